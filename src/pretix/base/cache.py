@@ -5,6 +5,8 @@ from typing import Callable, Dict, List
 from django.core.cache import caches
 from django.db.models import Model
 
+from pretix.helpers.metrics.instrumentation import timed_cache_call
+
 
 class NamespacedCache:
 
@@ -33,6 +35,7 @@ class NamespacedCache:
     def _strip_prefix(self, key: str) -> str:
         return key.split(":", 2 + self.prefixkey.count(":"))[-1]
 
+    @timed_cache_call
     def clear(self) -> None:
         self._last_prefix = None
         try:
@@ -41,12 +44,15 @@ class NamespacedCache:
             prefix = int(time.time())
             self.cache.set(self.prefixkey, prefix)
 
+    @timed_cache_call
     def set(self, key: str, value: str, timeout: int=300):
         return self.cache.set(self._prefix_key(key), value, timeout)
 
+    @timed_cache_call
     def get(self, key: str) -> str:
         return self.cache.get(self._prefix_key(key, known_prefix=self._last_prefix))
 
+    @timed_cache_call
     def get_or_set(self, key: str, default: Callable, timeout=300) -> str:
         return self.cache.get_or_set(
             self._prefix_key(key, known_prefix=self._last_prefix),
@@ -54,6 +60,7 @@ class NamespacedCache:
             timeout=timeout
         )
 
+    @timed_cache_call
     def get_many(self, keys: List[str]) -> Dict[str, str]:
         values = self.cache.get_many([self._prefix_key(key) for key in keys])
         newvalues = {}
@@ -61,21 +68,26 @@ class NamespacedCache:
             newvalues[self._strip_prefix(k)] = v
         return newvalues
 
+    @timed_cache_call
     def set_many(self, values: Dict[str, str], timeout=300):
         newvalues = {}
         for k, v in values.items():
             newvalues[self._prefix_key(k)] = v
         return self.cache.set_many(newvalues, timeout)
 
+    @timed_cache_call
     def delete(self, key: str):  # NOQA
         return self.cache.delete(self._prefix_key(key))
 
+    @timed_cache_call
     def delete_many(self, keys: List[str]):  # NOQA
         return self.cache.delete_many([self._prefix_key(key) for key in keys])
 
+    @timed_cache_call
     def incr(self, key: str, by: int=1):  # NOQA
         return self.cache.incr(self._prefix_key(key), by)
 
+    @timed_cache_call
     def decr(self, key: str, by: int=1):  # NOQA
         return self.cache.decr(self._prefix_key(key), by)
 
@@ -1,6 +1,12 @@
+import hashlib
 import logging
-from smtplib import SMTPRecipientsRefused, SMTPSenderRefused
+import os
+import threading
+import time
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPSenderRefused
 
+from celery.signals import worker_process_shutdown
+from django.conf import settings
 from django.core.mail.backends.smtp import EmailBackend
 
 logger = logging.getLogger('pretix.base.email')
@@ -24,3 +30,219 @@ class CustomSMTPBackend(EmailBackend):
                 raise SMTPRecipientsRefused(senderrs)
         finally:
             self.close()
+
+
+class PooledConnection:
+
+    def __init__(self, key, backend):
+        self.key = key
+        self.backend = backend
+        self.last_used = time.monotonic()
+        self.sent = 0
+
+    def alive(self):
+        try:
+            return self.backend.connection is not None and self.backend.connection.noop()[0] == 250
+        except (SMTPException, OSError):
+            return False
+
+    def close(self):
+        try:
+            self.backend.close()
+        except Exception:
+            logger.exception('Error closing a pooled SMTP connection')
+
+
+class MessageBatch:
+
+    def __init__(self):
+        self.messages = []
+        self.failed = []
+        self.closed = False
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class SMTPConnectionPool:
+    """
+    Keeps SMTP connections open between tasks of the same worker process, so we do not need a new
+    TCP connection, TLS handshake and login for every single email. Connections are pooled by the
+    configuration of the backend that asked for them, so events with a custom SMTP server get their
+    own connections. A connection is checked with a ``NOOP`` command if it has not been used for a
+    while, closed after a maximum number of messages and evicted once it has been idle for too long.
+
+    Backends other than Django's SMTP backend are not pooled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = {}
+        self._batches = {}
+        self._timer = None
+
+    def key(self, backend):
+        if not settings.MAIL_POOL or not isinstance(backend, EmailBackend):
+            return None
+        return (
+            '{}.{}'.format(type(backend).__module__, type(backend).__name__),
+            backend.host, backend.port, backend.username,
+            hashlib.sha1((backend.password or '').encode()).hexdigest(),
+            backend.use_tls, backend.use_ssl, backend.ssl_keyfile, backend.ssl_certfile, backend.timeout,
+        )
+
+    def _check_pid(self):
+        # Connections must never be shared between processes, e.g. after celery forked its workers
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def _checkout(self, key, backend):
+        self._check_pid()
+        self.evict()
+        with self._lock:
+            conns = self._idle.get(key)
+            conn = conns.pop() if conns else None
+        if conn and time.monotonic() - conn.last_used > settings.MAIL_POOL_KEEPALIVE and not conn.alive():
+            conn.close()
+            conn = None
+        if conn is None:
+            backend.open()
+            conn = PooledConnection(key, backend)
+        return conn
+
+    def _checkin(self, conn):
+        conn.last_used = time.monotonic()
+        if conn.sent >= settings.MAIL_POOL_MAX_MESSAGES:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.setdefault(conn.key, []).append(conn)
+            if self._timer is None:
+                self._timer = threading.Timer(settings.MAIL_POOL_IDLE_TIMEOUT, self._scheduled_evict)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _scheduled_evict(self):
+        with self._lock:
+            self._timer = None
+        self.evict()
+
+    def evict(self, max_idle=None):
+        """
+        Closes all connections that have not been used for ``max_idle`` seconds, by default
+        ``MAIL_POOL_IDLE_TIMEOUT``.
+        """
+        max_idle = settings.MAIL_POOL_IDLE_TIMEOUT if max_idle is None else max_idle
+        threshold = time.monotonic() - max_idle
+        evicted = []
+        with self._lock:
+            for key, conns in list(self._idle.items()):
+                evicted += [c for c in conns if c.last_used <= threshold]
+                conns[:] = [c for c in conns if c.last_used > threshold]
+                if not conns:
+                    del self._idle[key]
+        for conn in evicted:
+            conn.close()
+
+    def close_all(self):
+        if self._pid == os.getpid():
+            self.evict(max_idle=-1)
+
+    def _connect(self, key, backend):
+        if key is None:
+            backend.open()
+            return PooledConnection(None, backend)
+        return self._checkout(key, backend)
+
+    def _release(self, conn):
+        if conn.key is None:
+            conn.close()
+        else:
+            self._checkin(conn)
+
+    def send_messages(self, backend, messages):
+        """
+        Sends a list of messages one by one over the same connection, using a pooled connection if
+        possible. Returns the list of messages that could not be sent.
+
+        Django's ``send_messages`` stops at the first error, so we never hand it more than one message
+        at a time: a failing message must neither keep the following messages from being sent nor cause
+        the messages that have already been accepted by the server to be sent again.
+        """
+        key = self.key(backend)
+        failed = []
+        conn = None
+        for i, m in enumerate(messages):
+            if conn is None:
+                try:
+                    conn = self._connect(key, backend)
+                except Exception:
+                    logger.exception('Error connecting to the mail server')
+                    failed += messages[i:]
+                    break
+            try:
+                conn.backend.send_messages([m])
+            except Exception:
+                logger.exception('Error sending email')
+                failed.append(m)
+                # We do not know which state the connection is in now
+                conn.close()
+                conn = None
+                continue
+            conn.sent += 1
+            if key is not None and conn.sent >= settings.MAIL_POOL_MAX_MESSAGES:
+                self._release(conn)
+                conn = None
+        if conn is not None:
+            self._release(conn)
+        return failed
+
+    def send(self, backend, message):
+        """
+        Sends a single message and returns ``True`` on success. If ``MAIL_BATCH_WAIT`` is set, messages that
+        are sent for the same backend at the same time, e.g. by the tasks of a worker running with a
+        gevent or eventlet pool, are collected for up to this many seconds and sent together over one
+        connection.
+        """
+        key = self.key(backend)
+        if key is None or not settings.MAIL_BATCH_WAIT:
+            return not self.send_messages(backend, [message])
+
+        self._check_pid()
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._batches[key] = MessageBatch()
+            batch.messages.append(message)
+            if len(batch.messages) >= settings.MAIL_BATCH_SIZE:
+                batch.closed = True
+                del self._batches[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(settings.MAIL_BATCH_WAIT)
+            with self._lock:
+                if not batch.closed:
+                    batch.closed = True
+                    del self._batches[key]
+            try:
+                batch.failed = self.send_messages(backend, batch.messages)
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+        return not any(m is message for m in batch.failed)
+
+
+mail_pool = SMTPConnectionPool()
+
+
+@worker_process_shutdown.connect
+def close_mail_pool(**kwargs):
+    mail_pool.close_all()
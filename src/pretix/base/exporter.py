@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import Iterable, Tuple, Union
 
 
 class BaseExporter:
@@ -8,6 +8,8 @@ class BaseExporter:
 
     def __init__(self, event):
         self.event = event
+        # Replaced by the export task to report the progress of long exports, in percent
+        self.progress_callback = lambda value: None
 
     def __str__(self):
         return self.identifier
@@ -69,3 +71,16 @@ class BaseExporter:
         tasks.
         """
         raise NotImplementedError()  # NOQA
+
+    def render_stream(self, form_data: dict) -> Tuple[str, str, Iterable[Union[str, bytes]]]:
+        """
+        Render the exported file and return a tuple consisting of a filename, a file type
+        and an iterable that yields the file content in chunks of ``str`` or ``bytes``. The
+        export task writes these chunks to disk as they are generated, so you should override
+        this method instead of :py:meth:`render` if your export might become too large to
+        be kept in memory.
+
+        By default, this just returns the result of :py:meth:`render` as a single chunk.
+        """
+        filename, filetype, data = self.render(form_data)
+        return filename, filetype, [data]
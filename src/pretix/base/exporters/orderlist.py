@@ -12,6 +12,7 @@ from django.utils.translation import ugettext as _, ugettext_lazy
 
 from pretix.base.models import InvoiceAddress, Order, OrderPosition
 from pretix.base.models.orders import OrderFee
+from pretix.helpers.database import keyset_batches
 
 from ..exporter import BaseExporter
 from ..signals import register_data_exporters
@@ -51,9 +52,21 @@ class OrderListExporter(BaseExporter):
         return tax_rates
 
     def render(self, form_data: dict):
+        filename, filetype, chunks = self.render_stream(form_data)
+        return filename, filetype, b''.join(chunks)
+
+    def render_stream(self, form_data: dict):
+        return 'orders.csv', 'text/csv', self._stream(form_data)
+
+    def _csv_chunk(self, rows):
         output = io.StringIO()
-        tz = pytz.timezone(self.event.settings.timezone)
         writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC, delimiter=",")
+        for row in rows:
+            writer.writerow(row)
+        return output.getvalue().encode("utf-8")
+
+    def _stream(self, form_data: dict):
+        tz = pytz.timezone(self.event.settings.timezone)
 
         qs = self.event.orders.all().select_related('invoice_address').prefetch_related('invoices')
         if form_data['paid_only']:
@@ -75,31 +88,42 @@ class OrderListExporter(BaseExporter):
 
         headers.append(_('Invoice numbers'))
 
-        writer.writerow(headers)
+        yield self._csv_chunk([headers])
 
         provider_names = {
             k: v.verbose_name
             for k, v in self.event.get_payment_providers().items()
         }
 
+        total = qs.count()
+        done = 0
+        for batch in keyset_batches(qs, order_field='datetime'):
+            yield self._csv_chunk(self._rows(batch, tz, tax_rates, provider_names))
+            done += len(batch)
+            self.progress_callback(round(done * 100 / total))
+
+    def _rows(self, orders, tz, tax_rates, provider_names):
+        order_ids = [o.pk for o in orders]
         full_fee_sum_cache = {
             o['order__id']: o['grosssum'] for o in
-            OrderFee.objects.values('tax_rate', 'order__id').order_by().annotate(grosssum=Sum('value'))
+            OrderFee.objects.filter(order__id__in=order_ids).values('order__id').order_by().annotate(
+                grosssum=Sum('value')
+            )
         }
         fee_sum_cache = {
             (o['order__id'], o['tax_rate']): o for o in
-            OrderFee.objects.values('tax_rate', 'order__id').order_by().annotate(
+            OrderFee.objects.filter(order__id__in=order_ids).values('tax_rate', 'order__id').order_by().annotate(
                 taxsum=Sum('tax_value'), grosssum=Sum('value')
             )
         }
         sum_cache = {
             (o['order__id'], o['tax_rate']): o for o in
-            OrderPosition.objects.values('tax_rate', 'order__id').order_by().annotate(
+            OrderPosition.objects.filter(order__id__in=order_ids).values('tax_rate', 'order__id').order_by().annotate(
                 taxsum=Sum('tax_value'), grosssum=Sum('price')
             )
         }
 
-        for order in qs.order_by('datetime'):
+        for order in orders:
             row = [
                 order.code,
                 localize(order.total),
@@ -138,9 +162,7 @@ class OrderListExporter(BaseExporter):
                 ]
 
             row.append(', '.join([i.number for i in order.invoices.all()]))
-            writer.writerow(row)
-
-        return 'orders.csv', 'text/csv', output.getvalue().encode("utf-8")
+            yield row
 
 
 class QuotaListExporter(BaseExporter):
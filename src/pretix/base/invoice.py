@@ -1,10 +1,11 @@
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from decimal import Decimal
 from io import BytesIO
 from typing import Tuple
 
 import vat_moss.exchange_rates
 from django.contrib.staticfiles import finders
+from django.core.files import File
 from django.dispatch import receiver
 from django.utils.formats import date_format, localize
 from django.utils.translation import pgettext
@@ -25,6 +26,40 @@ from pretix.base.decimal import round_decimal
 from pretix.base.models import Event, Invoice
 from pretix.base.signals import register_invoice_renderers
 
+LOGO_CACHE_SIZE = 32
+
+_registered_fonts = set()
+_logo_cache = OrderedDict()
+
+
+def _register_font(name, path):
+    # reportlab keeps a process-wide registry of fonts, so every font file only needs to be loaded once
+    if name not in _registered_fonts:
+        pdfmetrics.registerFont(TTFont(name, finders.find(path)))
+        _registered_fonts.add(name)
+
+
+def _get_logo(event: Event):
+    """
+    Returns an ``ImageReader`` for the invoice logo of an event. The images are kept in memory in every
+    worker process for the most recently used logos. A new upload always gets a new file name, so the
+    file name is a safe cache key.
+    """
+    logo = event.settings.get('invoice_logo_image', as_type=File)
+    if not logo:
+        return None
+    name = logo.name
+    if name in _logo_cache:
+        _logo_cache.move_to_end(name)
+        return _logo_cache[name]
+    # We read the file right away instead of keeping it open, as the storage might be remote
+    with event.settings.get('invoice_logo_image', binary_file=True) as f:
+        reader = ImageReader(BytesIO(f.read()))
+    _logo_cache[name] = reader
+    while len(_logo_cache) > LOGO_CACHE_SIZE:
+        _logo_cache.popitem(last=False)
+    return reader
+
 
 class BaseInvoiceRenderer:
     """
@@ -78,8 +113,11 @@ class BaseReportlabInvoiceRenderer(BaseInvoiceRenderer):
     def _init(self):
         """
         Initialize the renderer. By default, this registers fonts and sets ``self.stylesheet``.
+        This is called for every invoice, but the stylesheet is only built for the first invoice
+        rendered by this renderer instance.
         """
-        self.stylesheet = self._get_stylesheet()
+        if getattr(self, 'stylesheet', None) is None:
+            self.stylesheet = self._get_stylesheet()
         self._register_fonts()
 
     def _get_stylesheet(self):
@@ -97,10 +135,10 @@ class BaseReportlabInvoiceRenderer(BaseInvoiceRenderer):
         """
         Register fonts with reportlab. By default, this registers the OpenSans font family
         """
-        pdfmetrics.registerFont(TTFont('OpenSans', finders.find('fonts/OpenSans-Regular.ttf')))
-        pdfmetrics.registerFont(TTFont('OpenSansIt', finders.find('fonts/OpenSans-Italic.ttf')))
-        pdfmetrics.registerFont(TTFont('OpenSansBd', finders.find('fonts/OpenSans-Bold.ttf')))
-        pdfmetrics.registerFont(TTFont('OpenSansBI', finders.find('fonts/OpenSans-BoldItalic.ttf')))
+        _register_font('OpenSans', 'fonts/OpenSans-Regular.ttf')
+        _register_font('OpenSansIt', 'fonts/OpenSans-Italic.ttf')
+        _register_font('OpenSansBd', 'fonts/OpenSans-Bold.ttf')
+        _register_font('OpenSansBI', 'fonts/OpenSans-BoldItalic.ttf')
         pdfmetrics.registerFontFamily('OpenSans', normal='OpenSans', bold='OpenSansBd',
                                       italic='OpenSansIt', boldItalic='OpenSansBI')
 
@@ -273,9 +311,9 @@ class ClassicInvoiceRenderer(BaseReportlabInvoiceRenderer):
 
         canvas.drawText(textobject)
 
-        if self.invoice.event.settings.invoice_logo_image:
-            logo_file = self.invoice.event.settings.get('invoice_logo_image', binary_file=True)
-            canvas.drawImage(ImageReader(logo_file),
+        logo = _get_logo(self.invoice.event)
+        if logo:
+            canvas.drawImage(logo,
                              95 * mm, (297 - 38) * mm,
                              width=25 * mm, height=25 * mm,
                              preserveAspectRatio=True, anchor='n',
@@ -0,0 +1,24 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pretix.helpers.profile.sampling import read_stacks
+
+
+class Command(BaseCommand):
+    help = "Print the stacks recorded by the sampling profiler in collapsed stack format"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--label', help='Only print the stacks of this URL name or celery:<task name>')
+        parser.add_argument('--clear', action='store_true', help='Delete all recorded stacks afterwards')
+
+    def handle(self, *args, **options):
+        if not os.path.exists(settings.PROFILE_DIR):
+            return
+        for stack, count in sorted(read_stacks(options.get('label')).items()):
+            self.stdout.write('{} {}'.format(stack, count))
+        if options.get('clear'):
+            for f in os.listdir(settings.PROFILE_DIR):
+                if f.startswith('stacks_') and f.endswith('.txt'):
+                    os.remove(os.path.join(settings.PROFILE_DIR, f))
@@ -1,12 +1,14 @@
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
-from ...signals import periodic_task
+from ...services.periodic import run_periodic_tasks
 
 
 class Command(BaseCommand):
     help = "Run periodic tasks"
 
     def handle(self, *args, **options):
-        periodic_task.send(self)
+        if run_periodic_tasks() is None:
+            self.stderr.write('Periodic tasks are already being run by another process, skipping.')
+            return
         call_command('clearsessions')
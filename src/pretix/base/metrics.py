@@ -1,16 +1,28 @@
+import atexit
+import logging
 import math
+import os
+import threading
+import time
 from collections import defaultdict
 
+from celery.signals import task_postrun, worker_process_shutdown
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import connection
+from django.dispatch import receiver
 
 if settings.HAS_REDIS:
     import django_redis
     redis = django_redis.get_redis_connection("redis")
 
+logger = logging.getLogger('pretix.base.metrics')
 REDIS_KEY = "pretix_metrics"
 _INF = float("inf")
 _MINUS_INF = float("-inf")
+ESTIMATE_MIN_ROWS = 10000
 
 
 def _float_to_go_string(d):
@@ -25,6 +37,73 @@ def _float_to_go_string(d):
         return repr(float(d))
 
 
+class MetricsBuffer:
+    """
+    Collects the updates of all metrics in the memory of the current process, so they can be written
+    to redis in a single pipeline instead of one round trip per update. The buffer is flushed once
+    ``METRICS_FLUSH_INTERVAL`` seconds have passed, which is checked after every request and task, as
+    well as before the metrics are served and when the process exits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._increments = defaultdict(float)
+        self._values = {}
+        self._last_flush = time.monotonic()
+
+    def _check_pid(self):
+        # Updates collected by a parent process must not be flushed again by its forked children
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, key, amount):
+        with self._lock:
+            self._check_pid()
+            if key in self._values:
+                self._values[key] += amount
+            else:
+                self._increments[key] += amount
+
+    def set(self, key, value):
+        with self._lock:
+            self._check_pid()
+            self._increments.pop(key, None)
+            self._values[key] = value
+
+    def flush(self):
+        """
+        Writes all collected updates to redis.
+        """
+        with self._lock:
+            self._check_pid()
+            increments, values = self._increments, self._values
+            self._increments, self._values = defaultdict(float), {}
+            self._last_flush = time.monotonic()
+
+        if not settings.HAS_REDIS or not (increments or values):
+            return
+        pipe = redis.pipeline()
+        for key, amount in increments.items():
+            pipe.hincrbyfloat(REDIS_KEY, key, amount)
+        for key, value in values.items():
+            pipe.hset(REDIS_KEY, key, value)
+        try:
+            pipe.execute()
+        except Exception:
+            logger.exception('Could not write metrics to redis')
+
+    def flush_if_due(self):
+        if time.monotonic() - self._last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+
+buffer = MetricsBuffer()
+
+
 class Metric(object):
     """
     Base Metrics Object
@@ -65,31 +144,24 @@ class Metric(object):
 
             return metricname + "{" + ",".join(named_labels) + "}"
 
-    def _inc_in_redis(self, key, amount, pipeline=None):
+    def _inc(self, key, amount):
         """
-        Increments given key in Redis.
+        Increments given key in the buffer.
         """
         if settings.HAS_REDIS:
-            if not pipeline:
-                pipeline = redis
-            pipeline.hincrbyfloat(REDIS_KEY, key, amount)
+            buffer.inc(key, amount)
 
-    def _set_in_redis(self, key, value, pipeline=None):
+    def _set(self, key, value):
         """
-        Sets given key in Redis.
+        Sets given key in the buffer.
         """
         if settings.HAS_REDIS:
-            if not pipeline:
-                pipeline = redis
-            pipeline.hset(REDIS_KEY, key, value)
-
-    def _get_redis_pipeline(self):
-        if settings.HAS_REDIS:
-            return redis.pipeline()
+            buffer.set(key, value)
 
-    def _execute_redis_pipeline(self, pipeline):
-        if settings.HAS_REDIS:
-            return pipeline.execute()
+    def _updated(self):
+        # Without a flush interval, every update is written to redis right away
+        if not settings.METRICS_FLUSH_INTERVAL:
+            buffer.flush()
 
 
 class Counter(Metric):
@@ -109,7 +181,8 @@ class Counter(Metric):
         self._check_label_consistency(kwargs)
 
         fullmetric = self._construct_metric_identifier(self.name, kwargs)
-        self._inc_in_redis(fullmetric, amount)
+        self._inc(fullmetric, amount)
+        self._updated()
 
 
 class Gauge(Metric):
@@ -125,7 +198,8 @@ class Gauge(Metric):
         self._check_label_consistency(kwargs)
 
         fullmetric = self._construct_metric_identifier(self.name, kwargs)
-        self._set_in_redis(fullmetric, value)
+        self._set(fullmetric, value)
+        self._updated()
 
     def inc(self, amount=1, **kwargs):
         """
@@ -137,7 +211,8 @@ class Gauge(Metric):
         self._check_label_consistency(kwargs)
 
         fullmetric = self._construct_metric_identifier(self.name, kwargs)
-        self._inc_in_redis(fullmetric, amount)
+        self._inc(fullmetric, amount)
+        self._updated()
 
     def dec(self, amount=1, **kwargs):
         """
@@ -149,7 +224,8 @@ class Gauge(Metric):
         self._check_label_consistency(kwargs)
 
         fullmetric = self._construct_metric_identifier(self.name, kwargs)
-        self._inc_in_redis(fullmetric, amount * -1)
+        self._inc(fullmetric, amount * -1)
+        self._updated()
 
 
 class Histogram(Metric):
@@ -182,13 +258,11 @@ class Histogram(Metric):
 
         self._check_label_consistency(kwargs)
 
-        pipe = self._get_redis_pipeline()
-
         countmetric = self._construct_metric_identifier(self.name + '_count', kwargs)
-        self._inc_in_redis(countmetric, 1, pipeline=pipe)
+        self._inc(countmetric, 1)
 
         summetric = self._construct_metric_identifier(self.name + '_sum', kwargs)
-        self._inc_in_redis(summetric, amount, pipeline=pipe)
+        self._inc(summetric, amount)
 
         kwargs_le = dict(kwargs.items())
         for i, bound in enumerate(self.buckets):
@@ -196,9 +270,9 @@ class Histogram(Metric):
                 kwargs_le['le'] = _float_to_go_string(bound)
                 bmetric = self._construct_metric_identifier(self.name + '_bucket', kwargs_le,
                                                             labelnames=self.labelnames + ["le"])
-                self._inc_in_redis(bmetric, 1, pipeline=pipe)
+                self._inc(bmetric, 1)
 
-        self._execute_redis_pipeline(pipe)
+        self._updated()
 
 
 def metric_values():
@@ -209,6 +283,7 @@ def metric_values():
 
     # Metrics from redis
     if settings.HAS_REDIS:
+        buffer.flush()
         for key, value in redis.hscan_iter(REDIS_KEY):
             dkey = key.decode("utf-8")
             splitted = dkey.split("{", 2)
@@ -223,12 +298,79 @@ def metric_values():
         metrics[a] = metrics[atarget]
 
     # Throwaway metrics
-    for m in apps.get_models():  # Count all models
-        metrics['pretix_model_instances']['{model="%s"}' % m._meta] = m.objects.count()
+    for model, count in model_counts().items():
+        metrics['pretix_model_instances']['{model="%s"}' % model] = count
 
     return metrics
 
 
+def _estimated_table_sizes(tables):
+    """
+    Returns the number of rows of the given tables as estimated by the database, without scanning them.
+    Tables the database has no estimate for are missing from the result.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relname IN %s "
+                "AND pg_table_is_visible(oid)",
+                (tuple(tables),)
+            )
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT table_name, table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name IN %s",
+                (tuple(tables),)
+            )
+        else:
+            return {}
+        return {name: int(rows) for name, rows in cursor.fetchall() if rows is not None and rows >= 0}
+
+
+def _count_models():
+    models = [m for m in apps.get_models() if m._meta.managed]
+    estimates = {}
+    if settings.METRICS_MODEL_COUNTS == 'estimated':
+        estimates = _estimated_table_sizes({m._meta.db_table for m in models})
+    return {
+        str(m._meta): (
+            estimates[m._meta.db_table] if estimates.get(m._meta.db_table, 0) >= ESTIMATE_MIN_ROWS
+            else m.objects.count()
+        )
+        for m in models
+    }
+
+
+def model_counts():
+    """
+    Returns the number of instances of every model, either counted exactly or estimated from the statistics
+    of the database, depending on the ``METRICS_MODEL_COUNTS`` setting. Estimates are only available on
+    PostgreSQL and MySQL, all other databases are always counted exactly. Tables with an estimate below
+    ``ESTIMATE_MIN_ROWS`` are counted exactly as well, as they are cheap to count and the estimates of
+    small or new tables, which might never have been analyzed, are often far off. The result is cached for
+    ``METRICS_MODEL_COUNTS_CACHE`` seconds, so frequent scrapes do not cause additional database load.
+    """
+    if settings.METRICS_MODEL_COUNTS == 'off':
+        return {}
+    if not settings.METRICS_MODEL_COUNTS_CACHE:
+        return _count_models()
+    return cache.get_or_set('pretix_metrics_model_counts', _count_models, settings.METRICS_MODEL_COUNTS_CACHE)
+
+
+@receiver(request_finished)
+@task_postrun.connect
+def flush_metrics(**kwargs):
+    buffer.flush_if_due()
+
+
+@worker_process_shutdown.connect
+def flush_metrics_on_shutdown(**kwargs):
+    buffer.flush()
+
+
+atexit.register(buffer.flush)
+
+
 """
 Provided metrics
 """
@@ -238,3 +380,28 @@ pretix_task_runs_total = Counter("pretix_task_runs_total", "Total calls to a cel
                                  ["task_name", "status"])
 pretix_task_duration_seconds = Histogram("pretix_task_duration_seconds", "Call time of a celery task",
                                          ["task_name"])
+pretix_lock_wait_seconds = Histogram("pretix_lock_wait_seconds", "Time spent waiting for a booking lock",
+                                     ["lock_type"])
+pretix_lock_hold_seconds = Histogram("pretix_lock_hold_seconds", "Time a booking lock has been held",
+                                     ["lock_type"])
+pretix_lock_timeouts_total = Counter("pretix_lock_timeouts_total", "Total number of failed attempts to obtain "
+                                     "a booking lock", ["lock_type"])
+pretix_view_db_queries = Histogram("pretix_view_db_queries", "Database queries per request",
+                                   ["url_name"], buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+pretix_view_db_seconds = Histogram("pretix_view_db_seconds", "Time spent on database queries per request",
+                                   ["url_name"])
+pretix_view_cache_calls = Histogram("pretix_view_cache_calls", "Cache calls per request",
+                                    ["url_name"], buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+pretix_view_cache_seconds = Histogram("pretix_view_cache_seconds", "Time spent on cache calls per request",
+                                      ["url_name"])
+pretix_view_lock_seconds = Histogram("pretix_view_lock_seconds", "Time spent waiting for locks per request",
+                                     ["url_name"])
+pretix_view_signal_seconds = Histogram("pretix_view_signal_seconds", "Time spent in plugin signals per request",
+                                       ["url_name"])
+pretix_invoice_render_seconds = Histogram("pretix_invoice_render_seconds", "Time spent rendering an invoice PDF",
+                                          ["renderer"])
+pretix_periodic_task_runs_total = Counter("pretix_periodic_task_runs_total", "Total runs of a periodic task",
+                                          ["task_name", "status"])
+pretix_periodic_task_duration_seconds = Histogram("pretix_periodic_task_duration_seconds",
+                                                  "Run time of a periodic task", ["task_name"],
+                                                  buckets=[.1, .5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0])
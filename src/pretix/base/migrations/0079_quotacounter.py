@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-16 20:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretixbase', '0078_auto_20171206_1603'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paid_orders', models.IntegerField(default=0)),
+                ('pending_orders', models.IntegerField(default=0)),
+                ('waitinglist', models.IntegerField(default=0)),
+                ('reconciled', models.DateTimeField(blank=True, null=True)),
+                ('quota', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='counter', to='pretixbase.Quota')),
+            ],
+        ),
+    ]
@@ -113,3 +113,15 @@ class Checkin(models.Model):
         return "<Checkin: pos {} on list '{}' at {}>".format(
             self.position, self.list, self.datetime
         )
+
+    def save(self, *args, **kwargs):
+        from .orders import OrderPosition
+
+        super().save(*args, **kwargs)
+        OrderPosition.objects.filter(pk=self.position_id).update(last_modified=now())
+
+    def delete(self, *args, **kwargs):
+        from .orders import OrderPosition
+
+        super().delete(*args, **kwargs)
+        OrderPosition.objects.filter(pk=self.position_id).update(last_modified=now())
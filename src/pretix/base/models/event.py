@@ -299,13 +299,19 @@ class Event(EventMixin, LoggedModel):
 
         return ObjectRelatedCache(self)
 
-    def lock(self):
+    def lock(self, quotas=None):
         """
         Returns a contextmanager that can be used to lock an event for bookings.
+
+        :param quotas: If you know the set of quotas affected by your operation, you can pass
+                       them here. If quota locking is enabled in the configuration file, only
+                       these quotas are locked instead of the whole event. You can also pass a
+                       function that returns the quotas, which is only called if quota locking
+                       is enabled.
         """
         from pretix.base.services import locking
 
-        return locking.LockManager(self)
+        return locking.LockManager(self, quotas=quotas)
 
     def get_mail_backend(self, force_custom=False):
         """
@@ -1,13 +1,16 @@
 import sys
 import uuid
+from collections import Counter, defaultdict
 from datetime import datetime
 from decimal import Decimal
-from typing import Tuple
+from typing import Dict, Tuple
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import F, Func, Q, Sum
+from django.db.models import Count, F, Func, Q, Sum
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
 from django.utils.functional import cached_property
 from django.utils.timezone import now
 from django.utils.translation import pgettext_lazy, ugettext_lazy as _
@@ -638,6 +641,215 @@ class QuestionOption(models.Model):
         return str(self.answer)
 
 
+class QuotaManager(models.Manager):
+
+    def compute_availability(self, quotas, now_dt: datetime=None,
+                             count_waitinglist=True) -> Dict[int, Tuple[int, int]]:
+        """
+        Computes the availability of many quotas at once. While :py:meth:`Quota.availability`
+        runs up to five queries per quota, this runs a constant number of grouped queries
+        regardless of the number of quotas passed. The result is neither read from nor
+        written to the cached availability fields of the quotas.
+
+        :param quotas: An iterable of :py:class:`Quota` objects
+        :param now_dt: The point in time to compute the availability for
+        :param count_waitinglist: If ``False``, waiting list entries will be ignored.
+        :returns: A dictionary mapping quota IDs to tuples as returned by :py:meth:`Quota.availability`.
+        """
+        quotas = [q for q in quotas]
+        result = {
+            q.pk: (Quota.AVAILABILITY_OK, None) for q in quotas if q.size is None
+        }
+        quotas = [q for q in quotas if q.size is not None]
+        if not quotas:
+            return result
+
+        counters = self.compute_counters(quotas, now_dt=now_dt, count_waitinglist=count_waitinglist)
+        for q in quotas:
+            result[q.pk] = Quota.availability_from_counts(q.size, count_waitinglist=count_waitinglist,
+                                                          **counters[q.pk])
+        return result
+
+    def compute_counters(self, quotas, now_dt: datetime=None, count_waitinglist=True,
+                         use_counters=True) -> Dict[int, Dict[str, int]]:
+        """
+        Counts the paid and pending order positions, blocking vouchers, cart positions and
+        waiting list entries for many quotas in a constant number of grouped queries.
+
+        If incrementally maintained quota counters are enabled and ``use_counters`` is set,
+        the paid, pending and waiting list numbers are taken from :py:class:`QuotaCounter`
+        wherever one exists.
+
+        :returns: A dictionary mapping quota IDs to dictionaries with the keys ``paid``,
+                  ``pending``, ``vouchers``, ``cart`` and ``waitinglist``.
+        """
+        from pretix.base.models import (
+            CartPosition, Order, OrderPosition, Voucher, WaitingListEntry,
+        )
+
+        now_dt = now_dt or now()
+        quota_subevents = {q.pk: q.subevent_id for q in quotas}
+        event_ids = {q.event_id for q in quotas}
+        counters = {
+            q.pk: {'paid': 0, 'pending': 0, 'vouchers': 0, 'cart': 0, 'waitinglist': 0} for q in quotas
+        }
+        if not quotas:
+            return counters
+
+        counted = set()
+        if use_counters and settings.PRETIX_QUOTA_COUNTERS:
+            for c in QuotaCounter.objects.filter(quota_id__in=quota_subevents.keys(), reconciled__isnull=False):
+                counters[c.quota_id].update(paid=c.paid_orders, pending=c.pending_orders,
+                                            waitinglist=c.waitinglist)
+                counted.add(c.quota_id)
+        uncounted = set(quota_subevents.keys()) - counted
+
+        item_quotas = defaultdict(set)
+        for quota_id, item_id in Quota.items.through.objects.filter(
+                quota_id__in=quota_subevents.keys()
+        ).values_list('quota_id', 'item_id'):
+            item_quotas[item_id].add(quota_id)
+
+        variation_quotas = defaultdict(set)
+        for quota_id, variation_id in Quota.variations.through.objects.filter(
+                quota_id__in=quota_subevents.keys()
+        ).values_list('quota_id', 'itemvariation_id'):
+            variation_quotas[variation_id].add(quota_id)
+
+        position_lookup = (
+            Q(variation__isnull=True, item_id__in=item_quotas.keys())
+            | Q(variation_id__in=variation_quotas.keys())
+        )
+        subevent_ids = {s for s in quota_subevents.values() if s is not None}
+        subevent_lookup = Q(subevent_id__in=subevent_ids)
+        if None in quota_subevents.values():
+            subevent_lookup |= Q(subevent__isnull=True)
+
+        def _matching_quotas(row, quota_id=None, only=None):
+            if row['variation'] is None:
+                candidates = set(item_quotas.get(row['item'], set()))
+            else:
+                candidates = set(variation_quotas.get(row['variation'], set()))
+            if quota_id is not None and quota_id in quota_subevents:
+                candidates.add(quota_id)
+            if only is not None:
+                candidates &= only
+            return [qid for qid in candidates if quota_subevents[qid] == row['subevent']]
+
+        if uncounted:
+            order_counts = OrderPosition.objects.filter(
+                position_lookup & subevent_lookup,
+                order__event_id__in=event_ids,
+                order__status__in=(Order.STATUS_PAID, Order.STATUS_PENDING),
+            ).order_by().values('order__status', 'item', 'variation', 'subevent').annotate(c=Count('id'))
+            for row in order_counts:
+                key = 'paid' if row['order__status'] == Order.STATUS_PAID else 'pending'
+                for qid in _matching_quotas(row, only=uncounted):
+                    counters[qid][key] += row['c']
+
+        if 'sqlite3' in settings.DATABASES['default']['ENGINE']:
+            func = 'MAX'
+        else:  # NOQA
+            func = 'GREATEST'
+        voucher_counts = Voucher.objects.filter(
+            Q(position_lookup | Q(quota_id__in=quota_subevents.keys())) & subevent_lookup,
+            Q(valid_until__isnull=True) | Q(valid_until__gte=now_dt),
+            event_id__in=event_ids,
+            block_quota=True,
+        ).order_by().values('item', 'variation', 'quota', 'subevent').annotate(
+            free=Sum(Func(F('max_usages') - F('redeemed'), 0, function=func))
+        )
+        for row in voucher_counts:
+            for qid in _matching_quotas(row, row['quota']):
+                counters[qid]['vouchers'] += row['free'] or 0
+
+        cart_counts = CartPosition.objects.filter(
+            position_lookup & subevent_lookup,
+            event_id__in=event_ids,
+            expires__gte=now_dt,
+        ).exclude(
+            Q(voucher__isnull=False) & Q(voucher__block_quota=True)
+            & Q(Q(voucher__valid_until__isnull=True) | Q(voucher__valid_until__gte=now_dt))
+        ).order_by().values('item', 'variation', 'subevent').annotate(c=Count('id'))
+        for row in cart_counts:
+            for qid in _matching_quotas(row):
+                counters[qid]['cart'] += row['c']
+
+        if count_waitinglist and uncounted:
+            waitinglist_counts = WaitingListEntry.objects.filter(
+                position_lookup & subevent_lookup,
+                voucher__isnull=True,
+            ).order_by().values('item', 'variation', 'subevent').annotate(c=Count('id'))
+            for row in waitinglist_counts:
+                for qid in _matching_quotas(row, only=uncounted):
+                    counters[qid]['waitinglist'] += row['c']
+
+        return counters
+
+    def apply_counter_deltas(self, deltas: Dict[Tuple[str, int, int, int], int]):
+        """
+        Applies changes to the incrementally maintained :py:class:`QuotaCounter` objects of all
+        quotas affected by a change in positions or waiting list entries. This should be called
+        in the same transaction as the change itself. Quotas without an initialized counter are
+        left alone.
+
+        :param deltas: A dictionary mapping tuples of ``(counter, item_id, variation_id, subevent_id)``
+                       to the number that should be added to the counter. ``counter`` is one of
+                       ``paid``, ``pending`` and ``waitinglist``.
+        """
+        deltas = {k: v for k, v in deltas.items() if v and k[0] is not None}
+        if not settings.PRETIX_QUOTA_COUNTERS or not deltas:
+            return
+
+        item_quotas = defaultdict(set)
+        for quota_id, item_id, subevent_id in Quota.items.through.objects.filter(
+                item_id__in={k[1] for k in deltas if k[2] is None}
+        ).values_list('quota_id', 'item_id', 'quota__subevent_id'):
+            item_quotas[item_id, subevent_id].add(quota_id)
+
+        variation_quotas = defaultdict(set)
+        for quota_id, variation_id, subevent_id in Quota.variations.through.objects.filter(
+                itemvariation_id__in={k[2] for k in deltas if k[2] is not None}
+        ).values_list('quota_id', 'itemvariation_id', 'quota__subevent_id'):
+            variation_quotas[variation_id, subevent_id].add(quota_id)
+
+        quota_deltas = Counter()
+        for (counter, item_id, variation_id, subevent_id), delta in deltas.items():
+            if variation_id is None:
+                affected = item_quotas.get((item_id, subevent_id), set())
+            else:
+                affected = variation_quotas.get((variation_id, subevent_id), set())
+            for qid in affected:
+                quota_deltas[qid, QuotaCounter.FIELDS[counter]] += delta
+
+        for (qid, field), delta in sorted(quota_deltas.items()):
+            if delta:
+                QuotaCounter.objects.filter(quota_id=qid).update(**{field: F(field) + delta})
+
+    def reset_counters(self, quotas):
+        """
+        Discards the incrementally maintained counters of the given quotas, e.g. because the
+        set of products they apply to changed. They will be counted from scratch until the
+        counters are rebuilt by the next reconciliation run.
+        """
+        QuotaCounter.objects.filter(quota__in=quotas).delete()
+
+    def for_positions(self, positions):
+        """
+        Returns all quotas that apply to at least one of the given cart or order positions
+        in a single query.
+        """
+        lookup = Q()
+        for item_id, variation_id, subevent_id in {(p.item_id, p.variation_id, p.subevent_id) for p in positions}:
+            if variation_id is None:
+                lookup |= Q(items__id=item_id, subevent_id=subevent_id)
+            else:
+                lookup |= Q(variations__id=variation_id, subevent_id=subevent_id)
+        if not lookup:
+            return self.none()
+        return self.filter(lookup).distinct()
+
+
 class Quota(LoggedModel):
     """
     A quota is a "pool of tickets". It is there to limit the number of items
@@ -730,6 +942,8 @@ class Quota(LoggedModel):
     cached_availability_paid_orders = models.PositiveIntegerField(null=True, blank=True)
     cached_availability_time = models.DateTimeField(null=True, blank=True)
 
+    objects = QuotaManager()
+
     class Meta:
         verbose_name = _("Quota")
         verbose_name_plural = _("Quotas")
@@ -742,9 +956,28 @@ class Quota(LoggedModel):
         if self.event:
             self.event.cache.clear()
 
+    @property
+    def _counter_key(self):
+        return self.__dict__.get('subevent_id'), self.__dict__.get('size')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counter_key_at_load = instance._counter_key
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._counter_key_at_load = self._counter_key
+
     def save(self, *args, **kwargs):
         clear_cache = kwargs.pop('clear_cache', True)
+        old_key = getattr(self, '_counter_key_at_load', None) if self.pk else None
         super().save(*args, **kwargs)
+        # Changes to the products are handled by quota_products_changed
+        if settings.PRETIX_QUOTA_COUNTERS and old_key and old_key != self._counter_key:
+            Quota.objects.reset_counters([self.pk])
+        self._counter_key_at_load = self._counter_key
         if self.event and clear_cache:
             self.event.cache.clear()
 
@@ -779,7 +1012,6 @@ class Quota(LoggedModel):
         now_dt = now_dt or now()
         res = self._availability(now_dt, count_waitinglist)
 
-        self.event.cache.delete('item_quota_cache')
         if count_waitinglist and not self.cache_is_hot(now_dt):
             self.cached_availability_state = res[0]
             self.cached_availability_number = res[1]
@@ -805,13 +1037,17 @@ class Quota(LoggedModel):
         if size_left is None:
             return Quota.AVAILABILITY_OK, None
 
-        paid_orders = self.count_paid_orders()
+        counter = None
+        if settings.PRETIX_QUOTA_COUNTERS:
+            counter = QuotaCounter.objects.filter(quota=self, reconciled__isnull=False).first()
+
+        paid_orders = counter.paid_orders if counter else self.count_paid_orders()
         self.cached_availability_paid_orders = paid_orders
         size_left -= paid_orders
         if size_left <= 0:
             return Quota.AVAILABILITY_GONE, 0
 
-        size_left -= self.count_pending_orders()
+        size_left -= counter.pending_orders if counter else self.count_pending_orders()
         if size_left <= 0:
             return Quota.AVAILABILITY_ORDERED, 0
 
@@ -824,12 +1060,36 @@ class Quota(LoggedModel):
             return Quota.AVAILABILITY_RESERVED, 0
 
         if count_waitinglist:
-            size_left -= self.count_waiting_list_pending()
+            size_left -= counter.waitinglist if counter else self.count_waiting_list_pending()
             if size_left <= 0:
                 return Quota.AVAILABILITY_RESERVED, 0
 
         return Quota.AVAILABILITY_OK, size_left
 
+    @staticmethod
+    def availability_from_counts(size: int, paid=0, pending=0, vouchers=0, cart=0, waitinglist=0,
+                                 count_waitinglist=True) -> Tuple[int, int]:
+        """
+        Derives an availability tuple from precomputed counters in the same order of precedence
+        that :py:meth:`availability` applies.
+        """
+        if size is None:
+            return Quota.AVAILABILITY_OK, None
+        size_left = size - paid
+        if size_left <= 0:
+            return Quota.AVAILABILITY_GONE, 0
+        size_left -= pending
+        if size_left <= 0:
+            return Quota.AVAILABILITY_ORDERED, 0
+        size_left -= vouchers + cart
+        if size_left <= 0:
+            return Quota.AVAILABILITY_RESERVED, 0
+        if count_waitinglist:
+            size_left -= waitinglist
+            if size_left <= 0:
+                return Quota.AVAILABILITY_RESERVED, 0
+        return Quota.AVAILABILITY_OK, size_left
+
     def count_blocking_vouchers(self, now_dt: datetime=None) -> int:
         from pretix.base.models import Voucher
 
@@ -924,3 +1184,59 @@ class Quota(LoggedModel):
         else:
             if subevent:
                 raise ValidationError(_('The subevent does not belong to this event.'))
+
+
+class QuotaCounter(models.Model):
+    """
+    Holds incrementally maintained counters for a quota. These are only used if the
+    ``quota_counters`` option is turned on in the configuration file. In this case, every
+    change to the status of an order, to the product of an order position or to a waiting
+    list entry applies a delta to the counters of the affected quotas in the same
+    transaction, which turns the most expensive parts of :py:meth:`Quota.availability`
+    into a single lookup. Blocking vouchers and cart positions depend on the current time
+    and are therefore still counted on every read. A periodic task reconciles the counters
+    with the actual data to fix any drift.
+
+    :param quota: The quota this belongs to
+    :type quota: Quota
+    :param paid_orders: The number of positions in paid orders
+    :type paid_orders: int
+    :param pending_orders: The number of positions in pending orders
+    :type pending_orders: int
+    :param waitinglist: The number of waiting list entries without an assigned voucher
+    :type waitinglist: int
+    :param reconciled: The last time the counters were compared to the actual data
+    :type reconciled: datetime
+    """
+    FIELDS = {
+        'paid': 'paid_orders',
+        'pending': 'pending_orders',
+        'waitinglist': 'waitinglist',
+    }
+
+    quota = models.OneToOneField(
+        Quota,
+        on_delete=models.CASCADE,
+        related_name='counter',
+    )
+    paid_orders = models.IntegerField(default=0)
+    pending_orders = models.IntegerField(default=0)
+    waitinglist = models.IntegerField(default=0)
+    reconciled = models.DateTimeField(null=True, blank=True)
+
+
+@receiver(m2m_changed, sender=Quota.items.through)
+@receiver(m2m_changed, sender=Quota.variations.through)
+def quota_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    event = instance.item.event if isinstance(instance, ItemVariation) else instance.event
+    event.cache.clear()
+    if not settings.PRETIX_QUOTA_COUNTERS:
+        return
+    if not reverse:
+        Quota.objects.reset_counters([instance.pk])
+    elif pk_set:
+        Quota.objects.reset_counters(pk_set)
+    else:
+        Quota.objects.reset_counters(instance.quotas.all())
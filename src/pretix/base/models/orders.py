@@ -2,14 +2,15 @@ import copy
 import json
 import os
 import string
+from collections import Counter
 from datetime import datetime, time
 from decimal import Decimal
 from typing import Any, Dict, List, Union
 
 import pytz
 from django.conf import settings
-from django.db import models
-from django.db.models import F, Sum
+from django.db import models, transaction
+from django.db.models import Count, F, Sum
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
 from django.urls import reverse
@@ -102,6 +103,10 @@ class Order(LoggedModel):
         (STATUS_CANCELED, _("canceled")),
         (STATUS_REFUNDED, _("refunded"))
     )
+    QUOTA_COUNTERS = {
+        STATUS_PAID: 'paid',
+        STATUS_PENDING: 'pending',
+    }
 
     code = models.CharField(
         max_length=16,
@@ -171,6 +176,9 @@ class Order(LoggedModel):
         verbose_name=_("Meta information"),
         null=True, blank=True
     )
+    last_modified = models.DateTimeField(
+        auto_now=True, db_index=True
+    )
 
     class Meta:
         verbose_name = _("Order")
@@ -196,12 +204,36 @@ class Order(LoggedModel):
     def changable(self):
         return self.status in (Order.STATUS_PAID, Order.STATUS_PENDING)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._status_at_load = instance.__dict__.get('status')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if fields is None or 'status' in fields:
+            self._status_at_load = self.__dict__.get('status')
+
     def save(self, *args, **kwargs):
         if not self.code:
             self.assign_code()
         if not self.datetime:
             self.datetime = now()
-        super().save(*args, **kwargs)
+        old_status = getattr(self, '_status_at_load', None)
+        update_fields = kwargs.get('update_fields')
+        if settings.PRETIX_QUOTA_COUNTERS and old_status and old_status != self.status and (
+                update_fields is None or 'status' in update_fields):
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                deltas = Counter()
+                for p in self.positions.order_by().values('item', 'variation', 'subevent').annotate(c=Count('id')):
+                    deltas[Order.QUOTA_COUNTERS.get(old_status), p['item'], p['variation'], p['subevent']] -= p['c']
+                    deltas[Order.QUOTA_COUNTERS.get(self.status), p['item'], p['variation'], p['subevent']] += p['c']
+                Quota.objects.apply_counter_deltas(deltas)
+        else:
+            super().save(*args, **kwargs)
+        self._status_at_load = self.status
 
     @cached_property
     def tax_total(self):
@@ -731,6 +763,9 @@ class OrderPosition(AbstractPosition):
         verbose_name=_('Tax value')
     )
     secret = models.CharField(max_length=64, default=generate_position_secret, db_index=True)
+    last_modified = models.DateTimeField(
+        auto_now=True, db_index=True
+    )
 
     class Meta:
         verbose_name = _("Order position")
@@ -805,13 +840,50 @@ class OrderPosition(AbstractPosition):
             self.tax_value = Decimal('0.00')
             self.tax_rate = Decimal('0.00')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._quota_key_at_load = instance._quota_key
+        return instance
+
+    @property
+    def _quota_key(self):
+        return self.__dict__.get('item_id'), self.__dict__.get('variation_id'), self.__dict__.get('subevent_id')
+
     def save(self, *args, **kwargs):
         if self.tax_rate is None:
             self._calculate_tax()
         if self.pk is None:
             while OrderPosition.objects.filter(secret=self.secret).exists():
                 self.secret = generate_position_secret()
-        return super().save(*args, **kwargs)
+        if not settings.PRETIX_QUOTA_COUNTERS:
+            return super().save(*args, **kwargs)
+
+        old_key = getattr(self, '_quota_key_at_load', None) if self.pk else None
+        counter = Order.QUOTA_COUNTERS.get(self.order.status)
+        with transaction.atomic():
+            ret = super().save(*args, **kwargs)
+            if old_key != self._quota_key:
+                deltas = Counter()
+                deltas[(counter,) + self._quota_key] += 1
+                if old_key:
+                    deltas[(counter,) + old_key] -= 1
+                Quota.objects.apply_counter_deltas(deltas)
+        self._quota_key_at_load = self._quota_key
+        return ret
+
+    def delete(self, *args, **kwargs):
+        # Deleted positions cannot be found by a delta sync, so we mark their order as modified instead
+        Order.objects.filter(pk=self.order_id).update(last_modified=now())
+        if not settings.PRETIX_QUOTA_COUNTERS:
+            return super().delete(*args, **kwargs)
+
+        counter = Order.QUOTA_COUNTERS.get(self.order.status)
+        key = getattr(self, '_quota_key_at_load', self._quota_key)
+        with transaction.atomic():
+            ret = super().delete(*args, **kwargs)
+            Quota.objects.apply_counter_deltas({(counter,) + key: -1})
+        return ret
 
 
 class CartPosition(AbstractPosition):
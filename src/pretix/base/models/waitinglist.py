@@ -1,5 +1,7 @@
+from collections import Counter
 from datetime import timedelta
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models, transaction
 from django.utils.timezone import now
@@ -12,7 +14,7 @@ from pretix.multidomain.urlreverse import build_absolute_uri
 
 from .base import LoggedModel
 from .event import Event, SubEvent
-from .items import Item, ItemVariation
+from .items import Item, ItemVariation, Quota
 
 
 class WaitingListException(Exception):
@@ -72,6 +74,47 @@ class WaitingListEntry(LoggedModel):
     def __str__(self):
         return '%s waits for %s' % (str(self.email), str(self.item))
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._quota_key_at_load = instance._quota_key
+        return instance
+
+    @property
+    def _quota_key(self):
+        # Only entries that did not yet receive a voucher count towards the quota
+        if self.__dict__.get('voucher_id') is not None:
+            return None
+        return self.__dict__.get('item_id'), self.__dict__.get('variation_id'), self.__dict__.get('subevent_id')
+
+    def save(self, *args, **kwargs):
+        if not settings.PRETIX_QUOTA_COUNTERS:
+            return super().save(*args, **kwargs)
+
+        old_key = getattr(self, '_quota_key_at_load', None) if self.pk else None
+        with transaction.atomic():
+            ret = super().save(*args, **kwargs)
+            if old_key != self._quota_key:
+                deltas = Counter()
+                if self._quota_key:
+                    deltas[('waitinglist',) + self._quota_key] += 1
+                if old_key:
+                    deltas[('waitinglist',) + old_key] -= 1
+                Quota.objects.apply_counter_deltas(deltas)
+        self._quota_key_at_load = self._quota_key
+        return ret
+
+    def delete(self, *args, **kwargs):
+        if not settings.PRETIX_QUOTA_COUNTERS:
+            return super().delete(*args, **kwargs)
+
+        key = getattr(self, '_quota_key_at_load', self._quota_key)
+        with transaction.atomic():
+            ret = super().delete(*args, **kwargs)
+            if key:
+                Quota.objects.apply_counter_deltas({('waitinglist',) + key: -1})
+        return ret
+
     def clean(self):
         if WaitingListEntry.objects.filter(
             item=self.item, variation=self.variation, email=self.email, voucher__isnull=True
@@ -19,6 +19,7 @@ from pretix.base.metrics import (
     pretix_task_duration_seconds, pretix_task_runs_total,
 )
 from pretix.celery_app import app
+from pretix.helpers.profile.sampling import profiler as sampling_profiler
 
 
 class ProfiledTask(app.Task):
@@ -34,6 +35,11 @@ class ProfiledTask(app.Task):
             profiler.dump_stats(os.path.join(settings.PROFILE_DIR, '{time:.0f}_{tottime:.3f}_celery_{t}.pstat'.format(
                 t=self.name, tottime=tottime, time=time.time()
             )))
+        elif settings.PROFILING_SAMPLE_INTERVAL > 0:
+            with sampling_profiler.activate('celery:' + self.name):
+                t0 = time.perf_counter()
+                ret = super().__call__(*args, **kwargs)
+                tottime = time.perf_counter() - t0
         else:
             t0 = time.perf_counter()
             ret = super().__call__(*args, **kwargs)
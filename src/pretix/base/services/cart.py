@@ -12,7 +12,7 @@ from django.utils.translation import pgettext_lazy, ugettext as _
 
 from pretix.base.i18n import LazyLocaleException, language
 from pretix.base.models import (
-    CartPosition, Event, InvoiceAddress, Item, ItemVariation, Voucher,
+    CartPosition, Event, InvoiceAddress, Item, ItemVariation, Quota, Voucher,
 )
 from pretix.base.models.event import SubEvent
 from pretix.base.models.orders import OrderFee
@@ -598,12 +598,23 @@ class CartManager:
         CartPosition.objects.bulk_create(new_cart_positions)
         return err
 
+    def _get_lock_quotas(self):
+        positions = list(self.positions)
+        if self._voucher_use_diff or any(p.voucher_id for p in positions):
+            # Voucher redemptions are counted across the whole event
+            return None
+        quotas = set(Quota.objects.for_positions(positions))
+        for op in self._operations:
+            if isinstance(op, self.AddOperation):
+                quotas.update(op.quotas)
+        return quotas
+
     def commit(self):
         self._check_presale_dates()
         self._check_max_cart_size()
         self._calculate_expiry()
 
-        with self.event.lock() as now_dt:
+        with self.event.lock(quotas=self._get_lock_quotas) as now_dt:
             with transaction.atomic():
                 self.now_dt = now_dt
                 self._extend_expiry_of_valid_existing_positions()
@@ -1,6 +1,7 @@
+import tempfile
 from typing import Any, Dict
 
-from django.core.files.base import ContentFile
+from django.core.files import File
 from django.utils.timezone import override
 
 from pretix.base.i18n import language
@@ -10,8 +11,15 @@ from pretix.base.signals import register_data_exporters
 from pretix.celery_app import app
 
 
-@app.task(base=ProfiledTask)
-def export(event: str, fileid: str, provider: str, form_data: Dict[str, Any]) -> None:
+@app.task(base=ProfiledTask, bind=True)
+def export(self, event: str, fileid: str, provider: str, form_data: Dict[str, Any]) -> None:
+    def set_progress(value):
+        if not self.request.called_directly and not self.request.is_eager:
+            self.update_state(
+                state='PROGRESS',
+                meta={'value': value}
+            )
+
     event = Event.objects.get(id=event)
     file = CachedFile.objects.get(id=fileid)
     with language(event.settings.locale), override(event.settings.timezone):
@@ -19,7 +27,12 @@ def export(event: str, fileid: str, provider: str, form_data: Dict[str, Any]) ->
         for receiver, response in responses:
             ex = response(event)
             if ex.identifier == provider:
-                file.filename, file.type, data = ex.render(form_data)
-                file.file.save(cachedfile_name(file, file.filename), ContentFile(data))
+                ex.progress_callback = set_progress
+                file.filename, file.type, chunks = ex.render_stream(form_data)
+                with tempfile.TemporaryFile() as f:
+                    for chunk in chunks:
+                        f.write(chunk.encode() if isinstance(chunk, str) else chunk)
+                    f.seek(0)
+                    file.file.save(cachedfile_name(file, file.filename), File(f, name=file.filename))
                 file.save()
     return file.pk
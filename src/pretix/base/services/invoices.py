@@ -1,6 +1,7 @@
 import copy
 import json
 import logging
+import time
 import urllib.error
 from datetime import date, timedelta
 from decimal import ROUND_HALF_UP, Decimal
@@ -18,15 +19,18 @@ from django.utils.translation import pgettext, ugettext as _
 from i18nfield.strings import LazyI18nString
 
 from pretix.base.i18n import language
+from pretix.base.metrics import pretix_invoice_render_seconds
 from pretix.base.models import Invoice, InvoiceAddress, InvoiceLine, Order
 from pretix.base.models.tax import EU_CURRENCIES
 from pretix.base.services.async import TransactionAwareTask
+from pretix.base.services.periodic import minimum_interval
 from pretix.base.settings import GlobalSettingsObject
 from pretix.base.signals import periodic_task
 from pretix.celery_app import app
 from pretix.helpers.database import rolledback_transaction
 
 logger = logging.getLogger(__name__)
+INVOICE_BATCH_SIZE = 100
 
 
 @transaction.atomic
@@ -209,14 +213,42 @@ def generate_invoice(order: Order, trigger_pdf=True):
     return invoice
 
 
+def _render_invoice(invoice: Invoice, renderer=None) -> str:
+    with language(invoice.locale):
+        renderer = renderer or invoice.event.invoice_renderer
+        t0 = time.perf_counter()
+        fname, ftype, fcontent = renderer.generate(invoice)
+        if settings.METRICS_ENABLED:
+            pretix_invoice_render_seconds.observe(time.perf_counter() - t0, renderer=renderer.identifier)
+        invoice.file.save(fname, ContentFile(fcontent))
+        invoice.save()
+        return invoice.file.name
+
+
 @app.task(base=TransactionAwareTask)
 def invoice_pdf_task(invoice: int):
     i = Invoice.objects.get(pk=invoice)
-    with language(i.locale):
-        fname, ftype, fcontent = i.event.invoice_renderer.generate(i)
-        i.file.save(fname, ContentFile(fcontent))
-        i.save()
-        return i.file.name
+    return _render_invoice(i)
+
+
+@app.task(base=TransactionAwareTask)
+def invoice_pdf_batch_task(invoices: list):
+    """
+    Renders the PDF files of many invoices in one task. The renderer of every event is only set up once
+    and then reused for all invoices of this event. A failing invoice does not stop the others.
+    """
+    events = {}
+    renderers = {}
+    qs = Invoice.objects.filter(pk__in=invoices).select_related('event', 'order', 'refers').order_by('event_id', 'pk')
+    for i in qs:
+        i.event = events.setdefault(i.event_id, i.event)
+        i.order.event = i.event
+        try:
+            if i.event_id not in renderers:
+                renderers[i.event_id] = i.event.invoice_renderer
+            _render_invoice(i, renderers[i.event_id])
+        except Exception:
+            logger.exception('Could not render invoice %s', i.number)
 
 
 def invoice_qualified(order: Order):
@@ -233,6 +265,17 @@ def invoice_pdf(*args, **kwargs):
     invoice_pdf_task.apply_async(args=args, kwargs=kwargs)
 
 
+def invoice_pdf_batch(invoices: list):
+    """
+    Renders the PDF files of a list of invoices in the background, using one task for every
+    ``INVOICE_BATCH_SIZE`` invoices. Like :py:func:`invoice_pdf`, this waits for the current
+    transaction to be committed.
+    """
+    ids = list(invoices)
+    for i in range(0, len(ids), INVOICE_BATCH_SIZE):
+        invoice_pdf_batch_task.apply_async(args=(ids[i:i + INVOICE_BATCH_SIZE],))
+
+
 class DummyRollbackException(Exception):
     pass
 
@@ -274,6 +317,7 @@ def build_preview_invoice_pdf(event):
 
 
 @receiver(signal=periodic_task)
+@minimum_interval(60)
 def fetch_ecb_rates(sender, **kwargs):
     if not settings.FETCH_ECB_RATES:
         return
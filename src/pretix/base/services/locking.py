@@ -1,28 +1,63 @@
+import hashlib
 import logging
 import time
 import uuid
 from datetime import timedelta
+from functools import lru_cache
 
 from django.conf import settings
-from django.db import transaction
+from django.db import OperationalError, connection, transaction
 from django.utils.timezone import now
 
+from pretix.base.metrics import (
+    pretix_lock_hold_seconds, pretix_lock_timeouts_total,
+    pretix_lock_wait_seconds,
+)
 from pretix.base.models import EventLock
+from pretix.helpers.metrics import instrumentation
 
 logger = logging.getLogger('pretix.base.locking')
 LOCK_TIMEOUT = 120
+HEARTBEAT_TIMEOUT = 2
 
 
 class LockManager:
-    def __init__(self, event):
+    def __init__(self, event, quotas=None):
         self.event = event
+        self.quotas = quotas
+        self.locks = None
+        self.lock_type = 'event'
 
     def __enter__(self):
-        lock_event(self.event)
+        quotas = None
+        if settings.PRETIX_QUOTA_LOCKING:
+            # Computing the set of quotas costs queries, which are wasted if we lock the whole event anyway
+            quotas = self.quotas() if callable(self.quotas) else self.quotas
+        self.lock_type = 'quota' if quotas else 'event'
+
+        t0 = time.perf_counter()
+        try:
+            if self.lock_type == 'quota':
+                self.locks = lock_quotas(self.event, quotas)
+            else:
+                lock_event(self.event)
+        except LockTimeoutException:
+            if settings.METRICS_ENABLED:
+                pretix_lock_timeouts_total.inc(1, lock_type=self.lock_type)
+            raise
+        self.acquired = time.perf_counter()
+        if settings.METRICS_ENABLED:
+            pretix_lock_wait_seconds.observe(self.acquired - t0, lock_type=self.lock_type)
+            instrumentation.add_lock_time(self.acquired - t0)
         return now()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        release_event(self.event)
+        if self.locks is not None:
+            release_quotas(self.event, self.locks)
+        else:
+            release_event(self.event)
+        if settings.METRICS_ENABLED:
+            pretix_lock_hold_seconds.observe(time.perf_counter() - self.acquired, lock_type=self.lock_type)
         if exc_type is not None:
             return False
 
@@ -35,10 +70,27 @@ class LockReleaseException(Exception):
     pass
 
 
+def _event_lock_keys(event):
+    keys = [str(event.id)]
+    if settings.PRETIX_QUOTA_LOCKING:
+        # Lock every quota as well, so we exclude everyone who only holds locks on some of
+        # the event's quotas.
+        keys += _quota_lock_keys(event.quotas.values_list('id', flat=True))
+    return keys
+
+
+def _quota_lock_keys(quotas):
+    ids = sorted({q if isinstance(q, int) else q.pk for q in quotas})
+    return ['quota_%d' % i for i in ids]
+
+
 def lock_event(event):
     """
     Issue a lock on this event so nobody can book tickets for this event until
-    you release the lock. Will retry 5 times on failure.
+    you release the lock. If fair locking is enabled, this waits in line for up to
+    ``LOCKING_MAX_WAIT`` seconds, otherwise it retries a few times with a short backoff.
+
+    If quota locking is enabled, this also locks all quotas of the event.
 
     :raises LockTimeoutException: if the event is locked every time we try
                                   to obtain the lock
@@ -46,10 +98,8 @@ def lock_event(event):
     if hasattr(event, '_lock') and event._lock:
         return True
 
-    if settings.HAS_REDIS:
-        return lock_event_redis(event)
-    else:
-        return lock_event_db(event)
+    event._lock = _lock_keys(_event_lock_keys(event))
+    return True
 
 
 def release_event(event):
@@ -62,63 +112,113 @@ def release_event(event):
     """
     if not hasattr(event, '_lock') or not event._lock:
         raise LockReleaseException('Lock is not owned by this thread')
-    if settings.HAS_REDIS:
-        return release_event_redis(event)
-    else:
-        return release_event_db(event)
+    locks, event._lock = event._lock, None
+    _release_locks(locks)
+
+
+def lock_quotas(event, quotas):
+    """
+    Issue a lock on a set of quotas of this event, so nobody else can book tickets
+    affecting one of these quotas until you release the lock. Locks are always acquired
+    in the order of the quota IDs to prevent deadlocks between two processes locking
+    overlapping sets of quotas. If the whole event is already locked by this python
+    representation of the event, this does nothing.
+
+    :returns: A list of the acquired locks that needs to be passed to :py:func:`release_quotas`.
+    :raises LockTimeoutException: if one of the quotas is locked every time we try
+                                  to obtain the lock
+    """
+    if hasattr(event, '_lock') and event._lock:
+        return []
+    return _lock_keys(_quota_lock_keys(quotas))
+
+
+def release_quotas(event, locks):
+    """
+    Release the locks returned by :py:func:`lock_quotas`.
+
+    :raises LockReleaseException: if we do not own one of the locks any more
+    """
+    _release_locks(locks)
+
+
+def _lock_keys(keys):
+    acquired = []
+    # Fair locks wait for up to LOCKING_MAX_WAIT seconds for all keys together, not for every single one
+    deadline = time.perf_counter() + settings.LOCKING_MAX_WAIT
+    try:
+        for key in keys:
+            if settings.HAS_REDIS and settings.LOCKING_FAIR:
+                acquired.append(lock_key_redis_fair(key, deadline))
+            elif settings.HAS_REDIS:
+                acquired.append(lock_key_redis(key))
+            elif settings.LOCKING_FAIR and 'postgresql' in settings.DATABASES['default']['ENGINE']:
+                acquired.append(lock_key_advisory(key, deadline))
+            else:
+                if settings.LOCKING_FAIR:
+                    _warn_fair_unavailable()
+                acquired.append(lock_key_db(key))
+    except LockTimeoutException:
+        _release_locks(acquired)
+        raise
+    return acquired
+
 
+@lru_cache(maxsize=1)
+def _warn_fair_unavailable():
+    logger.warning('Fair locking is enabled, but it requires Redis or PostgreSQL and has no effect with your '
+                   'configuration.')
 
-def lock_event_db(event):
+
+def _release_locks(locks):
+    for lock in reversed(locks):
+        if isinstance(lock, EventLock):
+            release_lock_db(lock)
+        elif isinstance(lock, AdvisoryLock):
+            release_lock_advisory(lock)
+        else:
+            release_lock_redis(lock)
+
+
+def lock_key_db(key):
     retries = 5
     for i in range(retries):
         with transaction.atomic():
             dt = now()
-            l, created = EventLock.objects.get_or_create(event=event.id)
+            l, created = EventLock.objects.get_or_create(event=key)
             if created:
-                event._lock = l
-                return True
+                return l
             elif l.date < now() - timedelta(seconds=LOCK_TIMEOUT):
                 newtoken = str(uuid.uuid4())
-                updated = EventLock.objects.filter(event=event.id, token=l.token).update(date=dt, token=newtoken)
+                updated = EventLock.objects.filter(event=key, token=l.token).update(date=dt, token=newtoken)
                 if updated:
                     l.token = newtoken
-                    event._lock = l
-                    return True
+                    return l
         time.sleep(2 ** i / 100)
     raise LockTimeoutException()
 
 
 @transaction.atomic
-def release_event_db(event):
-    if not hasattr(event, '_lock') or not event._lock:
-        raise LockReleaseException('Lock is not owned by this thread')
+def release_lock_db(lock):
     try:
-        lock = EventLock.objects.get(event=event.id, token=event._lock.token)
+        lock = EventLock.objects.get(event=lock.event, token=lock.token)
         lock.delete()
-        event._lock = None
     except EventLock.DoesNotExist:
         raise LockReleaseException('Lock is no longer owned by this thread')
 
 
-def redis_lock_from_event(event):
+def lock_key_redis(key):
     from django_redis import get_redis_connection
-    from redis.lock import Lock
-
-    if not hasattr(event, '_lock') or not event._lock:
-        rc = get_redis_connection("redis")
-        event._lock = Lock(redis=rc, name='pretix_event_%s' % event.id, timeout=LOCK_TIMEOUT)
-    return event._lock
-
-
-def lock_event_redis(event):
     from redis.exceptions import RedisError
+    from redis.lock import Lock
 
-    lock = redis_lock_from_event(event)
+    rc = get_redis_connection("redis")
+    lock = Lock(redis=rc, name='pretix_event_%s' % key, timeout=LOCK_TIMEOUT)
     retries = 5
     for i in range(retries):
         try:
             if lock.acquire(False):
-                return True
+                return lock
         except RedisError:
             logger.exception('Error locking an event')
             raise LockTimeoutException()
@@ -126,13 +226,162 @@ def lock_event_redis(event):
     raise LockTimeoutException()
 
 
-def release_event_redis(event):
+def release_lock_redis(lock):
     from redis import RedisError
 
-    lock = redis_lock_from_event(event)
     try:
         lock.release()
     except RedisError:
         logger.exception('Error releasing an event lock')
         raise LockTimeoutException()
-    event._lock = None
+
+
+def lock_key_redis_fair(key, deadline: float=None):
+    """
+    Acquires the same lock as :py:func:`lock_key_redis`, but instead of giving up after a few
+    attempts, waiters line up in a sorted set ordered by their arrival time and only the
+    first one in line may try to take the lock. Waiters give up at ``deadline``, a value of
+    ``time.perf_counter()``, or after ``LOCKING_MAX_WAIT`` seconds if none is given.
+
+    Every waiter regularly stores a heartbeat while it is waiting. If the first waiter in line
+    has not done so for ``HEARTBEAT_TIMEOUT`` seconds, e.g. because its process died, the
+    others remove it from the line instead of waiting for it.
+    """
+    from django_redis import get_redis_connection
+    from redis.exceptions import RedisError
+    from redis.lock import Lock
+
+    rc = get_redis_connection("redis")
+    lock = Lock(redis=rc, name='pretix_event_%s' % key, timeout=LOCK_TIMEOUT)
+    queue = 'pretix_lockqueue_%s' % key
+    heartbeats = 'pretix_lockqueue_%s_heartbeats' % key
+    ticket = str(uuid.uuid4())
+    if deadline is None:
+        deadline = time.perf_counter() + settings.LOCKING_MAX_WAIT
+
+    def redis_now():
+        seconds, microseconds = rc.time()
+        return seconds + microseconds / 1000000
+
+    try:
+        arrival = redis_now()
+        i = 0
+        while True:
+            beat = redis_now()
+            pipe = rc.pipeline()
+            # We might have been removed from the line if we did not send a heartbeat for too long
+            pipe.execute_command('ZADD', queue, 'NX', arrival, ticket)
+            pipe.hset(heartbeats, ticket, beat)
+            for k in (queue, heartbeats):
+                pipe.expire(k, int(settings.LOCKING_MAX_WAIT) + LOCK_TIMEOUT)
+            pipe.zrange(queue, 0, 0)
+            head = pipe.execute()[-1]
+            if head and head[0].decode() == ticket:
+                if lock.acquire(False):
+                    return lock
+            elif head:
+                last_beat = rc.hget(heartbeats, head[0])
+                if last_beat is None or float(last_beat) < beat - HEARTBEAT_TIMEOUT:
+                    rc.zrem(queue, head[0])
+                    rc.hdel(heartbeats, head[0])
+                    continue
+            if time.perf_counter() > deadline:
+                raise LockTimeoutException()
+            time.sleep(min(2 ** i / 1000, 0.05))
+            i += 1
+    except RedisError:
+        logger.exception('Error locking an event')
+        raise LockTimeoutException()
+    finally:
+        try:
+            rc.zrem(queue, ticket)
+            rc.hdel(heartbeats, ticket)
+        except RedisError:
+            logger.exception('Error leaving the lock queue')
+
+
+def acquire_named_lock(name: str, timeout: int):
+    """
+    Tries to acquire a lock that is not related to an event, e.g. to make sure that a job does not run
+    twice at the same time. In contrast to the event locks, this does not wait if the lock is taken, and
+    the lock is only considered stale after ``timeout`` seconds.
+
+    :returns: The lock, which needs to be passed to :py:func:`release_named_lock`, or ``None`` if the
+              lock is held by someone else.
+    """
+    key = 'named_' + hashlib.sha1(name.encode()).hexdigest()[:30]
+    if settings.HAS_REDIS:
+        from django_redis import get_redis_connection
+        from redis.exceptions import RedisError
+        from redis.lock import Lock
+
+        rc = get_redis_connection("redis")
+        lock = Lock(redis=rc, name='pretix_%s' % key, timeout=timeout)
+        try:
+            return lock if lock.acquire(False) else None
+        except RedisError:
+            logger.exception('Error acquiring a lock')
+            return None
+
+    with transaction.atomic():
+        l, created = EventLock.objects.get_or_create(event=key)
+        if created:
+            return l
+        if l.date < now() - timedelta(seconds=timeout):
+            newtoken = str(uuid.uuid4())
+            if EventLock.objects.filter(event=key, token=l.token).update(date=now(), token=newtoken):
+                l.token = newtoken
+                return l
+    return None
+
+
+def release_named_lock(lock):
+    """
+    Releases a lock returned by :py:func:`acquire_named_lock`. If it has been taken over by someone else
+    in the meantime, because we held it for longer than its timeout, this only logs a warning.
+    """
+    try:
+        if isinstance(lock, EventLock):
+            release_lock_db(lock)
+        else:
+            release_lock_redis(lock)
+    except (LockReleaseException, LockTimeoutException):
+        logger.warning('Lock has been released by someone else')
+
+
+class AdvisoryLock:
+    def __init__(self, key):
+        self.key = key
+        self.id = int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big', signed=True)
+
+
+def lock_key_advisory(key, deadline: float=None):
+    """
+    Acquires a session-level PostgreSQL advisory lock. PostgreSQL grants these to waiting
+    sessions in the order they asked for them, so we can just block until ``deadline``, a
+    value of ``time.perf_counter()``, or for ``LOCKING_MAX_WAIT`` seconds if none is given.
+    The lock is released automatically if our database connection dies.
+    """
+    lock = AdvisoryLock(key)
+    if deadline is None:
+        deadline = time.perf_counter() + settings.LOCKING_MAX_WAIT
+    # A lock_timeout of zero would mean waiting forever
+    wait = max(int((deadline - time.perf_counter()) * 1000), 1)
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('lock_timeout')")
+            previous_timeout = cursor.fetchone()[0]
+            cursor.execute("SELECT set_config('lock_timeout', %s, true)",
+                           ['%dms' % wait])
+            cursor.execute("SELECT pg_advisory_lock(%s)", [lock.id])
+            cursor.execute("SELECT set_config('lock_timeout', %s, true)", [previous_timeout])
+    except OperationalError:
+        raise LockTimeoutException()
+    return lock
+
+
+def release_lock_advisory(lock):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", [lock.id])
+        if not cursor.fetchone()[0]:
+            raise LockReleaseException('Lock is no longer owned by this thread')
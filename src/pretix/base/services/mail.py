@@ -1,3 +1,6 @@
+import hashlib
+import html as html_lib
+import json
 import logging
 from typing import Any, Dict, List, Union
 
@@ -6,12 +9,17 @@ import cssutils
 import markdown
 from celery import chain
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template.loader import get_template
-from django.utils.translation import ugettext as _
+from django.utils.formats import date_format
+from django.utils.timezone import localtime
+from django.utils.translation import get_language, ugettext as _
 from i18nfield.strings import LazyI18nString
 from inlinestyler.utils import inline_css
+from lxml import etree
 
+from pretix.base.email import mail_pool
 from pretix.base.i18n import language
 from pretix.base.models import Event, Invoice, InvoiceAddress, Order
 from pretix.base.services.invoices import invoice_pdf_task
@@ -24,6 +32,14 @@ logger = logging.getLogger('pretix.base.mail')
 INVALID_ADDRESS = 'invalid-pretix-mail-address'
 cssutils.log.setLevel(logging.CRITICAL)
 
+# Placeholders for the per-recipient parts of the HTML wrapper, see render_mail_html()
+BODY_PLACEHOLDER = 'pretixmailplaceholderbody'
+ORDER_CODE_PLACEHOLDER = 'pretixmailplaceholderordercode'
+ORDER_DATE_PLACEHOLDER = 'pretixmailplaceholderorderdate'
+ORDER_URL_PLACEHOLDER = 'pretixmailplaceholderorderurl'
+FRAGMENT_MARKER = 'data-pretix-mail-body'
+WRAPPER_CACHE_TIMEOUT = 3600 * 24
+
 
 class TolerantDict(dict):
 
@@ -73,87 +89,11 @@ def mail(email: str, subject: str, template: Union[str, LazyI18nString],
     if email == INVALID_ADDRESS:
         return
 
-    headers = headers or {}
-
     with language(locale):
-        if isinstance(context, dict) and order:
-            try:
-                context.update({
-                    'invoice_name': order.invoice_address.name,
-                    'invoice_company': order.invoice_address.company
-                })
-            except InvoiceAddress.DoesNotExist:
-                context.update({
-                    'invoice_name': '',
-                    'invoice_company': ''
-                })
-        body, body_md = render_mail(template, context)
-        subject = str(subject).format_map(context)
-        sender = sender or (event.settings.get('mail_from') if event else settings.MAIL_FROM)
-
-        subject = str(subject)
-        body_plain = body
-
-        htmlctx = {
-            'site': settings.PRETIX_INSTANCE_NAME,
-            'site_url': settings.SITE_URL,
-            'body': body_md,
-            'color': '#8E44B3'
-        }
-
-        if event:
-            htmlctx['event'] = event
-            htmlctx['color'] = event.settings.primary_color
-
-            if event.settings.mail_from == settings.DEFAULT_FROM_EMAIL and event.settings.contact_mail and not headers.get('Reply-To'):
-                headers['Reply-To'] = event.settings.contact_mail
-
-            prefix = event.settings.get('mail_prefix')
-            if prefix:
-                subject = "[%s] %s" % (prefix, subject)
-
-            body_plain += "\r\n\r\n-- \r\n"
-
-            signature = str(event.settings.get('mail_text_signature'))
-            if signature:
-                signature = signature.format(event=event.name)
-                signature_md = signature.replace('\n', '<br>\n')
-                signature_md = bleach.linkify(bleach.clean(markdown.markdown(signature_md), tags=bleach.ALLOWED_TAGS + ['p', 'br']))
-                htmlctx['signature'] = signature_md
-                body_plain += signature
-                body_plain += "\r\n\r\n-- \r\n"
-
-            if order:
-                body_plain += _(
-                    "You are receiving this email because you placed an order for {event}."
-                ).format(event=event.name)
-                htmlctx['order'] = order
-                body_plain += "\r\n"
-                body_plain += _(
-                    "You can view your order details at the following URL:\n{orderurl}."
-                ).replace("\n", "\r\n").format(
-                    event=event.name, orderurl=build_absolute_uri(
-                        order.event, 'presale:event.order', kwargs={
-                            'order': order.code,
-                            'secret': order.secret
-                        }
-                    )
-                )
-            body_plain += "\r\n"
-
-        tpl = get_template('pretixbase/email/plainwrapper.html')
-        body_html = tpl.render(htmlctx)
-
+        send_kwargs = render_mail_message(email, subject, template, context, event, order, headers, sender)
         send_task = mail_send_task.si(
-            to=[email],
-            subject=subject,
-            body=body_plain,
-            html=body_html,
-            sender=sender,
-            event=event.id if event else None,
-            headers=headers,
             invoices=[i.pk for i in invoices] if invoices else [],
-            order=order.pk if order else None
+            **send_kwargs
         )
 
         if invoices:
@@ -165,13 +105,104 @@ def mail(email: str, subject: str, template: Union[str, LazyI18nString],
         chain(*task_chain).apply_async()
 
 
-@app.task
-def mail_send_task(*args, to: List[str], subject: str, body: str, html: str, sender: str,
-                   event: int=None, headers: dict=None, bcc: List[str]=None, invoices: List[int]=None,
-                   order: int=None) -> bool:
+def render_mail_message(email: str, subject: Union[str, LazyI18nString], template: Union[str, LazyI18nString],
+                        context: Dict[str, Any]=None, event: Event=None, order: Order=None, headers: dict=None,
+                        sender: str=None) -> Dict[str, Any]:
+    """
+    Renders the subject, the plain text and the HTML version of an email in the currently active
+    language. See :py:func:`mail` for the parameters. Returns the keyword arguments for
+    :py:func:`mail_send_task` or :py:func:`build_mail_message`.
+    """
+    headers = headers or {}
+
+    if isinstance(context, dict) and order:
+        try:
+            context.update({
+                'invoice_name': order.invoice_address.name,
+                'invoice_company': order.invoice_address.company
+            })
+        except InvoiceAddress.DoesNotExist:
+            context.update({
+                'invoice_name': '',
+                'invoice_company': ''
+            })
+    body, body_md = render_mail(template, context)
+    subject = str(subject).format_map(context)
+    sender = sender or (event.settings.get('mail_from') if event else settings.MAIL_FROM)
+
+    subject = str(subject)
+    body_plain = body
+
+    htmlctx = {
+        'site': settings.PRETIX_INSTANCE_NAME,
+        'site_url': settings.SITE_URL,
+        'color': '#8E44B3'
+    }
+
+    if event:
+        htmlctx['event'] = event
+        htmlctx['color'] = event.settings.primary_color
+
+        if event.settings.mail_from == settings.DEFAULT_FROM_EMAIL and event.settings.contact_mail and not headers.get('Reply-To'):
+            headers['Reply-To'] = event.settings.contact_mail
+
+        prefix = event.settings.get('mail_prefix')
+        if prefix:
+            subject = "[%s] %s" % (prefix, subject)
+
+        body_plain += "\r\n\r\n-- \r\n"
+
+        signature = str(event.settings.get('mail_text_signature'))
+        if signature:
+            signature = signature.format(event=event.name)
+            signature_md = signature.replace('\n', '<br>\n')
+            signature_md = bleach.linkify(bleach.clean(markdown.markdown(signature_md), tags=bleach.ALLOWED_TAGS + ['p', 'br']))
+            htmlctx['signature'] = signature_md
+            body_plain += signature
+            body_plain += "\r\n\r\n-- \r\n"
+
+        if order:
+            body_plain += _(
+                "You are receiving this email because you placed an order for {event}."
+            ).format(event=event.name)
+            body_plain += "\r\n"
+            body_plain += _(
+                "You can view your order details at the following URL:\n{orderurl}."
+            ).replace("\n", "\r\n").format(
+                event=event.name, orderurl=build_absolute_uri(
+                    order.event, 'presale:event.order', kwargs={
+                        'order': order.code,
+                        'secret': order.secret
+                    }
+                )
+            )
+        body_plain += "\r\n"
+
+    body_html = render_mail_html(htmlctx, body_md, order)
+
+    return {
+        'to': [email],
+        'subject': subject,
+        'body': body_plain,
+        'html': body_html,
+        'sender': sender,
+        'event': event.id if event else None,
+        'headers': headers,
+        'order': order.pk if order else None,
+    }
+
+
+def build_mail_message(to: List[str], subject: str, body: str, html: str, sender: str,
+                       event: Event=None, headers: dict=None, bcc: List[str]=None, invoices: List[int]=None,
+                       order: Order=None) -> EmailMultiAlternatives:
+    """
+    Builds the message object for an email rendered by :py:func:`render_mail_message`, including the
+    attached invoices and the changes made by plugins through the ``email_filter`` signal. The CSS of
+    ``html`` needs to be inlined already.
+    """
     email = EmailMultiAlternatives(subject, body, sender, to=to, bcc=bcc, headers=headers)
     if html is not None:
-        email.attach_alternative(inline_css(html), "text/html")
+        email.attach_alternative(html, "text/html")
     if invoices:
         invoices = Invoice.objects.filter(pk__in=invoices)
         for inv in invoices:
@@ -182,26 +213,107 @@ def mail_send_task(*args, to: List[str], subject: str, body: str, html: str, sen
                     'application/pdf'
                 )
     if event:
-        event = Event.objects.get(id=event)
-        backend = event.get_mail_backend()
-    else:
-        backend = get_connection(fail_silently=False)
+        email = email_filter.send_chained(event, 'message', message=email, order=order)
+    return email
+
 
+@app.task
+def mail_send_task(*args, to: List[str], subject: str, body: str, html: str, sender: str,
+                   event: int=None, headers: dict=None, bcc: List[str]=None, invoices: List[int]=None,
+                   order: int=None) -> bool:
     if event:
+        event = Event.objects.get(id=event)
+        backend = event.get_mail_backend()
         if order:
             try:
                 order = event.orders.get(pk=order)
             except Order.DoesNotExist:
                 order = None
-        email = email_filter.send_chained(event, 'message', message=email, order=order)
+    else:
+        backend = get_connection(fail_silently=False)
+        order = None
+
+    if html is not None and '<style' in html:
+        # HTML rendered by render_mail_message() has been inlined already, but other callers might
+        # pass a complete document with stylesheets.
+        html = inline_css(html)
+    email = build_mail_message(to, subject, body, html, sender, event=event, headers=headers, bcc=bcc,
+                               invoices=invoices, order=order)
 
-    try:
-        backend.send_messages([email])
-    except Exception:
-        logger.exception('Error sending email')
+    if not mail_pool.send(backend, email):
         raise SendMailException('Failed to send an email to {}.'.format(to))
 
 
+def render_mail_html(htmlctx: Dict[str, Any], body_md: str, order: Order=None) -> str:
+    """
+    Renders the HTML version of an email with all CSS inlined. Rendering the wrapper template and
+    inlining its CSS is expensive and the result only depends on the event and its settings, so we
+    do it once with placeholders for the body and the order details and cache the result. For every
+    single email, we then only inline the CSS into the body and insert it.
+    """
+    key_data = [get_language(), order is not None] + [str(v) for k, v in sorted(htmlctx.items()) if k != 'event']
+    if htmlctx.get('event'):
+        event = htmlctx['event']
+        key_data += [event.pk, str(event.name), build_absolute_uri(event, 'presale:event.index')]
+    key = 'mail_wrapper_{}'.format(hashlib.sha1(json.dumps(key_data).encode()).hexdigest())
+
+    wrapper = cache.get(key)
+    if not wrapper:
+        ctx = dict(htmlctx, body=BODY_PLACEHOLDER)
+        if order:
+            ctx.update({
+                'order': {'code': ORDER_CODE_PLACEHOLDER},
+                'order_date': ORDER_DATE_PLACEHOLDER,
+                'order_url': ORDER_URL_PLACEHOLDER,
+            })
+        tpl = get_template('pretixbase/email/plainwrapper.html')
+        html = tpl.render(ctx)
+        document = etree.HTML(html)
+        container = document.xpath('//*[contains(text(), "{}")]'.format(BODY_PLACEHOLDER))[0]
+        wrapper = {
+            'html': inline_css(html),
+            'css': ''.join(element.text or '' for element in document.iter('style')),
+            'ancestors': [(el.tag, dict(el.attrib)) for el in reversed([container] + list(container.iterancestors()))],
+        }
+        cache.set(key, wrapper, WRAPPER_CACHE_TIMEOUT)
+
+    body_html = _inline_css_fragment(body_md, wrapper['css'], wrapper['ancestors'])
+    html = wrapper['html'].replace(BODY_PLACEHOLDER, body_html)
+    if order:
+        html = html.replace(ORDER_CODE_PLACEHOLDER, html_lib.escape(order.code)).replace(
+            ORDER_DATE_PLACEHOLDER, html_lib.escape(date_format(localtime(order.datetime), 'SHORT_DATE_FORMAT'))
+        ).replace(
+            ORDER_URL_PLACEHOLDER, html_lib.escape(build_absolute_uri(order.event, 'presale:event.order', kwargs={
+                'order': order.code,
+                'secret': order.secret
+            }))
+        )
+    return html
+
+
+def _inline_css_fragment(fragment: str, css: str, ancestors: list) -> str:
+    """
+    Inlines CSS into a HTML fragment that will be inserted into an element with the given chain of
+    ancestors. We only pass these ancestors and the fragment to the inliner instead of the whole
+    wrapper, which is a lot faster, but selectors like ``.content p`` still apply.
+    """
+    root = container = None
+    for tag, attrib in ancestors:
+        container = etree.Element(tag, attrib) if root is None else etree.SubElement(container, tag, attrib)
+        root = root if root is not None else container
+    head = etree.Element('head')
+    etree.SubElement(head, 'style').text = css
+    root.insert(0, head)
+    container.set(FRAGMENT_MARKER, '')
+    container.text = BODY_PLACEHOLDER
+
+    html = etree.tostring(root, method="html", encoding="unicode").replace(BODY_PLACEHOLDER, fragment)
+    container = etree.HTML(inline_css(html)).xpath('//*[@{}]'.format(FRAGMENT_MARKER))[0]
+    return html_lib.escape(container.text or '', quote=False) + ''.join(
+        etree.tostring(child, method="html", encoding="unicode") for child in container
+    )
+
+
 def mail_send(*args, **kwargs):
     mail_send_task.apply_async(args=args, kwargs=kwargs)
 
@@ -34,7 +34,8 @@ from pretix.base.payment import BasePaymentProvider
 from pretix.base.reldate import RelativeDateWrapper
 from pretix.base.services.async import ProfiledTask
 from pretix.base.services.invoices import (
-    generate_cancellation, generate_invoice, invoice_qualified,
+    generate_cancellation, generate_invoice, invoice_pdf_batch,
+    invoice_qualified,
 )
 from pretix.base.services.locking import LockTimeoutException
 from pretix.base.services.mail import SendMailException
@@ -106,18 +107,85 @@ def mark_order_paid(order: Order, provider: str=None, info: str=None, date: date
     if order.status == Order.STATUS_PAID:
         return order
 
-    with order.event.lock() as now_dt:
-        can_be_paid = order._can_be_paid(count_waitinglist=count_waitinglist)
-        if not force and can_be_paid is not True:
-            raise Quota.QuotaExceededException(can_be_paid)
-        order.payment_provider = provider or order.payment_provider
-        order.payment_info = info or order.payment_info
-        order.payment_date = date or now_dt
-        if manual is not None:
-            order.payment_manual = manual
-        order.status = Order.STATUS_PAID
-        order.save()
+    with order.event.lock(quotas=lambda: Quota.objects.for_positions(order.positions.all())) as now_dt:
+        _set_order_paid(order, now_dt, provider=provider, info=info, date=date, manual=manual, force=force,
+                        count_waitinglist=count_waitinglist)
+
+    _order_paid_actions(order, now_dt, provider=provider, info=info, date=date, manual=manual, force=force,
+                        send_mail=send_mail, user=user, mail_text=mail_text, api_token=api_token)
+    return order
 
+
+def mark_orders_paid(event: Event, orders: list, provider: str=None, date: datetime=None, send_mail: bool=True,
+                     user: User=None, count_waitinglist=True, on_result=None) -> dict:
+    """
+    Marks a list of orders of the same event as paid. This works like :py:func:`mark_order_paid`, but
+    the event is locked only once for the whole list instead of once per order, which makes a large
+    difference if many payments are processed at the same time, e.g. when importing bank statements.
+
+    Errors in the actions that follow a payment, like sending emails, are logged and do not keep the
+    remaining orders from being processed.
+
+    :param orders: A list of tuples of an order and the information to store in its ``payment_info``
+    :param on_result: An optional function that is called with every order that has been marked as paid
+                      or could not be marked as paid, and the ``Quota.QuotaExceededException`` that
+                      occurred or ``None``. It is called within the same database transaction that
+                      marks the order as paid, so you can use it to store the outcome of the payment.
+                      It is not called for orders that are no longer pending or expired, which are
+                      skipped.
+    :returns: A dictionary mapping the IDs of all orders that could not be marked as paid to the
+              ``Quota.QuotaExceededException`` that occurred
+    """
+    errors = {}
+    paid = []
+    with event.lock() as now_dt:
+        for order, info in orders:
+            with transaction.atomic():
+                # The order might have been paid, canceled or changed since it has been loaded
+                order.refresh_from_db()
+                if order.status not in (Order.STATUS_PENDING, Order.STATUS_EXPIRED):
+                    continue
+                try:
+                    _set_order_paid(order, now_dt, provider=provider, info=info, date=date,
+                                    count_waitinglist=count_waitinglist)
+                except Quota.QuotaExceededException as e:
+                    errors[order.pk] = e
+                else:
+                    paid.append((order, info))
+                if on_result:
+                    on_result(order, errors.get(order.pk))
+
+    invoices = []
+    for order, info in paid:
+        try:
+            _order_paid_actions(order, now_dt, provider=provider, info=info, date=date, send_mail=send_mail,
+                                user=user, invoice_pdfs=invoices)
+        except Exception:
+            logger.exception('Error running the actions after order %s has been paid', order.code)
+    invoice_pdf_batch([i.pk for i in invoices])
+    return errors
+
+
+def _set_order_paid(order: Order, now_dt: datetime, provider: str=None, info: str=None, date: datetime=None,
+                    manual: bool=None, force: bool=False, count_waitinglist=True):
+    # Needs to be called while holding a lock on the order's quotas
+    can_be_paid = order._can_be_paid(count_waitinglist=count_waitinglist)
+    if not force and can_be_paid is not True:
+        raise Quota.QuotaExceededException(can_be_paid)
+    order.payment_provider = provider or order.payment_provider
+    order.payment_info = info or order.payment_info
+    order.payment_date = date or now_dt
+    if manual is not None:
+        order.payment_manual = manual
+    order.status = Order.STATUS_PAID
+    order.save()
+
+
+def _order_paid_actions(order: Order, now_dt: datetime, provider: str=None, info: str=None, date: datetime=None,
+                        manual: bool=None, force: bool=False, send_mail: bool=True, user: User=None,
+                        mail_text='', api_token=None, invoice_pdfs: list=None):
+    # If a list is passed as invoice_pdfs, new invoices are added to it instead of rendering their
+    # PDF files right away, so the caller can render them in a batch.
     order.log_action('pretix.event.order.paid', {
         'provider': provider,
         'info': info,
@@ -130,10 +198,10 @@ def mark_order_paid(order: Order, provider: str=None, info: str=None, date: date
     invoice = None
     if order.event.settings.get('invoice_generate') in ('True', 'paid') and invoice_qualified(order):
         if not order.invoices.exists():
-            invoice = generate_invoice(
-                order,
-                trigger_pdf=not send_mail or not order.event.settings.invoice_email_attachment
-            )
+            trigger_pdf = not send_mail or not order.event.settings.invoice_email_attachment
+            invoice = generate_invoice(order, trigger_pdf=trigger_pdf and invoice_pdfs is None)
+            if trigger_pdf and invoice_pdfs is not None:
+                invoice_pdfs.append(invoice)
 
     if send_mail:
         with language(order.locale):
@@ -165,8 +233,6 @@ def mark_order_paid(order: Order, provider: str=None, info: str=None, date: date
             except SendMailException:
                 logger.exception('Order paid email could not be sent')
 
-    return order
-
 
 def extend_order(order: Order, new_date: datetime, force: bool=False, user: User=None, api_token=None):
     """
@@ -496,7 +562,14 @@ def _perform_order(event: str, payment_provider: str, position_ids: List[str],
         except InvoiceAddress.DoesNotExist:
             pass
 
-    with event.lock() as now_dt:
+    def lock_quotas():
+        lock_positions = CartPosition.objects.filter(id__in=position_ids)
+        if lock_positions.filter(voucher__isnull=False).exists():
+            # Voucher redemptions are counted across the whole event
+            return None
+        return Quota.objects.for_positions(lock_positions)
+
+    with event.lock(quotas=lock_quotas) as now_dt:
         positions = list(CartPosition.objects.filter(
             id__in=position_ids).select_related('item', 'variation', 'subevent'))
         if len(positions) == 0:
@@ -1065,8 +1138,12 @@ class OrderChangeManager:
         if not self._operations:
             # Do nothing
             return
+
+        def lock_quotas():
+            return set(self._quotadiff.keys()) | set(Quota.objects.for_positions(self.order.positions.all()))
+
         with transaction.atomic():
-            with self.order.event.lock():
+            with self.order.event.lock(quotas=lock_quotas):
                 if self.order.status not in (Order.STATUS_PENDING, Order.STATUS_PAID):
                     raise OrderError(self.error_messages['not_pending_or_paid'])
                 self._check_free_to_paid()
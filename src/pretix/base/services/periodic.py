@@ -0,0 +1,100 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from pretix.base.metrics import (
+    pretix_periodic_task_duration_seconds, pretix_periodic_task_runs_total,
+)
+from pretix.base.services.async import ProfiledTask
+from pretix.base.services.locking import (
+    acquire_named_lock, release_named_lock,
+)
+from pretix.base.signals import periodic_task
+from pretix.celery_app import app
+
+logger = logging.getLogger('pretix.base.periodic')
+SCHEDULER_LOCK_TIMEOUT = 300
+RUNNING_TIMEOUT = 3600
+
+
+def minimum_interval(minutes: int):
+    """
+    Decorator for receivers of the ``periodic_task`` signal that do not need to run every time the periodic
+    tasks are run, but at most once every ``minutes`` minutes::
+
+        @receiver(signal=periodic_task)
+        @minimum_interval(60)
+        def fetch_something(sender, **kwargs):
+            ...
+    """
+    def decorator(func):
+        func.periodic_interval = minutes * 60
+        return func
+    return decorator
+
+
+def receiver_name(receiver) -> str:
+    return '{}.{}'.format(receiver.__module__, receiver.__qualname__)
+
+
+def _receivers() -> dict:
+    return {receiver_name(r): r for r in periodic_task._live_receivers(None)}
+
+
+@app.task(base=ProfiledTask)
+def run_periodic_receiver(name: str):
+    """
+    Runs a single receiver of the ``periodic_task`` signal. If the same receiver is still running from an
+    earlier run, this does nothing. The lock that ensures this is held while the receiver runs, but for
+    no longer than ``RUNNING_TIMEOUT`` seconds, in case a worker dies without releasing it.
+    """
+    receiver = _receivers().get(name)
+    if receiver is None:
+        logger.warning('Periodic task %s does not exist (anymore)', name)
+        return
+
+    lock = acquire_named_lock('periodic_%s' % name, RUNNING_TIMEOUT)
+    if lock is None:
+        logger.info('Periodic task %s is still running, skipping', name)
+        return
+
+    t0 = time.perf_counter()
+    status = 'success'
+    try:
+        receiver(signal=periodic_task, sender=None)
+    except Exception:
+        # One failing receiver should never keep the others from running
+        status = 'error'
+        logger.exception('Periodic task %s failed', name)
+    finally:
+        release_named_lock(lock)
+        if settings.METRICS_ENABLED:
+            pretix_periodic_task_runs_total.inc(1, task_name=name, status=status)
+            if status == 'success':
+                pretix_periodic_task_duration_seconds.observe(time.perf_counter() - t0, task_name=name)
+
+
+def run_periodic_tasks():
+    """
+    Schedules every receiver of the ``periodic_task`` signal as its own task, so a slow receiver does not
+    delay the others and all of them can run in parallel. Receivers decorated with
+    :py:func:`minimum_interval` are skipped if they have been scheduled recently.
+
+    Returns the names of all scheduled receivers, or ``None`` if the periodic tasks are already being
+    scheduled by another process at the same time.
+    """
+    if not cache.add('pretix_periodic_scheduler', True, SCHEDULER_LOCK_TIMEOUT):
+        return None
+    try:
+        scheduled = []
+        for name, receiver in sorted(_receivers().items()):
+            interval = getattr(receiver, 'periodic_interval', None)
+            if interval and not cache.add('pretix_periodic_last_%s' % name, True, interval):
+                continue
+            run_periodic_receiver.apply_async(args=(name,))
+            scheduled.append(name)
+        return scheduled
+    finally:
+        cache.delete('pretix_periodic_scheduler')
@@ -1,32 +1,97 @@
-from django.db import models
+import logging
+
+from django.conf import settings
+from django.db import models, transaction
 from django.db.models import F, Max, OuterRef, Q, Subquery
 from django.dispatch import receiver
 
-from pretix.base.models import LogEntry, Quota
+from pretix.base.models import Event, LogEntry, Quota, QuotaCounter
+from pretix.base.services.locking import LockTimeoutException
 from pretix.celery_app import app
 
 from ..signals import periodic_task
 
+logger = logging.getLogger(__name__)
+
 
 @receiver(signal=periodic_task)
 def build_all_quota_caches(sender, **kwargs):
     refresh_quota_caches.apply_async()
 
 
-@app.task
-def refresh_quota_caches():
-    last_activity = LogEntry.objects.filter(
+@receiver(signal=periodic_task)
+def reconcile_all_quota_counters(sender, **kwargs):
+    if settings.PRETIX_QUOTA_COUNTERS:
+        reconcile_quota_counters.apply_async()
+
+
+def _last_activity():
+    return LogEntry.objects.filter(
         event=OuterRef('event_id'),
     ).order_by().values('event').annotate(
         m=Max('datetime')
     ).values(
         'm'
     )
+
+
+@app.task
+def refresh_quota_caches():
     quotas = Quota.objects.annotate(
-        last_activity=Subquery(last_activity, output_field=models.DateTimeField())
+        last_activity=Subquery(_last_activity(), output_field=models.DateTimeField())
     ).filter(
         Q(cached_availability_time__isnull=True) |
         Q(cached_availability_time__lt=F('last_activity'))
     )
     for q in quotas:
         q.availability()
+
+
+def reconcile_event_quota_counters(event: Event):
+    """
+    Counts the paid and pending order positions and the waiting list entries of all quotas
+    of an event from scratch and stores the result in their :py:class:`QuotaCounter` objects,
+    creating them if necessary.
+    """
+    # Deltas are only applied to existing counters and lock their rows while doing so. Missing
+    # counters are therefore created first (they are ignored until they have been reconciled)
+    # and then locked, so that every concurrent change is either contained in our count or
+    # applied on top of it after we commit.
+    quotas = list(event.quotas.all())
+    existing = set(QuotaCounter.objects.filter(quota__in=quotas).values_list('quota_id', flat=True))
+    for q in quotas:
+        if q.pk not in existing:
+            QuotaCounter.objects.get_or_create(quota=q)
+
+    with event.lock() as now_dt, transaction.atomic():
+        rows = {
+            c.quota_id: c for c in
+            QuotaCounter.objects.select_for_update().filter(quota__in=quotas).order_by('quota_id')
+        }
+        counters = Quota.objects.compute_counters(quotas, now_dt=now_dt, use_counters=False)
+        for q in quotas:
+            c = rows.get(q.pk)
+            if c is None:
+                # The counter has been reset in the meantime
+                continue
+            c.paid_orders = counters[q.pk]['paid']
+            c.pending_orders = counters[q.pk]['pending']
+            c.waitinglist = counters[q.pk]['waitinglist']
+            c.reconciled = now_dt
+            c.save()
+
+
+@app.task
+def reconcile_quota_counters():
+    event_ids = Quota.objects.annotate(
+        last_activity=Subquery(_last_activity(), output_field=models.DateTimeField())
+    ).filter(
+        Q(counter__isnull=True) |
+        Q(counter__reconciled__isnull=True) |
+        Q(counter__reconciled__lt=F('last_activity'))
+    ).order_by().values_list('event_id', flat=True).distinct()
+    for event in Event.objects.filter(pk__in=set(event_ids)):
+        try:
+            reconcile_event_quota_counters(event)
+        except LockTimeoutException:
+            logger.info('Could not reconcile quota counters of event %d, will try again next time.' % event.pk)
@@ -1,7 +1,12 @@
+import time
 from decimal import Decimal
 from typing import Any, Dict, Iterable, List, Tuple
 
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models import Count, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
 from pretix.base.models import Event, Item, ItemCategory, Order, OrderPosition
@@ -10,6 +15,9 @@ from pretix.base.models.orders import OrderFee
 from pretix.base.signals import order_fee_type_name
 
 
+OVERVIEW_CACHE_TIMEOUT = 3600
+
+
 class DummyObject:
     pass
 
@@ -70,6 +78,82 @@ def dictsum(*dicts) -> dict:
     return res
 
 
+def _overview_version_key(event_id: int) -> str:
+    return 'pretix_orderoverview_version_%d' % event_id
+
+
+def invalidate_order_overview(event_id: int) -> None:
+    """
+    Discards all cached order overview data of an event.
+    """
+    try:
+        cache.incr(_overview_version_key(event_id))
+    except ValueError:
+        cache.set(_overview_version_key(event_id), int(time.time() * 1000), None)
+
+
+def _overview_counters(event: Event, subevent: SubEvent=None) -> Tuple[List[dict], List[dict]]:
+    """
+    Returns the aggregated numbers of positions and fees per product and order status, which is the
+    expensive part of :py:func:`order_overview`. The result is cached until an order of the event
+    changes its status or one of its positions or fees is changed. The cache key contains a version
+    number of the event that we read before we run the queries, so numbers computed by a request that
+    overlaps with a change are never stored as the current ones.
+    """
+    version = cache.get(_overview_version_key(event.pk))
+    if version is None:
+        cache.add(_overview_version_key(event.pk), int(time.time() * 1000), None)
+        version = cache.get(_overview_version_key(event.pk))
+    key = 'pretix_orderoverview_%d_%s_%s' % (event.pk, version, subevent.pk if subevent else 'all')
+
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    qs = OrderPosition.objects
+    if subevent:
+        qs = qs.filter(subevent=subevent)
+    positions = list(qs.filter(
+        order__event=event
+    ).values(
+        'item', 'variation', 'order__status'
+    ).annotate(cnt=Count('id'), price=Sum('price'), tax_value=Sum('tax_value')).order_by())
+
+    fees = []
+    if not subevent:
+        fees = list(OrderFee.objects.filter(
+            order__event=event
+        ).values(
+            'fee_type', 'internal_type', 'order__status'
+        ).annotate(cnt=Count('id'), value=Sum('value'), tax_value=Sum('tax_value')).order_by())
+
+    data = positions, fees
+    if version is not None:
+        cache.set(key, data, OVERVIEW_CACHE_TIMEOUT)
+    return data
+
+
+def _invalidate_on_commit(event_id: int):
+    transaction.on_commit(lambda: invalidate_order_overview(event_id))
+
+
+@receiver(post_save, sender=Order, dispatch_uid="stats_overview_order")
+def _order_saved(sender, instance, created, **kwargs):
+    if created or getattr(instance, '_status_at_load', None) != instance.status:
+        _invalidate_on_commit(instance.event_id)
+
+
+@receiver(post_save, sender=OrderPosition, dispatch_uid="stats_overview_position_saved")
+@receiver(post_delete, sender=OrderPosition, dispatch_uid="stats_overview_position_deleted")
+@receiver(post_save, sender=OrderFee, dispatch_uid="stats_overview_fee_saved")
+@receiver(post_delete, sender=OrderFee, dispatch_uid="stats_overview_fee_deleted")
+def _order_part_changed(sender, instance, **kwargs):
+    try:
+        _invalidate_on_commit(instance.order.event_id)
+    except Order.DoesNotExist:
+        pass
+
+
 def order_overview(event: Event, subevent: SubEvent=None) -> Tuple[List[Tuple[ItemCategory, List[Item]]],
                                                                    Dict[str, Tuple[Decimal, Decimal]]]:
     items = event.items.all().select_related(
@@ -78,14 +162,7 @@ def order_overview(event: Event, subevent: SubEvent=None) -> Tuple[List[Tuple[It
         'variations'
     ).order_by('category__position', 'category_id', 'position', 'name')
 
-    qs = OrderPosition.objects
-    if subevent:
-        qs = qs.filter(subevent=subevent)
-    counters = qs.filter(
-        order__event=event
-    ).values(
-        'item', 'variation', 'order__status'
-    ).annotate(cnt=Count('id'), price=Sum('price'), tax_value=Sum('tax_value')).order_by()
+    counters, fee_counters = _overview_counters(event, subevent)
 
     num_canceled = {
         (p['item'], p['variation']): (p['cnt'], p['price'], p['price'] - p['tax_value'])
@@ -163,11 +240,7 @@ def order_overview(event: Event, subevent: SubEvent=None) -> Tuple[List[Tuple[It
     payment_items = []
 
     if not subevent:
-        counters = OrderFee.objects.filter(
-            order__event=event
-        ).values(
-            'fee_type', 'internal_type', 'order__status'
-        ).annotate(cnt=Count('id'), value=Sum('value'), tax_value=Sum('tax_value')).order_by()
+        counters = fee_counters
 
         num_canceled = {
             (o['fee_type'], o['internal_type']): (o['cnt'], o['value'], o['value'] - o['tax_value'])
@@ -1,7 +1,13 @@
 import os
 from datetime import timedelta
 
+from celery import group
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Q
+from django.dispatch import receiver
 from django.utils.timezone import now
 from django.utils.translation import ugettext as _
 
@@ -11,34 +17,55 @@ from pretix.base.models import (
     OrderPosition,
 )
 from pretix.base.services.async import ProfiledTask
-from pretix.base.signals import register_ticket_outputs
+from pretix.base.signals import order_paid, register_ticket_outputs
+from pretix.base.ticketoutput import is_downloadable
 from pretix.celery_app import app
 from pretix.helpers.database import rolledback_transaction
 
+PREGENERATE_BATCH_SIZE = 50
+PENDING_TIMEOUT = timedelta(minutes=5)
 
-@app.task(base=ProfiledTask)
-def generate(order_position: str, provider: str):
-    order_position = OrderPosition.objects.select_related('order', 'order__event').get(id=order_position)
+
+def _get_cachedticket(order_position: OrderPosition, provider: str) -> CachedTicket:
     try:
-        ct = CachedTicket.objects.get(order_position=order_position, provider=provider)
+        return CachedTicket.objects.get(order_position=order_position, provider=provider)
     except CachedTicket.MultipleObjectsReturned:
         CachedTicket.objects.filter(order_position=order_position, provider=provider).delete()
-        ct = CachedTicket.objects.create(order_position=order_position, provider=provider, extension='',
-                                         type='', file=None)
     except CachedTicket.DoesNotExist:
-        ct = CachedTicket.objects.create(order_position=order_position, provider=provider, extension='',
-                                         type='', file=None)
+        pass
+    return CachedTicket.objects.create(order_position=order_position, provider=provider, extension='',
+                                       type='', file=None)
+
+
+def _store_cachedticket(ct, filename: str, filetype: str, data: bytes):
+    path, ext = os.path.splitext(filename)
+    ct.type = filetype
+    ct.extension = ext
+    ct.save()
+    ct.file.save(filename, ContentFile(data))
+
+
+def _get_output(event: Event, provider: str):
+    responses = register_ticket_outputs.send(event)
+    for receiver, response in responses:
+        prov = response(event)
+        if prov.identifier == provider:
+            return prov
+
+
+@app.task(base=ProfiledTask)
+def generate(order_position: str, provider: str):
+    order_position = OrderPosition.objects.select_related('order', 'order__event').get(id=order_position)
+    ct = _get_cachedticket(order_position, provider)
+    if ct.file:
+        # Another job has been faster
+        return
 
     with language(order_position.order.locale):
-        responses = register_ticket_outputs.send(order_position.order.event)
-        for receiver, response in responses:
-            prov = response(order_position.order.event)
-            if prov.identifier == provider:
-                filename, ct.type, data = prov.generate(order_position)
-                path, ext = os.path.splitext(filename)
-                ct.extension = ext
-                ct.save()
-                ct.file.save(filename, ContentFile(data))
+        prov = _get_output(order_position.order.event, provider)
+        if prov:
+            filename, filetype, data = prov.generate(order_position)
+            _store_cachedticket(ct, filename, filetype, data)
 
 
 @app.task(base=ProfiledTask)
@@ -53,17 +80,123 @@ def generate_order(order: int, provider: str):
     except CachedCombinedTicket.DoesNotExist:
         ct = CachedCombinedTicket.objects.create(order=order, provider=provider, extension='',
                                                  type='', file=None)
+    if ct.file:
+        return
 
     with language(order.locale):
-        responses = register_ticket_outputs.send(order.event)
-        for receiver, response in responses:
-            prov = response(order.event)
-            if prov.identifier == provider:
-                filename, ct.type, data = prov.generate_order(order)
-                path, ext = os.path.splitext(filename)
-                ct.extension = ext
-                ct.save()
-                ct.file.save(filename, ContentFile(data))
+        prov = _get_output(order.event, provider)
+        if prov:
+            filename, filetype, data = prov.generate_order(order)
+            _store_cachedticket(ct, filename, filetype, data)
+
+
+def _claim(model, field: str, objects: list, provider: str) -> list:
+    """
+    Creates empty placeholders for all of the given objects that do not have a cached ticket yet and
+    returns tuples of these objects and their placeholders. The placeholders mark the tickets as being
+    generated, so nobody else starts rendering them in the meantime. Placeholders that have been pending
+    for too long are replaced.
+    """
+    existing = model.objects.filter(**{field + '__in': objects, 'provider': provider})
+    existing.filter(Q(file__isnull=True) | Q(file=''), created__lt=now() - PENDING_TIMEOUT).delete()
+    taken = set(existing.values_list(field + '_id', flat=True))
+    claimed = [
+        (o, model(**{field: o, 'provider': provider, 'extension': '', 'type': '', 'file': None}))
+        for o in objects if o.pk not in taken
+    ]
+    if connection.features.can_return_ids_from_bulk_insert:
+        model.objects.bulk_create([ct for o, ct in claimed])
+    else:
+        # We need to know the IDs of our placeholders to fill exactly these later on
+        for o, ct in claimed:
+            ct.save()
+    return claimed
+
+
+def _store_claimed(ct, filename: str, filetype: str, data: bytes):
+    """
+    Stores a ticket in a placeholder created by :py:func:`_claim`, but only if this placeholder still exists
+    and is still empty. If the cached tickets have been invalidated in the meantime, e.g. because the layout
+    has been changed while we were rendering, the ticket is outdated and is thrown away.
+    """
+    path, ext = os.path.splitext(filename)
+    name = ct.file.field.generate_filename(ct, filename)
+    name = ct.file.storage.save(name, ContentFile(data))
+    updated = type(ct).objects.filter(Q(file__isnull=True) | Q(file=''), pk=ct.pk).update(
+        type=filetype, extension=ext, file=name
+    )
+    if not updated:
+        ct.file.storage.delete(name)
+
+
+@app.task(base=ProfiledTask)
+def pregenerate_orders(orders: list, provider: str=None):
+    """
+    Generates the cached tickets of paid orders of one event in advance, so they are ready by the time
+    the customers want to download them. Tickets that already exist or are currently being generated by
+    another job are skipped. If ``provider`` is given, only the tickets of this output are generated.
+    """
+    orders = list(Order.objects.filter(id__in=orders, status=Order.STATUS_PAID).select_related('event'))
+    if not orders:
+        return
+    event = orders[0].event
+    if not event.settings.ticket_download:
+        return
+    positions = list(OrderPosition.objects.filter(order__in=orders).select_related(
+        'order', 'item', 'variation', 'subevent', 'addon_to'
+    ))
+    for op in positions:
+        op.order.event = event
+    positions = [op for op in positions if is_downloadable(event, op)]
+    for order in orders:
+        order.event = event
+
+    for receiver, response in register_ticket_outputs.send(event):
+        prov = response(event)
+        if not prov.is_enabled or (provider and prov.identifier != provider):
+            continue
+
+        placeholders = dict(_claim(CachedTicket, 'order_position', positions, prov.identifier))
+        for op, (filename, filetype, data) in prov.generate_batch(list(placeholders)):
+            _store_claimed(placeholders[op], filename, filetype, data)
+
+        if prov.multi_download_enabled:
+            for order, ct in _claim(CachedCombinedTicket, 'order', orders, prov.identifier):
+                with language(order.locale):
+                    filename, filetype, data = prov.generate_order(order)
+                _store_claimed(ct, filename, filetype, data)
+
+
+@app.task(base=ProfiledTask)
+def pregenerate_event(event: int, provider: str=None):
+    """
+    Generates the cached tickets of all paid orders of an event in advance, e.g. after the ticket layout
+    has been changed. The orders are split into batches that are rendered in the background queue.
+    """
+    event = Event.objects.get(pk=event)
+    if not event.settings.ticket_download:
+        return
+    ids = list(event.orders.filter(status=Order.STATUS_PAID).order_by('pk').values_list('pk', flat=True))
+    group(
+        pregenerate_orders.si(ids[i:i + PREGENERATE_BATCH_SIZE], provider)
+        for i in range(0, len(ids), PREGENERATE_BATCH_SIZE)
+    ).apply_async()
+
+
+def invalidate_cachedtickets(event: Event, provider: str):
+    """
+    Deletes all cached tickets of one ticket output of an event, e.g. because its layout has been
+    changed, and generates them again in the background once the current transaction is committed.
+    """
+    CachedTicket.objects.filter(order_position__order__event=event, provider=provider).delete()
+    CachedCombinedTicket.objects.filter(order__event=event, provider=provider).delete()
+    transaction.on_commit(lambda: pregenerate_event.apply_async(args=(event.pk, provider)))
+
+
+@receiver(order_paid, dispatch_uid="tickets_pregenerate_order_paid")
+def _pregenerate_paid_order(sender: Event, order: Order, **kwargs):
+    if sender.settings.ticket_download:
+        transaction.on_commit(lambda: pregenerate_orders.apply_async(args=([order.pk],)))
 
 
 class DummyRollbackException(Exception):
@@ -97,6 +230,19 @@ def preview(event: int, provider: str):
                 return prov.generate(p)
 
 
+def _escalate(kind: str, pk: int, provider: str) -> bool:
+    """
+    Returns ``True`` only the first time this is called for a ticket within ``PENDING_TIMEOUT``. This is
+    used to move a ticket that is pending in the background queue to the regular queue as soon as a
+    customer is actually waiting for it. Without a shared cache, this always returns ``True``.
+    """
+    if not settings.REAL_CACHE_USED:
+        # We cannot tell whether this has happened before, so we rather generate the ticket right away
+        # than let the customer wait for the background queue
+        return True
+    return cache.add('pretix_ticketgen_%s_%d_%s' % (kind, pk, provider), True, PENDING_TIMEOUT.total_seconds())
+
+
 def get_cachedticket_for_position(pos, identifier):
     try:
         ct = CachedTicket.objects.filter(
@@ -109,10 +255,10 @@ def get_cachedticket_for_position(pos, identifier):
         ct = CachedTicket.objects.create(
             order_position=pos, provider=identifier,
             extension='', type='', file=None)
+        _escalate('position', pos.pk, identifier)
         generate.apply_async(args=(pos.id, identifier))
-
-    if not ct.file:
-        if now() - ct.created > timedelta(minutes=5):
+    elif not ct.file:
+        if now() - ct.created > PENDING_TIMEOUT or _escalate('position', pos.pk, identifier):
             generate.apply_async(args=(pos.id, identifier))
     return ct
 
@@ -129,9 +275,9 @@ def get_cachedticket_for_order(order, identifier):
         ct = CachedCombinedTicket.objects.create(
             order=order, provider=identifier,
             extension='', type='', file=None)
+        _escalate('order', order.pk, identifier)
         generate_order.apply_async(args=(order.id, identifier))
-
-    if not ct.file:
-        if now() - ct.created > timedelta(minutes=5):
+    elif not ct.file:
+        if now() - ct.created > PENDING_TIMEOUT or _escalate('order', order.pk, identifier):
             generate_order.apply_async(args=(order.id, identifier))
     return ct
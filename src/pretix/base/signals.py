@@ -6,6 +6,8 @@ from django.apps import apps
 from django.conf import settings
 from django.dispatch.dispatcher import NO_RECEIVERS
 
+from pretix.helpers.metrics.instrumentation import signal_timer
+
 from .models import Event
 
 app_cache = {}
@@ -64,10 +66,11 @@ class EventPluginSignal(django.dispatch.Signal):
         if not app_cache:
             _populate_app_cache()
 
-        for receiver in self._live_receivers(sender):
-            if self._is_active(sender, receiver):
-                response = receiver(signal=self, sender=sender, **named)
-                responses.append((receiver, response))
+        with signal_timer():
+            for receiver in self._live_receivers(sender):
+                if self._is_active(sender, receiver):
+                    response = receiver(signal=self, sender=sender, **named)
+                    responses.append((receiver, response))
         return sorted(responses, key=lambda r: (receiver.__module__, receiver.__name__))
 
     def send_chained(self, sender: Event, chain_kwarg_name, **named) -> List[Tuple[Callable, Any]]:
@@ -88,10 +91,11 @@ class EventPluginSignal(django.dispatch.Signal):
         if not app_cache:
             _populate_app_cache()
 
-        for receiver in self._live_receivers(sender):
-            if self._is_active(sender, receiver):
-                named[chain_kwarg_name] = response
-                response = receiver(signal=self, sender=sender, **named)
+        with signal_timer():
+            for receiver in self._live_receivers(sender):
+                if self._is_active(sender, receiver):
+                    named[chain_kwarg_name] = response
+                    response = receiver(signal=self, sender=sender, **named)
         return response
 
 
@@ -282,6 +286,11 @@ time the periodic task cronjob runs. This interval is not sharply defined, it ca
 be everything between a minute and a day. The actions you perform should be
 idempotent, i.e. it should not make a difference if this is sent out more often
 than expected.
+
+Every receiver is run as a separate background task, so you cannot rely on the order
+of receivers and ``sender`` will be ``None``. A receiver is never run again while it is
+still running. If your receiver does not need to run every time, you can limit it with
+the ``pretix.base.services.periodic.minimum_interval`` decorator.
 """
 
 register_global_settings = django.dispatch.Signal()
@@ -1,17 +1,30 @@
 import os
 import tempfile
 from collections import OrderedDict
-from typing import Tuple
+from typing import Iterable, Iterator, Tuple
 from zipfile import ZipFile
 
 from django import forms
 from django.http import HttpRequest
 from django.utils.translation import ugettext_lazy as _
 
+from pretix.base.i18n import language
 from pretix.base.models import Event, Order, OrderPosition
 from pretix.base.settings import SettingsSandbox
 
 
+def is_downloadable(event: Event, position: OrderPosition) -> bool:
+    """
+    Returns whether a ticket can be downloaded for the given position. Depending on the event's settings,
+    add-on products and non-admission products do not get their own tickets.
+    """
+    if position.addon_to_id and not event.settings.ticket_download_addons:
+        return False
+    if not position.item.admission and not event.settings.ticket_download_nonadm:
+        return False
+    return True
+
+
 class BaseTicketOutput:
     """
     This is the base class for all ticket outputs.
@@ -70,13 +83,12 @@ class BaseTicketOutput:
         If you override this method, make sure that positions that are addons (i.e. ``addon_to``
         is set) are only outputted if the event setting ``ticket_download_addons`` is active.
         Do the same for positions that are non-admission without ``ticket_download_nonadm`` active.
+        You can use :py:func:`is_downloadable` to check this.
         """
         with tempfile.TemporaryDirectory() as d:
             with ZipFile(os.path.join(d, 'tmp.zip'), 'w') as zipf:
                 for pos in order.positions.all():
-                    if pos.addon_to_id and not self.event.settings.ticket_download_addons:
-                        continue
-                    if not pos.item.admission and not self.event.settings.ticket_download_nonadm:
+                    if not is_downloadable(self.event, pos):
                         continue
                     fname, __, content = self.generate(pos)
                     zipf.writestr('{}-{}{}'.format(
@@ -86,6 +98,22 @@ class BaseTicketOutput:
             with open(os.path.join(d, 'tmp.zip'), 'rb') as zipf:
                 return '{}-{}.zip'.format(order.code, self.identifier), 'application/zip', zipf.read()
 
+    def generate_batch(self, positions: Iterable[OrderPosition]) -> Iterator[Tuple[OrderPosition, Tuple[str, str, str]]]:
+        """
+        This method is used to generate the download files of many positions at once, e.g. when
+        the tickets of a whole event are generated in advance. It should yield tuples of a position
+        and the return value of ``generate()`` for this position.
+
+        This method is optional to implement. The default implementation calls ``generate()`` for
+        every position in the language of its order. The same instance of your output is used for
+        the whole batch, so if you need to do expensive preparations like loading fonts or templates,
+        it is a good idea to do them only once per instance.
+        """
+        for pos in positions:
+            with language(pos.order.locale):
+                result = self.generate(pos)
+            yield pos, result
+
     @property
     def verbose_name(self) -> str:
         """
@@ -1,6 +1,7 @@
 import logging
 
 import celery.exceptions
+import celery.states
 from celery.result import AsyncResult
 from django.conf import settings
 from django.contrib import messages
@@ -26,15 +27,16 @@ class AsyncAction:
         res = self.task.apply_async(args=args, kwargs=kwargs)
 
         if 'ajax' in self.request.GET or 'ajax' in self.request.POST:
-            data = self._return_ajax_result(res)
+            data = self._return_ajax_result(res, timeout=settings.CELERY_RESULT_WAIT)
             data['check_url'] = self.get_check_url(res.id, True)
             return JsonResponse(data)
         else:
-            if res.ready():
-                if res.successful() and not isinstance(res.info, Exception):
-                    return self.success(res.info)
+            ready, success, info = self._get_state(res)
+            if ready:
+                if success:
+                    return self.success(info)
                 else:
-                    return self.error(res.info)
+                    return self.error(info)
             return redirect(self.get_check_url(res.id, False))
 
     def get_success_url(self, value):
@@ -54,52 +56,66 @@ class AsyncAction:
     def _ajax_response_data(self):
         return {}
 
-    def _return_ajax_result(self, res, timeout=.5):
-        if not res.ready():
+    def _get_state(self, res):
+        # Every access to ready(), state or info may query the result backend, so we only fetch the
+        # state and info once and derive everything else from them. Unless the task is done, info is
+        # only passed on if it contains progress information.
+        state, info = res.state, res.info
+        if state not in celery.states.READY_STATES:
+            return False, False, info if state == 'PROGRESS' else None
+        return True, state == celery.states.SUCCESS and not isinstance(info, Exception), info
+
+    def _return_ajax_result(self, res, timeout=0):
+        # Unless configured otherwise, we only look up the state of the task here and let the browser
+        # ask again, as waiting for the result would keep this web worker busy for the whole time.
+        if timeout and not res.ready():
             try:
                 res.get(timeout=timeout, propagate=False)
             except celery.exceptions.TimeoutError:
                 pass
 
-        ready = res.ready()
+        ready, success, info = self._get_state(res)
         data = self._ajax_response_data()
         data.update({
             'async_id': res.id,
             'ready': ready
         })
+        if not ready and isinstance(info, dict):
+            data['percentage'] = info.get('value', 0)
         if ready:
-            if res.successful() and not isinstance(res.info, Exception):
-                smes = self.get_success_message(res.info)
+            if success:
+                smes = self.get_success_message(info)
                 if smes:
                     messages.success(self.request, smes)
                 # TODO: Do not store message if the ajax client states that it will not redirect
                 # but handle the mssage itself
                 data.update({
-                    'redirect': self.get_success_url(res.info),
+                    'redirect': self.get_success_url(info),
                     'success': True,
-                    'message': str(self.get_success_message(res.info))
+                    'message': str(self.get_success_message(info))
                 })
             else:
-                messages.error(self.request, self.get_error_message(res.info))
+                messages.error(self.request, self.get_error_message(info))
                 # TODO: Do not store message if the ajax client states that it will not redirect
                 # but handle the mssage itself
                 data.update({
                     'redirect': self.get_error_url(),
                     'success': False,
-                    'message': str(self.get_error_message(res.info))
+                    'message': str(self.get_error_message(info))
                 })
         return data
 
     def get_result(self, request):
         res = AsyncResult(request.GET.get('async_id'))
         if 'ajax' in self.request.GET:
-            return JsonResponse(self._return_ajax_result(res, timeout=0.25))
+            return JsonResponse(self._return_ajax_result(res, timeout=settings.CELERY_RESULT_WAIT / 2))
         else:
-            if res.ready():
-                if res.successful() and not isinstance(res.info, Exception):
-                    return self.success(res.info)
+            ready, success, info = self._get_state(res)
+            if ready:
+                if success:
+                    return self.success(info)
                 else:
-                    return self.error(res.info)
+                    return self.error(info)
             return render(request, 'pretixpresale/waiting.html')
 
     def success(self, value):
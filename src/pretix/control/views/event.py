@@ -26,8 +26,8 @@ from i18nfield.strings import LazyI18nString
 from pytz import timezone
 
 from pretix.base.models import (
-    CachedCombinedTicket, CachedTicket, Event, Item, ItemVariation, LogEntry,
-    Order, RequiredAction, TaxRule, Voucher,
+    Event, Item, ItemVariation, LogEntry, Order, RequiredAction, TaxRule,
+    Voucher,
 )
 from pretix.base.models.event import EventMetaValue
 from pretix.base.services import tickets
@@ -668,12 +668,7 @@ class TicketSettings(EventSettingsViewMixin, EventPermissionRequiredMixin, FormV
                             for k in provider.form.changed_data
                         }
                     )
-                    CachedTicket.objects.filter(
-                        order_position__order__event=self.request.event, provider=provider.identifier
-                    ).delete()
-                    CachedCombinedTicket.objects.filter(
-                        order__event=self.request.event, provider=provider.identifier
-                    ).delete()
+                    tickets.invalidate_cachedtickets(self.request.event, provider.identifier)
             else:
                 success = False
         form = self.get_form(self.get_form_class())
@@ -685,6 +680,8 @@ class TicketSettings(EventSettingsViewMixin, EventPermissionRequiredMixin, FormV
                         k: form.cleaned_data.get(k) for k in form.changed_data
                     }
                 )
+                if {'ticket_download', 'ticket_download_addons', 'ticket_download_nonadm'} & set(form.changed_data):
+                    transaction.on_commit(lambda: tickets.pregenerate_event.apply_async(args=(self.request.event.pk,)))
 
             messages.success(self.request, _('Your changes have been saved.'))
             return redirect(self.get_success_url())
@@ -1,6 +1,7 @@
 import contextlib
 
 from django.db import transaction
+from django.db.models import Q
 from django.db.models.expressions import OrderBy
 
 
@@ -29,6 +30,34 @@ def rolledback_transaction():
         raise Exception('Invalid state, should have rolled back.')
 
 
+def keyset_batches(queryset, batch_size=500, order_field=None):
+    """
+    Iterates over a queryset in lists of at most ``batch_size`` objects, ordered by primary key
+    or, if ``order_field`` is given, by this (non-nullable) field and the primary key. Every
+    batch is fetched with a separate query that continues after the last object of the previous
+    batch instead of using ``OFFSET``, so even the last batches of a large table are cheap to
+    fetch. Any ``prefetch_related`` lookups are executed per batch, which keeps memory usage
+    constant regardless of the size of the queryset.
+    """
+    queryset = queryset.order_by(order_field, 'pk') if order_field else queryset.order_by('pk')
+    last = None
+    while True:
+        if last is None:
+            qs = queryset
+        elif order_field:
+            value = getattr(last, order_field)
+            qs = queryset.filter(
+                Q(**{order_field + '__gt': value}) | Q(**{order_field: value, 'pk__gt': last.pk})
+            )
+        else:
+            qs = queryset.filter(pk__gt=last.pk)
+        batch = list(qs[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
 @contextlib.contextmanager
 def casual_reads():
     """
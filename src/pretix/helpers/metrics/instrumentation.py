@@ -0,0 +1,143 @@
+import heapq
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.backends.utils import CursorWrapper
+
+SLOW_QUERIES_LOGGED = 10
+
+_local = threading.local()
+
+
+class RequestStats:
+    """
+    Collects the time spent in the database, the cache, locks and plugin signals while handling
+    one request. If ``keep_queries`` is set, the slowest queries are kept for the slow request log.
+    """
+
+    def __init__(self, keep_queries=False):
+        self.keep_queries = keep_queries
+        self.db_queries = 0
+        self.db_time = 0
+        self.cache_calls = 0
+        self.cache_time = 0
+        self.lock_time = 0
+        self.signal_time = 0
+        self.signal_depth = 0
+        self.queries = []
+
+    def query(self, sql, duration):
+        self.db_queries += 1
+        self.db_time += duration
+        if self.keep_queries:
+            item = (duration, self.db_queries, sql)
+            if len(self.queries) < SLOW_QUERIES_LOGGED:
+                heapq.heappush(self.queries, item)
+            elif duration > self.queries[0][0]:
+                heapq.heapreplace(self.queries, item)
+
+    def slowest_queries(self):
+        return [(duration, sql) for duration, i, sql in sorted(self.queries, reverse=True)]
+
+
+def current():
+    """
+    Returns the statistics of the request that is currently handled by this thread, or ``None`` if
+    nothing is being collected.
+    """
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def collect(keep_queries=False):
+    stats = RequestStats(keep_queries=keep_queries)
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = None
+
+
+def add_lock_time(duration):
+    stats = current()
+    if stats is not None:
+        stats.lock_time += duration
+
+
+@contextmanager
+def signal_timer():
+    stats = current()
+    if stats is None or stats.signal_depth:
+        # Signals sent by receivers of other signals are already included in the outer signal's time
+        yield
+        return
+    t0 = time.perf_counter()
+    stats.signal_depth += 1
+    try:
+        yield
+    finally:
+        stats.signal_depth -= 1
+        stats.signal_time += time.perf_counter() - t0
+
+
+def timed_cache_call(func):
+    """
+    Decorator for the methods of a cache class that counts the calls and their duration.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        stats = current()
+        if stats is None:
+            return func(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.cache_calls += 1
+            stats.cache_time += time.perf_counter() - t0
+    return wrapper
+
+
+class InstrumentedCursorWrapper(CursorWrapper):
+
+    def _timed(self, method, sql, *args):
+        stats = current()
+        if stats is None:
+            return method(sql, *args)
+        t0 = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            stats.query(sql, time.perf_counter() - t0)
+
+    def execute(self, sql, params=None):
+        return self._timed(super().execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(super().executemany, sql, param_list)
+
+
+def _instrument_connection(connection):
+    # Django 1.11 has no connection.execute_wrapper() yet, so we replace the cursor class instead
+    connection.make_cursor = lambda cursor: InstrumentedCursorWrapper(cursor, connection)
+
+
+def _connection_created(sender, connection, **kwargs):
+    _instrument_connection(connection)
+
+
+def install():
+    """
+    Makes sure all database queries are recorded. This only needs to be called once per process,
+    but it is safe to call it again.
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    connection_created.connect(_connection_created, dispatch_uid='pretix_metrics_instrumentation')
+    for connection in connections.all():
+        _instrument_connection(connection)
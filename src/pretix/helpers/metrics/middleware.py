@@ -1,8 +1,18 @@
+import logging
 import time
 
+from django.conf import settings
 from django.urls import resolve
 
-from pretix.base.metrics import pretix_view_duration_seconds
+from pretix.base.metrics import (
+    pretix_view_cache_calls, pretix_view_cache_seconds, pretix_view_db_queries,
+    pretix_view_db_seconds, pretix_view_duration_seconds,
+    pretix_view_lock_seconds, pretix_view_signal_seconds,
+)
+
+from . import instrumentation
+
+logger = logging.getLogger('pretix.helpers.metrics')
 
 
 class MetricsMiddleware(object):
@@ -15,6 +25,7 @@ class MetricsMiddleware(object):
     def __init__(self, get_response):
         self.get_response = get_response
         # One-time configuration and initialization.
+        instrumentation.install()
 
     def __call__(self, request):
         # Code to be executed for each request before
@@ -24,11 +35,29 @@ class MetricsMiddleware(object):
                 return self.get_response(request)
 
         url = resolve(request.path_info)
+        url_name = url.namespace + ':' + url.url_name
+
+        with instrumentation.collect(keep_queries=bool(settings.METRICS_SLOW_REQUEST)) as stats:
+            t0 = time.perf_counter()
+            resp = self.get_response(request)
+            tdiff = time.perf_counter() - t0
 
-        t0 = time.perf_counter()
-        resp = self.get_response(request)
-        tdiff = time.perf_counter() - t0
         pretix_view_duration_seconds.observe(tdiff, status_code=resp.status_code, method=request.method,
-                                             url_name=url.namespace + ':' + url.url_name)
+                                             url_name=url_name)
+        pretix_view_db_queries.observe(stats.db_queries, url_name=url_name)
+        pretix_view_db_seconds.observe(stats.db_time, url_name=url_name)
+        pretix_view_cache_calls.observe(stats.cache_calls, url_name=url_name)
+        pretix_view_cache_seconds.observe(stats.cache_time, url_name=url_name)
+        pretix_view_lock_seconds.observe(stats.lock_time, url_name=url_name)
+        pretix_view_signal_seconds.observe(stats.signal_time, url_name=url_name)
+
+        if settings.METRICS_SLOW_REQUEST and tdiff >= settings.METRICS_SLOW_REQUEST:
+            logger.warning(
+                'Slow request: %s %s (%s) took %.3fs, %d queries in %.3fs, %d cache calls in %.3fs, '
+                '%.3fs waiting for locks, %.3fs in signals. Slowest queries:\n%s',
+                request.method, request.path, url_name, tdiff, stats.db_queries, stats.db_time,
+                stats.cache_calls, stats.cache_time, stats.lock_time, stats.signal_time,
+                '\n'.join('%.3fs %s' % q for q in stats.slowest_queries())
+            )
 
         return resp
@@ -4,6 +4,9 @@ import random
 import time
 
 from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from .sampling import profiler
 
 
 class CProfileMiddleware(object):
@@ -36,3 +39,28 @@ class CProfileMiddleware(object):
             return response
         else:
             return self.get_response(request)
+
+
+class SamplingProfilerMiddleware(object):
+    blacklist = (
+        '/healthcheck/',
+        '/jsi18n/',
+        '/metrics',
+    )
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        for b in self.blacklist:
+            if b in request.path:
+                return self.get_response(request)
+
+        try:
+            url = resolve(request.path_info)
+        except Resolver404:
+            return self.get_response(request)
+        # Views without a name are labeled with the path of the view function instead
+        label = url.namespace + ':' + url.url_name if url.url_name else url.view_name
+        with profiler.activate(label):
+            return self.get_response(request)
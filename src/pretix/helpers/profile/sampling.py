@@ -0,0 +1,123 @@
+import atexit
+import glob
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+MAX_DEPTH = 128
+WRITE_INTERVAL = 30
+
+
+class SamplingProfiler:
+    """
+    A statistical profiler with low overhead that can run all the time. A background thread looks at the
+    stacks of all threads that currently handle a request or a task every ``PROFILING_SAMPLE_INTERVAL``
+    seconds and counts how often every stack has been seen, prefixed with the name of the view or task.
+
+    Every process writes its counts to a file in ``PROFILE_DIR`` from time to time. The ``profilestacks``
+    management command merges these files into the collapsed stack format understood by flame graph tools.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._labels = {}
+        self._names = {}
+        self._stacks = Counter()
+
+    def _ensure_started(self):
+        # The sampling thread does not survive a fork, so every process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._labels = {}
+            self._stacks = Counter()
+        if settings.PROFILING_SAMPLE_INTERVAL > 0:
+            threading.Thread(target=self._run, name='pretix-sampling-profiler', daemon=True).start()
+            atexit.register(self.write)
+
+    @contextmanager
+    def activate(self, label: str):
+        """
+        Marks the current thread as working on ``label`` until the block is left. Only active threads
+        are sampled.
+        """
+        self._ensure_started()
+        ident = threading.get_ident()
+        self._labels[ident] = label
+        try:
+            yield
+        finally:
+            self._labels.pop(ident, None)
+
+    def _name(self, frame):
+        code = frame.f_code
+        name = self._names.get(code)
+        if name is None:
+            name = self._names[code] = '{}:{}'.format(frame.f_globals.get('__name__', '?'), code.co_name)
+        return name
+
+    def sample(self):
+        frames = sys._current_frames()
+        stacks = []
+        for ident, label in list(self._labels.items()):
+            frame = frames.get(ident)
+            names = []
+            while frame is not None and len(names) < MAX_DEPTH:
+                names.append(self._name(frame))
+                frame = frame.f_back
+            if names:
+                names.append(label)
+                stacks.append(';'.join(reversed(names)))
+        with self._lock:
+            self._stacks.update(stacks)
+
+    def _run(self):
+        pid = os.getpid()
+        last_write = time.monotonic()
+        while self._pid == pid:
+            time.sleep(settings.PROFILING_SAMPLE_INTERVAL)
+            self.sample()
+            if time.monotonic() - last_write > WRITE_INTERVAL:
+                self.write()
+                last_write = time.monotonic()
+
+    def write(self):
+        """
+        Writes all stacks counted by this process so far to its file in ``PROFILE_DIR``.
+        """
+        with self._lock:
+            stacks = dict(self._stacks)
+        if not stacks or self._pid != os.getpid():
+            return
+        path = os.path.join(settings.PROFILE_DIR, 'stacks_{}.txt'.format(os.getpid()))
+        with open(path + '.tmp', 'w') as f:
+            for stack, count in stacks.items():
+                f.write('{} {}\n'.format(stack, count))
+        os.replace(path + '.tmp', path)
+
+
+def read_stacks(label: str=None) -> Counter:
+    """
+    Merges the stacks written by all processes. If ``label`` is given, only stacks of this view or task
+    are returned.
+    """
+    stacks = Counter()
+    for path in glob.glob(os.path.join(settings.PROFILE_DIR, 'stacks_*.txt')):
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack and (label is None or stack.split(';', 1)[0] == label):
+                    stacks[stack] += int(count)
+    return stacks
+
+
+profiler = SamplingProfiler()
@@ -1,6 +1,7 @@
 import json
 import logging
 import re
+from collections import OrderedDict
 from decimal import Decimal
 
 from celery.exceptions import MaxRetriesExceededError
@@ -10,74 +11,150 @@ from django.db.models import Q
 from django.utils.translation import ugettext_noop
 
 from pretix.base.i18n import language
-from pretix.base.models import Event, Order, Organizer, Quota
+from pretix.base.models import Event, Order, Organizer
 from pretix.base.services.async import TransactionAwareTask
 from pretix.base.services.locking import LockTimeoutException
-from pretix.base.services.mail import SendMailException
-from pretix.base.services.orders import mark_order_paid
+from pretix.base.services.orders import mark_orders_paid
 from pretix.celery_app import app
 
 from .models import BankImportJob, BankTransaction
 
 logger = logging.getLogger(__name__)
+LOOKUP_BATCH_SIZE = 500
+PAYMENT_BATCH_SIZE = 200
 
 
-def _handle_transaction(trans: BankTransaction, code: str, event: Event=None, organizer: Organizer=None,
-                        slug: str=None):
+def _match_transactions(transactions: list, event: Event=None, organizer: Organizer=None):
+    """
+    Extracts the order codes from the references of all transactions and looks up the matching orders
+    with as few queries as possible. Returns a list of tuples of a transaction and its order or ``None``.
+    """
+    code_len = settings.ENTROPY['order_code']
     if event:
-        try:
-            trans.order = event.orders.get(code=code)
-        except Order.DoesNotExist:
-            normalized_code = Order.normalize_code(code)
-            try:
-                trans.order = event.orders.get(code=normalized_code)
-            except Order.DoesNotExist:
-                trans.state = BankTransaction.STATE_NOMATCH
-                trans.save()
-                return
+        pattern = re.compile(event.slug.upper() + "[ \-_]*([A-Z0-9]{%s})" % code_len)
     else:
-        qs = Order.objects.filter(event__organizer=organizer)
-        if slug:
-            qs = qs.filter(event__slug__iexact=slug)
-        try:
-            trans.order = qs.get(code=code)
-        except Order.DoesNotExist:
-            normalized_code = Order.normalize_code(code)
-            try:
-                trans.order = qs.get(code=normalized_code)
-            except Order.DoesNotExist:
-                trans.state = BankTransaction.STATE_NOMATCH
-                trans.save()
-                return
+        prefixes = [e.slug.upper().replace(".", r"\.").replace("-", r"\-")
+                    for e in organizer.events.all()]
+        pattern = re.compile("(%s)[ \-_]*([A-Z0-9]{%s})" % ("|".join(prefixes), code_len))
+
+    candidates = []
+    for trans in transactions:
+        match = pattern.search(trans.reference.replace(" ", "").replace("\n", "").upper())
+        if not match:
+            candidates.append((trans, None, None))
+        elif event:
+            candidates.append((trans, event.slug.upper(), match.group(1)))
+        else:
+            candidates.append((trans, match.group(1), match.group(2)))
 
-    if trans.order.status == Order.STATUS_PAID:
-        trans.state = BankTransaction.STATE_DUPLICATE
-    elif trans.order.status == Order.STATUS_REFUNDED:
+    codes = set()
+    for trans, slug, code in candidates:
+        if code:
+            codes |= {code, Order.normalize_code(code)}
+    codes = sorted(codes)
+
+    if event:
+        qs = event.orders.all()
+    else:
+        qs = Order.objects.filter(event__organizer=organizer).select_related('event')
+    orders = {}
+    events = {}
+    for i in range(0, len(codes), LOOKUP_BATCH_SIZE):
+        for order in qs.filter(code__in=codes[i:i + LOOKUP_BATCH_SIZE]):
+            # Make sure all orders of an event share the same instance, which is the one we will lock
+            order.event = event or events.setdefault(order.event_id, order.event)
+            orders[order.event.slug.upper(), order.code] = order
+
+    return [
+        (trans, orders.get((slug, code)) or orders.get((slug, Order.normalize_code(code))) if code else None)
+        for trans, slug, code in candidates
+    ]
+
+
+def _set_order_state(trans: BankTransaction, order: Order):
+    # Sets the state of a transaction for an order that can no longer be paid
+    if order.status == Order.STATUS_REFUNDED:
         trans.state = BankTransaction.STATE_ERROR
         trans.message = ugettext_noop('The order has already been refunded.')
-    elif trans.order.status == Order.STATUS_CANCELED:
+    elif order.status == Order.STATUS_CANCELED:
         trans.state = BankTransaction.STATE_ERROR
         trans.message = ugettext_noop('The order has already been canceled.')
-    elif trans.amount != trans.order.total:
-        trans.state = BankTransaction.STATE_INVALID
-        trans.message = ugettext_noop('The transaction amount is incorrect.')
     else:
-        try:
-            mark_order_paid(trans.order, provider='banktransfer', info=json.dumps({
-                'reference': trans.reference,
-                'date': trans.date,
-                'payer': trans.payer,
-                'trans_id': trans.pk
-            }))
-        except Quota.QuotaExceededException as e:
-            trans.state = BankTransaction.STATE_ERROR
-            trans.message = str(e)
-        except SendMailException:
+        trans.state = BankTransaction.STATE_DUPLICATE
+
+
+def _mark_paid(event: Event, batch: list):
+    """
+    Marks the orders of a batch of transactions as paid while locking the event only once. Every item of
+    the batch is a list of all transactions that refer to the same order, the first of which is treated
+    as the payment and all others as duplicates.
+    """
+    pending = OrderedDict((trans.order.pk, (trans, duplicates)) for trans, *duplicates in batch)
+
+    def save_result(order, error):
+        # Runs in the same database transaction as the payment itself, so a payment is never committed
+        # without the transaction it has been made with
+        trans, duplicates = pending.pop(order.pk)
+        if error:
             trans.state = BankTransaction.STATE_ERROR
-            trans.message = ugettext_noop('Problem sending email.')
+            trans.message = str(error)
         else:
             trans.state = BankTransaction.STATE_VALID
-    trans.save()
+        trans.save()
+        for dup in duplicates:
+            if error:
+                dup.state = BankTransaction.STATE_ERROR
+                dup.message = trans.message
+            else:
+                dup.state = BankTransaction.STATE_DUPLICATE
+            dup.save()
+
+    mark_orders_paid(event, [
+        (trans.order, json.dumps({
+            'reference': trans.reference,
+            'date': trans.date,
+            'payer': trans.payer,
+            'trans_id': trans.pk
+        }))
+        for trans, *duplicates in batch
+    ], provider='banktransfer', on_result=save_result)
+
+    # The remaining orders have been paid, refunded or canceled by someone else since we looked them up
+    with transaction.atomic():
+        for trans, duplicates in pending.values():
+            for t in [trans] + duplicates:
+                _set_order_state(t, trans.order)
+                t.save()
+
+
+def _process_transactions(transactions: list, event: Event=None, organizer: Organizer=None):
+    payments = OrderedDict()
+    with transaction.atomic():
+        for trans, order in _match_transactions(transactions, event=event, organizer=organizer):
+            trans.order = order
+            if order is None:
+                trans.state = BankTransaction.STATE_NOMATCH
+            elif order.pk in payments:
+                # The order is already being paid by an earlier transaction of this import, we will
+                # know whether this is a duplicate once we tried that.
+                payments[order.pk].append(trans)
+                continue
+            elif order.status in (Order.STATUS_PAID, Order.STATUS_REFUNDED, Order.STATUS_CANCELED):
+                _set_order_state(trans, order)
+            elif trans.amount != order.total:
+                trans.state = BankTransaction.STATE_INVALID
+                trans.message = ugettext_noop('The transaction amount is incorrect.')
+            else:
+                payments[order.pk] = [trans]
+                continue
+            trans.save()
+
+    by_event = OrderedDict()
+    for transes in payments.values():
+        by_event.setdefault(transes[0].order.event, []).append(transes)
+    for ev, batches in by_event.items():
+        for i in range(0, len(batches), PAYMENT_BATCH_SIZE):
+            _mark_paid(ev, batches[i:i + PAYMENT_BATCH_SIZE])
 
 
 def _get_unknown_transactions(job: BankImportJob, data: list, event: Event=None, organizer: Organizer=None):
@@ -124,39 +201,13 @@ def process_banktransfers(self, job: int, data: list) -> None:
         job = BankImportJob.objects.get(pk=job)
         job.state = BankImportJob.STATE_RUNNING
         job.save()
-        prefixes = []
 
         try:
             # Delete left-over transactions from a failed run before so they can reimported
             BankTransaction.objects.filter(state=BankTransaction.STATE_UNCHECKED, **job.owner_kwargs).delete()
 
             transactions = _get_unknown_transactions(job, data, **job.owner_kwargs)
-
-            code_len = settings.ENTROPY['order_code']
-            if job.event:
-                pattern = re.compile(job.event.slug.upper() + "[ \-_]*([A-Z0-9]{%s})" % code_len)
-            else:
-                if not prefixes:
-                    prefixes = [e.slug.upper().replace(".", r"\.").replace("-", r"\-")
-                                for e in job.organizer.events.all()]
-                pattern = re.compile("(%s)[ \-_]*([A-Z0-9]{%s})" % ("|".join(prefixes), code_len))
-
-            for trans in transactions:
-                match = pattern.search(trans.reference.replace(" ", "").replace("\n", "").upper())
-
-                if match:
-                    if job.event:
-                        code = match.group(1)
-                        with transaction.atomic():
-                            _handle_transaction(trans, code, event=job.event)
-                    else:
-                        slug = match.group(1)
-                        code = match.group(2)
-                        with transaction.atomic():
-                            _handle_transaction(trans, code, organizer=job.organizer, slug=slug)
-                else:
-                    trans.state = BankTransaction.STATE_NOMATCH
-                    trans.save()
+            _process_transactions(transactions, **job.owner_kwargs)
         except LockTimeoutException:
             try:
                 self.retry()
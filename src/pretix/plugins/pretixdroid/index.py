@@ -0,0 +1,287 @@
+import json
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+
+from pretix.base.models import Checkin, CheckinList, OrderPosition
+
+logger = logging.getLogger('pretix.plugins.pretixdroid.index')
+INDEX_TIMEOUT = 3600 * 6
+BUILD_LOCK_TIMEOUT = 120
+
+
+def index_enabled():
+    return settings.PRETIX_CHECKIN_INDEX and settings.HAS_REDIS
+
+
+def _redis():
+    from django_redis import get_redis_connection
+
+    return get_redis_connection("redis")
+
+
+def _event_key(event_id):
+    return 'pretix_secretindex_event_%d' % event_id
+
+
+class SecretIndex:
+    """
+    A Redis-backed index of all ticket secrets of a check-in list. For every secret, it stores
+    whether the ticket is paid, whether its product is valid on the list and the data that is
+    returned to the device, so scans can be validated without any database queries. Check-ins
+    are tracked in a second hash that maps secrets to the nonce of their first scan. The index
+    is built lazily on first use and kept up to date by the signal receivers in
+    ``pretix.plugins.pretixdroid.signals``. It is a cache: If it expires or is invalidated, it
+    will be rebuilt from the database.
+
+    Only one process builds the index of a list at a time. It writes the entries to temporary keys
+    and renames them once they are complete. The check-ins hash is never deleted or replaced while
+    the index is in use, as devices claim check-ins in it. Check-ins from the database are merged
+    into it instead.
+    """
+
+    def __init__(self, checkin_list, rc=None):
+        self.list = checkin_list
+        self.rc = rc or _redis()
+        self.entries_key = 'pretix_secretindex_%d' % checkin_list.pk
+        self.checkins_key = 'pretix_secretindex_%d_checkins' % checkin_list.pk
+        self.positions_key = 'pretix_secretindex_%d_positions' % checkin_list.pk
+        self.build_key = 'pretix_secretindex_%d_build' % checkin_list.pk
+        self.generation_key = 'pretix_secretindex_%d_generation' % checkin_list.pk
+        self.dirty_key = 'pretix_secretindex_%d_dirty' % checkin_list.pk
+
+    def get(self, secret):
+        """
+        Returns the index entry for the given secret or ``None`` if the secret is not known or the
+        index is currently being built by someone else.
+        """
+        if not self.rc.exists(self.entries_key) or not self.rc.exists(self.checkins_key):
+            if not self.build():
+                return None
+        value = self.rc.hget(self.entries_key, secret) if secret else None
+        return json.loads(value.decode()) if value else None
+
+    def checkin(self, secret, nonce):
+        """
+        Atomically marks a secret as checked in. Returns a tuple of a boolean that is ``True``
+        if the ticket has not been checked in before and the nonce of its first check-in.
+        """
+        if self.rc.hsetnx(self.checkins_key, secret, nonce or ''):
+            return True, nonce
+        return False, (self.rc.hget(self.checkins_key, secret) or b'').decode() or None
+
+    def revert_checkin(self, secret):
+        self.rc.hdel(self.checkins_key, secret)
+
+    def build(self):
+        """
+        Builds the index from the database. Returns ``False`` if the index is already being built by
+        someone else or has been invalidated while we were building it.
+        """
+        from redis.exceptions import WatchError
+
+        from .views import serialize_op
+
+        token = uuid.uuid4().hex
+        if not self.rc.set(self.build_key, token, nx=True, ex=BUILD_LOCK_TIMEOUT):
+            return False
+        try:
+            generation = self.rc.get(self.generation_key)
+            # Positions that change from now on are applied again once the new index is in place
+            self.rc.delete(self.dirty_key)
+            self.rc.sadd(_event_key(self.list.event_id), self.list.pk)
+            self.rc.expire(_event_key(self.list.event_id), INDEX_TIMEOUT)
+
+            products = None
+            if not self.list.all_products:
+                products = set(self.list.limit_products.values_list('id', flat=True))
+
+            entries = {}
+            positions = {}
+            qs = OrderPosition.objects.filter(
+                order__event=self.list.event, subevent=self.list.subevent
+            ).select_related('item', 'variation', 'order', 'order__invoice_address', 'addon_to')
+            for op in qs.iterator():
+                entries[op.secret] = json.dumps(self._entry(op, products, serialize_op))
+                positions[op.pk] = op.secret
+            checkins = Checkin.objects.filter(list=self.list).values_list('position__secret', 'nonce')
+
+            tmp_entries_key = '%s_tmp_%s' % (self.entries_key, token)
+            tmp_positions_key = '%s_tmp_%s' % (self.positions_key, token)
+            pipe = self.rc.pipeline()
+            # The empty field marks the hashes as built even if there are no tickets yet
+            pipe.hmset(tmp_entries_key, dict(entries, **{'': ''}))
+            pipe.hmset(tmp_positions_key, dict(positions, **{'': ''}))
+            for key in (tmp_entries_key, tmp_positions_key):
+                pipe.expire(key, BUILD_LOCK_TIMEOUT)
+            for secret, nonce in checkins:
+                pipe.hsetnx(self.checkins_key, secret, nonce or '')
+            pipe.hsetnx(self.checkins_key, '', '')
+            pipe.execute()
+
+            with self.rc.pipeline() as pipe:
+                try:
+                    pipe.watch(self.generation_key)
+                    if pipe.get(self.generation_key) != generation:
+                        pipe.reset()
+                        self.rc.delete(tmp_entries_key, tmp_positions_key)
+                        return False
+                    pipe.multi()
+                    pipe.rename(tmp_entries_key, self.entries_key)
+                    pipe.rename(tmp_positions_key, self.positions_key)
+                    for key in (self.entries_key, self.checkins_key, self.positions_key):
+                        pipe.expire(key, INDEX_TIMEOUT)
+                    pipe.execute()
+                except WatchError:
+                    self.rc.delete(tmp_entries_key, tmp_positions_key)
+                    return False
+
+            pipe = self.rc.pipeline()
+            pipe.smembers(self.dirty_key)
+            pipe.delete(self.dirty_key)
+            dirty = pipe.execute()[0]
+            self.update([int(pid) for pid in dirty])
+            return True
+        finally:
+            if self.rc.get(self.build_key) == token.encode():
+                self.rc.delete(self.build_key)
+
+    def invalidate(self):
+        """
+        Removes the entries of the index, so it will be rebuilt on next use. A build that is running
+        at the same time will not put its results in place.
+        """
+        pipe = self.rc.pipeline()
+        pipe.incr(self.generation_key)
+        pipe.expire(self.generation_key, INDEX_TIMEOUT)
+        pipe.delete(self.entries_key, self.positions_key)
+        pipe.execute()
+
+    def update(self, position_ids):
+        from .views import serialize_op
+
+        if not position_ids:
+            return
+
+        # If the index is being built right now, the builder might have read these positions
+        # before they changed, so we tell it to apply them again.
+        pipe = self.rc.pipeline()
+        pipe.sadd(self.dirty_key, *position_ids)
+        pipe.expire(self.dirty_key, BUILD_LOCK_TIMEOUT)
+        pipe.execute()
+        if not self.rc.exists(self.entries_key):
+            return
+
+        products = None
+        if not self.list.all_products:
+            products = set(self.list.limit_products.values_list('id', flat=True))
+
+        qs = OrderPosition.objects.filter(
+            pk__in=position_ids, subevent=self.list.subevent
+        ).select_related('item', 'variation', 'order', 'order__invoice_address', 'addon_to')
+        ops = {op.pk: op for op in qs}
+        checked_in = dict(
+            Checkin.objects.filter(list=self.list, position__in=ops.keys()).values_list('position_id', 'nonce')
+        )
+        old_secrets = dict(zip(position_ids, self.rc.hmget(self.positions_key, position_ids)))
+
+        pipe = self.rc.pipeline()
+        for pid in position_ids:
+            old_secret = old_secrets.get(pid)
+            op = ops.get(pid)
+            if old_secret and (not op or old_secret.decode() != op.secret):
+                pipe.hdel(self.entries_key, old_secret)
+                pipe.hdel(self.checkins_key, old_secret)
+                pipe.hdel(self.positions_key, pid)
+            if op:
+                pipe.hset(self.entries_key, op.secret, json.dumps(self._entry(op, products, serialize_op)))
+                pipe.hset(self.positions_key, op.pk, op.secret)
+                if op.pk in checked_in:
+                    pipe.hsetnx(self.checkins_key, op.secret, checked_in[op.pk] or '')
+        pipe.execute()
+
+    def _entry(self, op, products, serialize_op):
+        return {
+            'position': op.pk,
+            'positionid': op.positionid,
+            'order': op.order_id,
+            'item': op.item_id,
+            'paid': op.order.status == op.order.STATUS_PAID,
+            'product_allowed': products is None or op.item_id in products,
+            'data': serialize_op(op, redeemed=False),
+        }
+
+
+def _built_lists(rc, event_id):
+    list_ids = rc.smembers(_event_key(event_id))
+    if not list_ids:
+        return []
+    return list(CheckinList.objects.filter(event_id=event_id, pk__in=[int(i) for i in list_ids]))
+
+
+def update_positions(event_id, position_ids):
+    """
+    Updates the entries of the given positions in all indexes that have been built for check-in lists
+    of this event. This should be called after the transaction that changed the positions has been
+    committed.
+    """
+    rc = _redis()
+    for cl in _built_lists(rc, event_id):
+        SecretIndex(cl, rc=rc).update(list(position_ids))
+
+
+def invalidate_event(event_id):
+    rc = _redis()
+    for cl in _built_lists(rc, event_id):
+        SecretIndex(cl, rc=rc).invalidate()
+
+
+def invalidate_list(checkin_list):
+    SecretIndex(checkin_list).invalidate()
+
+
+def checkins_created(checkin_list, checkins):
+    """
+    Marks the secrets of check-ins that have been stored without going through the index as checked in.
+    ``checkins`` is a list of tuples of a secret and the nonce of its check-in.
+    """
+    rc = _redis()
+    idx = SecretIndex(checkin_list, rc=rc)
+    if not checkins or not rc.exists(idx.checkins_key):
+        return
+    pipe = rc.pipeline()
+    for secret, nonce in checkins:
+        pipe.hsetnx(idx.checkins_key, secret, nonce or '')
+    pipe.execute()
+
+
+def checkin_deleted(checkin_list, position_id):
+    rc = _redis()
+    idx = SecretIndex(checkin_list, rc=rc)
+    if not rc.exists(idx.checkins_key):
+        return
+    if not Checkin.objects.filter(list=checkin_list, position_id=position_id).exists():
+        # The check-ins hash outlives the other parts of the index, so we might need to look up the secret
+        secret = rc.hget(idx.positions_key, position_id) or OrderPosition.objects.filter(
+            pk=position_id
+        ).values_list('secret', flat=True).first()
+        if secret:
+            idx.revert_checkin(secret)
+
+
+def after_commit(func, *args):
+    """
+    Runs one of the update functions of this module once the current transaction has been committed.
+    A failing Redis server should not break the write itself, so errors are only logged.
+    """
+    from redis.exceptions import RedisError
+
+    def run():
+        try:
+            func(*args)
+        except RedisError:
+            logger.exception('Error updating the secret index')
+
+    transaction.on_commit(run)
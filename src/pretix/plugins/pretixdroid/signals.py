@@ -3,14 +3,23 @@ import json
 import dateutil.parser
 import pytz
 from django.core.urlresolvers import resolve, reverse
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.utils.formats import date_format
 from django.utils.translation import ugettext_lazy as _
 
-from pretix.base.models import CheckinList
+from pretix.base.models import (
+    Checkin, CheckinList, InvoiceAddress, Item, ItemVariation, Order,
+    OrderPosition,
+)
 from pretix.base.signals import logentry_display
 from pretix.control.signals import nav_event
 
+from .index import (
+    after_commit, checkin_deleted, checkins_created, index_enabled,
+    invalidate_event, invalidate_list, update_positions,
+)
+
 
 @receiver(nav_event, dispatch_uid="pretixdroid_nav")
 def control_nav_import(sender, request=None, **kwargs):
@@ -81,3 +90,61 @@ def pretixcontrol_logentry_display(sender, logentry, **kwargs):
                 list=checkin_list
             )
         )
+
+
+@receiver(post_save, sender=Order, dispatch_uid="pretixdroid_index_order")
+def index_order_changed(sender, instance, **kwargs):
+    if index_enabled():
+        after_commit(update_positions, instance.event_id, list(instance.positions.values_list('id', flat=True)))
+
+
+@receiver(post_save, sender=OrderPosition, dispatch_uid="pretixdroid_index_position_saved")
+@receiver(post_delete, sender=OrderPosition, dispatch_uid="pretixdroid_index_position_deleted")
+def index_position_changed(sender, instance, **kwargs):
+    if index_enabled():
+        try:
+            event_id = instance.order.event_id
+        except Order.DoesNotExist:  # The whole order has been deleted
+            return
+        after_commit(update_positions, event_id, [instance.pk])
+
+
+@receiver(post_save, sender=InvoiceAddress, dispatch_uid="pretixdroid_index_invoiceaddress")
+def index_invoiceaddress_changed(sender, instance, **kwargs):
+    if index_enabled() and instance.order_id:
+        after_commit(update_positions, instance.order.event_id,
+                     list(instance.order.positions.values_list('id', flat=True)))
+
+
+@receiver(post_save, sender=Checkin, dispatch_uid="pretixdroid_index_checkin_saved")
+def index_checkin_created(sender, instance, created, **kwargs):
+    # Check-ins made through the index have already been recorded in it
+    if index_enabled() and created and not getattr(instance, '_indexed', False):
+        after_commit(checkins_created, instance.list, [(instance.position.secret, instance.nonce)])
+
+
+@receiver(post_delete, sender=Checkin, dispatch_uid="pretixdroid_index_checkin_deleted")
+def index_checkin_deleted(sender, instance, **kwargs):
+    if index_enabled():
+        after_commit(checkin_deleted, instance.list, instance.position_id)
+
+
+@receiver(post_save, sender=CheckinList, dispatch_uid="pretixdroid_index_list_saved")
+@receiver(post_delete, sender=CheckinList, dispatch_uid="pretixdroid_index_list_deleted")
+def index_list_changed(sender, instance, **kwargs):
+    if index_enabled():
+        after_commit(invalidate_list, instance)
+
+
+@receiver(m2m_changed, sender=CheckinList.limit_products.through, dispatch_uid="pretixdroid_index_list_products")
+def index_list_products_changed(sender, instance, action, **kwargs):
+    if index_enabled() and action.startswith('post_') and isinstance(instance, CheckinList):
+        after_commit(invalidate_list, instance)
+
+
+@receiver(post_save, sender=Item, dispatch_uid="pretixdroid_index_item")
+@receiver(post_save, sender=ItemVariation, dispatch_uid="pretixdroid_index_variation")
+def index_item_changed(sender, instance, **kwargs):
+    if index_enabled():
+        event_id = instance.event_id if isinstance(instance, Item) else instance.item.event_id
+        after_commit(invalidate_event, event_id)
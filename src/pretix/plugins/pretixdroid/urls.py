@@ -3,6 +3,8 @@ from django.conf.urls import include, url
 from . import views
 
 pretixdroid_api_patterns = [
+    url(r'^redeem/batch/', views.ApiBatchRedeemView.as_view(),
+        name='api.redeem.batch'),
     url(r'^redeem/', views.ApiRedeemView.as_view(),
         name='api.redeem'),
     url(r'^search/', views.ApiSearchView.as_view(),
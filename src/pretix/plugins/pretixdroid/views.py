@@ -1,12 +1,16 @@
 import json
 import logging
+from datetime import timedelta
 
 import dateutil.parser
+import pytz
 from django.contrib import messages
+from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
 from django.db.models import Count, Max, OuterRef, Q, Subquery
 from django.http import (
-    HttpResponseForbidden, HttpResponseNotFound, JsonResponse,
+    HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound,
+    JsonResponse,
 )
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
@@ -15,20 +19,31 @@ from django.utils.functional import cached_property
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
 from django.views.generic import TemplateView, View
 
-from pretix.base.models import Checkin, Event, Order, OrderPosition
+from pretix.base.models import (
+    Checkin, Event, LogEntry, Order, OrderPosition,
+)
 from pretix.base.models.event import SubEvent
 from pretix.control.permissions import EventPermissionRequiredMixin
+from pretix.helpers.json import CustomJSONEncoder
 from pretix.helpers.urls import build_absolute_uri
 from pretix.multidomain.urlreverse import (
     build_absolute_uri as event_absolute_uri,
 )
 from pretix.plugins.pretixdroid.forms import AppConfigurationForm
+from pretix.plugins.pretixdroid.index import (
+    SecretIndex, after_commit, checkins_created, index_enabled,
+)
 from pretix.plugins.pretixdroid.models import AppConfiguration
 
 logger = logging.getLogger('pretix.plugins.pretixdroid')
 API_VERSION = 3
+DOWNLOAD_PAGE_SIZE = 500
+DOWNLOAD_MAX_PAGE_SIZE = 5000
+BATCH_REDEEM_MAX_SIZE = 1000
+SYNC_TOKEN_OVERLAP = timedelta(seconds=60)
 
 
 class ConfigCodeView(EventPermissionRequiredMixin, TemplateView):
@@ -162,6 +177,12 @@ class ApiRedeemView(ApiView):
         else:
             dt = now()
 
+        if index_enabled() and self.config.list.subevent == self.subevent:
+            result = self._redeem_indexed(secret, force, nonce, dt)
+            if result is not None:
+                response.update(result)
+                return JsonResponse(response)
+
         try:
             with transaction.atomic():
                 created = False
@@ -218,6 +239,166 @@ class ApiRedeemView(ApiView):
 
         return JsonResponse(response)
 
+    def _redeem_indexed(self, secret, force, nonce, dt):
+        """
+        Validates the scan against the secret index and only touches the database to store a new
+        check-in. Returns ``None`` if the secret is not in the index, in which case we fall back to
+        the database to be sure.
+        """
+        index = SecretIndex(self.config.list)
+        entry = index.get(secret)
+        if entry is None:
+            return None
+
+        response = {}
+        if not entry['product_allowed'] or (
+                not self.config.all_items and entry['item'] not in {i.pk for i in self.config.items.all()}):
+            response['status'] = 'error'
+            response['reason'] = 'product'
+        elif not entry['paid'] and not force:
+            response['status'] = 'error'
+            response['reason'] = 'unpaid'
+        if 'status' in response:
+            response['data'] = dict(entry['data'], redeemed=entry['paid'] or force)
+            return response
+
+        created, first_nonce = index.checkin(secret, nonce)
+        if created:
+            try:
+                with transaction.atomic():
+                    ci = Checkin(position_id=entry['position'], list=self.config.list, datetime=dt, nonce=nonce)
+                    ci._indexed = True
+                    ci.save()
+                    scan_logentry(self.event, self.config.list, entry['order'], entry['position'],
+                                  entry['positionid'], dt, first=True, forced=not entry['paid']).save()
+            except Exception:
+                index.revert_checkin(secret)
+                raise
+            response['status'] = 'ok'
+        elif nonce and nonce == first_nonce:
+            response['status'] = 'ok'
+        else:
+            if force:
+                response['status'] = 'ok'
+            else:
+                response['status'] = 'error'
+                response['reason'] = 'already_redeemed'
+            scan_logentry(self.event, self.config.list, entry['order'], entry['position'],
+                          entry['positionid'], dt, first=False, forced=force).save()
+
+        response['data'] = dict(entry['data'], redeemed=entry['paid'] or force)
+        return response
+
+
+class ApiBatchRedeemView(ApiView):
+    """
+    Redeems a list of scans at once, e.g. when a device uploads the scans it recorded while it was
+    offline. The scans are processed in the given order with the same rules as in
+    :py:class:`ApiRedeemView`, but all tickets are looked up with a single query and all check-ins
+    and log entries are written in bulk.
+    """
+
+    def post(self, request, **kwargs):
+        try:
+            scans = json.loads(request.body.decode('utf-8'))
+            if not isinstance(scans, list) or len(scans) > BATCH_REDEEM_MAX_SIZE:
+                raise ValueError('Invalid batch')
+            for scan in scans:
+                scan['datetime'] = dateutil.parser.parse(scan['datetime']) if scan.get('datetime') else now()
+                scan['force'] = scan.get('force') in (True, 'true', 'True')
+                scan['secret'] = str(scan.get('secret', '!INVALID!'))
+        except (ValueError, TypeError, KeyError, AttributeError, OverflowError):
+            return HttpResponseBadRequest('Invalid request body')
+
+        results = []
+        with transaction.atomic():
+            ops = {
+                op.secret: op for op in OrderPosition.objects.select_related(
+                    'item', 'variation', 'order', 'order__invoice_address', 'addon_to'
+                ).filter(
+                    order__event=self.event, secret__in={s['secret'] for s in scans}, subevent=self.subevent
+                )
+            }
+            checkins = {
+                ci.position_id: ci for ci in Checkin.objects.filter(
+                    position__in=ops.values(), list=self.config.list
+                ).order_by('datetime')
+            }
+            list_products = None if self.config.list.all_products else set(
+                self.config.list.limit_products.values_list('id', flat=True)
+            )
+            config_items = None if self.config.all_items else set(self.config.items.values_list('id', flat=True))
+
+            new_checkins = []
+            logentries = []
+            for scan in scans:
+                res = {'secret': scan['secret']}
+                results.append(res)
+                op = ops.get(scan['secret'])
+                if not op:
+                    res['status'] = 'error'
+                    res['reason'] = 'unknown_ticket'
+                    continue
+
+                paid = op.order.status == Order.STATUS_PAID
+                if (list_products is not None and op.item_id not in list_products) or (
+                        config_items is not None and op.item_id not in config_items):
+                    res['status'] = 'error'
+                    res['reason'] = 'product'
+                elif not paid and not scan['force']:
+                    res['status'] = 'error'
+                    res['reason'] = 'unpaid'
+                elif op.pk not in checkins:
+                    ci = Checkin(position=op, list=self.config.list, datetime=scan['datetime'],
+                                 nonce=scan.get('nonce'))
+                    checkins[op.pk] = ci
+                    new_checkins.append(ci)
+                    res['status'] = 'ok'
+                    logentries.append(scan_logentry(self.event, self.config.list, op.order_id, op.pk, op.positionid,
+                                                    scan['datetime'], first=True, forced=not paid))
+                elif scan.get('nonce') and scan.get('nonce') == checkins[op.pk].nonce:
+                    res['status'] = 'ok'
+                else:
+                    if scan['force']:
+                        res['status'] = 'ok'
+                    else:
+                        res['status'] = 'error'
+                        res['reason'] = 'already_redeemed'
+                    logentries.append(scan_logentry(self.event, self.config.list, op.order_id, op.pk, op.positionid,
+                                                    scan['datetime'], first=False, forced=scan['force']))
+
+                res['data'] = serialize_op(op, redeemed=paid or scan['force'])
+
+            Checkin.objects.bulk_create(new_checkins)
+            OrderPosition.objects.filter(pk__in={ci.position_id for ci in new_checkins}).update(last_modified=now())
+            LogEntry.objects.bulk_create(logentries)
+            if index_enabled():
+                after_commit(checkins_created, self.config.list,
+                             [(ci.position.secret, ci.nonce) for ci in new_checkins])
+
+        return JsonResponse({
+            'version': API_VERSION,
+            'results': results
+        })
+
+
+def scan_logentry(event, checkin_list, order_id, position_id, positionid, dt, first, forced):
+    """
+    Builds the log entry for a scan without loading the order it belongs to.
+    """
+    return LogEntry(
+        content_type=ContentType.objects.get_for_model(Order), object_id=order_id, event=event,
+        action_type='pretix.plugins.pretixdroid.scan',
+        data=json.dumps({
+            'position': position_id,
+            'positionid': positionid,
+            'first': first,
+            'forced': forced,
+            'datetime': dt,
+            'list': checkin_list.pk
+        }, cls=CustomJSONEncoder)
+    )
+
 
 def serialize_op(op, redeemed):
     name = op.attendee_name
@@ -287,12 +468,42 @@ class ApiSearchView(ApiView):
         return JsonResponse(response)
 
 
+def parse_sync_token(token):
+    dt = dateutil.parser.parse(token)
+    if dt.tzinfo is None:
+        raise ValueError('Sync token without timezone')
+    return dt
+
+
 class ApiDownloadView(ApiView):
+    """
+    Returns the data of all paid tickets. If ``since`` is given, only the orders that have
+    been modified since the matching call are returned, together with all their paid positions.
+    Devices are expected to replace everything they know about these orders with the new data.
+    """
+
+    @method_decorator(gzip_page)
     def get(self, request, **kwargs):
         response = {
             'version': API_VERSION
         }
 
+        try:
+            since = parse_sync_token(request.GET['since']) if 'since' in request.GET else None
+            token = request.GET['token'] if 'token' in request.GET else None
+            after = int(request.GET.get('after', '0'))
+            page_size = request.GET.get('page_size', DOWNLOAD_PAGE_SIZE if since else None)
+            page_size = min(int(page_size), DOWNLOAD_MAX_PAGE_SIZE) if page_size else None
+            if page_size is not None and page_size < 1:
+                raise ValueError('Invalid page size')
+        except (ValueError, OverflowError):
+            return HttpResponseBadRequest('Invalid parameters')
+
+        if not token:
+            # Transactions that are still running while we query can commit changes with an older
+            # modification date later on, so the next sync starts a bit earlier than this one.
+            token = (now() - SYNC_TOKEN_OVERLAP).astimezone(pytz.UTC).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
         cqs = Checkin.objects.filter(
             position_id=OuterRef('pk'),
             list_id=self.config.list.pk
@@ -314,7 +525,30 @@ class ApiDownloadView(ApiView):
         if not self.config.all_items:
             qs = qs.filter(item__in=self.config.items.all())
 
+        if page_size:
+            if since:
+                oqs = self.event.orders.filter(
+                    Q(last_modified__gt=since) | Q(positions__last_modified__gt=since)
+                    | Q(invoice_address__last_modified__gt=since)
+                ).distinct()
+            else:
+                oqs = self.event.orders.filter(status=Order.STATUS_PAID)
+            orders = list(oqs.filter(pk__gt=after).order_by('pk').values_list('pk', 'code')[:page_size + 1])
+            has_next = len(orders) > page_size
+            orders = orders[:page_size]
+            qs = qs.filter(order_id__in=[o[0] for o in orders]).order_by('order_id', 'positionid', 'pk')
+            if since:
+                response['orders'] = [o[1] for o in orders]
+            if has_next:
+                params = request.GET.copy()
+                params['after'] = orders[-1][0]
+                params['token'] = token
+                response['next'] = request.build_absolute_uri('{}?{}'.format(request.path, params.urlencode()))
+            else:
+                response['next'] = None
+
         response['results'] = [serialize_op(op, bool(op.last_checked_in)) for op in qs]
+        response['sync_token'] = token
         return JsonResponse(response)
 
 
@@ -0,0 +1,126 @@
+import json
+import logging
+import time
+
+import pytz
+from django.conf import settings
+from django.db.models import Q
+from django.utils.formats import date_format
+from django.utils.timezone import now
+from django.utils.translation import ugettext as _
+from i18nfield.strings import LazyI18nString
+
+from pretix.base.email import mail_pool
+from pretix.base.i18n import language
+from pretix.base.models import Event, LogEntry, Order, User
+from pretix.base.services.async import ProfiledTask
+from pretix.base.services.mail import (
+    INVALID_ADDRESS, SendMailException, build_mail_message,
+    render_mail_message,
+)
+from pretix.celery_app import app
+from pretix.helpers.database import keyset_batches
+from pretix.helpers.json import CustomJSONEncoder
+from pretix.multidomain.urlreverse import build_absolute_uri
+
+logger = logging.getLogger('pretix.plugins.sendmail')
+BATCH_SIZE = 100
+
+
+def get_orders(event: Event, sendto: list, item: int=None, subevent: int=None):
+    """
+    Returns all orders of the event that the given form selection applies to.
+    """
+    statusq = Q(status__in=sendto)
+    if 'overdue' in sendto:
+        statusq |= Q(status=Order.STATUS_PENDING, expires__lt=now())
+    orders = event.orders.filter(statusq)
+    if item:
+        orders = orders.filter(positions__item_id=item)
+    if subevent:
+        orders = orders.filter(positions__subevent_id=subevent)
+    return orders.distinct()
+
+
+class RateLimiter:
+    """
+    Makes sure we do not hand more than ``rate`` messages per second to a mail backend.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.count = 0
+
+    def wait(self, count):
+        self.count += count
+        if self.rate:
+            delay = self.count / self.rate - (time.monotonic() - self.start)
+            if delay > 0:
+                time.sleep(delay)
+
+
+@app.task(base=ProfiledTask, bind=True)
+def send_mails(self, event: int, user: int, subject: dict, message: dict, sendto: list, item: int=None,
+               subevent: int=None) -> int:
+    def set_progress(value):
+        if not self.request.called_directly and not self.request.is_eager:
+            self.update_state(
+                state='PROGRESS',
+                meta={'value': value}
+            )
+
+    event = Event.objects.get(pk=event)
+    user = User.objects.get(pk=user) if user else None
+    subject = LazyI18nString(subject)
+    message = LazyI18nString(message)
+    tz = pytz.timezone(event.settings.timezone)
+
+    orders = get_orders(event, sendto, item, subevent).select_related('invoice_address')
+    total = orders.count()
+    backend = event.get_mail_backend()
+    ratelimit = RateLimiter(settings.MAIL_BULK_RATE)
+    done = 0
+    failures = []
+
+    for batch in keyset_batches(orders, batch_size=BATCH_SIZE):
+        messages = {}
+        logentries = {}
+        for o in batch:
+            if not o.email or o.email == INVALID_ADDRESS:
+                continue
+            with language(o.locale):
+                email_context = {
+                    'event': event,
+                    'code': o.code,
+                    'date': date_format(o.datetime.astimezone(tz), 'SHORT_DATETIME_FORMAT'),
+                    'expire_date': date_format(o.expires, 'SHORT_DATE_FORMAT'),
+                    'url': build_absolute_uri(event, 'presale:event.order', kwargs={
+                        'order': o.code,
+                        'secret': o.secret
+                    }),
+                }
+                o.event = event
+                send_kwargs = render_mail_message(o.email, subject, message, email_context, event, o)
+                send_kwargs.update(event=event, order=o)
+                messages[o.pk] = build_mail_message(**send_kwargs)
+                logentries[o.pk] = LogEntry(
+                    content_object=o, user=user, event=event, action_type='pretix.plugins.sendmail.order.email.sent',
+                    data=json.dumps({
+                        'subject': subject.localize(o.locale),
+                        'message': message.localize(o.locale).format_map(email_context),
+                        'recipient': o.email
+                    }, cls=CustomJSONEncoder)
+                )
+
+        failed = mail_pool.send_messages(backend, list(messages.values()))
+        failures += [m.to[0] for m in failed]
+        LogEntry.objects.bulk_create([l for pk, l in logentries.items() if messages[pk] not in failed])
+
+        ratelimit.wait(len(messages))
+        done += len(batch)
+        set_progress(done / total * 100 if total else 100)
+
+    if failures:
+        raise SendMailException(_('Failed to send mails to the following users: {}').format(' '.join(failures)))
+    return total
@@ -1,32 +1,34 @@
 import logging
 from datetime import timedelta
 
-import pytz
+from django.conf import settings
 from django.contrib import messages
-from django.db.models import Q
 from django.http import Http404
-from django.shortcuts import redirect
+from django.urls import reverse
 from django.utils.formats import date_format
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic import FormView, ListView
 
 from pretix.base.i18n import LazyI18nString, language
-from pretix.base.models import InvoiceAddress, LogEntry, Order
+from pretix.base.models import LogEntry, Order
 from pretix.base.models.event import SubEvent
-from pretix.base.services.mail import SendMailException, mail
+from pretix.base.views.async import AsyncAction
 from pretix.control.permissions import EventPermissionRequiredMixin
 from pretix.multidomain.urlreverse import build_absolute_uri
 
 from . import forms
+from .tasks import get_orders, send_mails
 
 logger = logging.getLogger('pretix.plugins.sendmail')
 
 
-class SenderView(EventPermissionRequiredMixin, FormView):
+class SenderView(EventPermissionRequiredMixin, AsyncAction, FormView):
     template_name = 'pretixplugins/sendmail/send_form.html'
     permission = 'can_change_orders'
     form_class = forms.MailForm
+    task = send_mails
+    known_errortypes = ['SendMailException']
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
@@ -59,23 +61,18 @@ class SenderView(EventPermissionRequiredMixin, FormView):
         messages.error(self.request, _('We could not send the email. See below for details.'))
         return super().form_invalid(form)
 
+    def get(self, request, *args, **kwargs):
+        if 'async_id' in request.GET and settings.HAS_CELERY:
+            return self.get_result(request)
+        return FormView.get(self, request, *args, **kwargs)
+
     def form_valid(self, form):
-        qs = Order.objects.filter(event=self.request.event)
-        statusq = Q(status__in=form.cleaned_data['sendto'])
-        if 'overdue' in form.cleaned_data['sendto']:
-            statusq |= Q(status=Order.STATUS_PENDING, expires__lt=now())
-        orders = qs.filter(statusq)
-        if form.cleaned_data.get('item'):
-            orders = orders.filter(positions__item=form.cleaned_data.get('item'))
-        if form.cleaned_data.get('subevent'):
-            orders = orders.filter(positions__subevent__in=(form.cleaned_data.get('subevent'),))
-        orders = orders.distinct()
-
-        tz = pytz.timezone(self.request.event.settings.timezone)
-
-        failures = []
+        orders = get_orders(self.request.event, form.cleaned_data['sendto'],
+                            item=form.cleaned_data['item'].pk if form.cleaned_data.get('item') else None,
+                            subevent=form.cleaned_data['subevent'].pk if form.cleaned_data.get('subevent') else None)
+
         self.output = {}
-        if not orders:
+        if not orders.exists():
             messages.error(self.request, _('There are no orders matching this selection.'))
             return self.get(self.request, *self.args, **self.kwargs)
 
@@ -110,57 +107,28 @@ class SenderView(EventPermissionRequiredMixin, FormView):
 
             return self.get(self.request, *self.args, **self.kwargs)
 
-        for o in orders:
-            try:
-                invoice_name = o.invoice_address.name
-                invoice_company = o.invoice_address.company
-            except InvoiceAddress.DoesNotExist:
-                invoice_name = ""
-                invoice_company = ""
-            try:
-                with language(o.locale):
-                    email_context = {
-                        'event': o.event,
-                        'code': o.code,
-                        'date': date_format(o.datetime.astimezone(tz), 'SHORT_DATETIME_FORMAT'),
-                        'expire_date': date_format(o.expires, 'SHORT_DATE_FORMAT'),
-                        'url': build_absolute_uri(o.event, 'presale:event.order', kwargs={
-                            'order': o.code,
-                            'secret': o.secret
-                        }),
-                        'invoice_name': invoice_name,
-                        'invoice_company': invoice_company,
-                    }
-                    mail(
-                        o.email, form.cleaned_data['subject'], form.cleaned_data['message'],
-                        email_context,
-                        self.request.event, locale=o.locale, order=o)
-                    o.log_action(
-                        'pretix.plugins.sendmail.order.email.sent',
-                        user=self.request.user,
-                        data={
-                            'subject': form.cleaned_data['subject'].localize(o.locale),
-                            'message': form.cleaned_data['message'].localize(o.locale).format_map(email_context),
-                            'recipient': o.email
-                        }
-                    )
-            except SendMailException:
-                failures.append(o.email)
         self.request.event.log_action('pretix.plugins.sendmail.sent',
                                       user=self.request.user,
                                       data=dict(form.cleaned_data))
-        if failures:
-            messages.error(self.request,
-                           _('Failed to send mails to the following users: {}'.format(' '.join(failures))))
-        else:
-            messages.success(self.request, _('Your message has been queued and will be sent to the selected users.'))
-
-        return redirect(
-            'plugins:sendmail:send',
-            event=self.request.event.slug,
-            organizer=self.request.event.organizer.slug
+        return self.do(
+            self.request.event.pk, self.request.user.pk,
+            form.cleaned_data['subject'].data, form.cleaned_data['message'].data, form.cleaned_data['sendto'],
+            form.cleaned_data['item'].pk if form.cleaned_data.get('item') else None,
+            form.cleaned_data['subevent'].pk if form.cleaned_data.get('subevent') else None,
         )
 
+    def get_success_message(self, value):
+        return _('Your message has been sent to {num} customers.').format(num=value)
+
+    def get_success_url(self, value):
+        return self.get_error_url()
+
+    def get_error_url(self):
+        return reverse('plugins:sendmail:send', kwargs={
+            'event': self.request.event.slug,
+            'organizer': self.request.event.organizer.slug
+        })
+
     def get_context_data(self, *args, **kwargs):
         ctx = super().get_context_data(*args, **kwargs)
         ctx['output'] = getattr(self, 'output', None)
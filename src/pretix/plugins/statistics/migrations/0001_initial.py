@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def schedule_rebuild(apps, schema_editor):
+    Event = apps.get_model('pretixbase', 'Event')
+    StatisticsUpdate = apps.get_model('statistics', 'StatisticsUpdate')
+    StatisticsUpdate.objects.bulk_create([
+        StatisticsUpdate(event_id=pk, date=None) for pk in Event.objects.values_list('pk', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('pretixbase', '0080_last_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemDayStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('ordered', models.PositiveIntegerField(default=0)),
+                ('paid', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=13)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.Event')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.Item')),
+                ('subevent', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.SubEvent')),
+                ('variation', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.ItemVariation')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderDayStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('ordered', models.PositiveIntegerField(default=0)),
+                ('paid', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=13)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.Event')),
+                ('subevent', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.SubEvent')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatisticsUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.PositiveIntegerField()),
+                ('date', models.DateField(null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='statisticsupdate',
+            unique_together=set([('event_id', 'date')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='orderdaystatistics',
+            unique_together=set([('event', 'subevent', 'date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='itemdaystatistics',
+            index_together=set([('event', 'date')]),
+        ),
+        migrations.RunPython(schedule_rebuild, migrations.RunPython.noop),
+    ]
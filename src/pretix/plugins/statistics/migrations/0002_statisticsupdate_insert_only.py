@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('statistics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='statisticsupdate',
+            unique_together=set([]),
+        ),
+        migrations.AlterField(
+            model_name='statisticsupdate',
+            name='event_id',
+            field=models.PositiveIntegerField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+from django.db import models
+
+
+class OrderDayStatistics(models.Model):
+    """
+    The number of orders placed and paid and the revenue of an event on one day in the event's
+    timezone. Orders are counted on the day they were placed, payments and revenue on the day
+    of the payment. Rows with a subevent only count orders with positions in this subevent and
+    the revenue of these positions, the row without a subevent covers the whole event.
+    """
+    event = models.ForeignKey('pretixbase.Event', on_delete=models.CASCADE, related_name='+')
+    subevent = models.ForeignKey('pretixbase.SubEvent', null=True, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    ordered = models.PositiveIntegerField(default=0)
+    paid = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=13, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        unique_together = (('event', 'subevent', 'date'),)
+
+
+class ItemDayStatistics(models.Model):
+    """
+    The number of ordered and paid positions and their revenue per product, variation and subevent
+    of all orders placed on one day in the event's timezone.
+    """
+    event = models.ForeignKey('pretixbase.Event', on_delete=models.CASCADE, related_name='+')
+    subevent = models.ForeignKey('pretixbase.SubEvent', null=True, on_delete=models.CASCADE, related_name='+')
+    item = models.ForeignKey('pretixbase.Item', on_delete=models.CASCADE, related_name='+')
+    variation = models.ForeignKey('pretixbase.ItemVariation', null=True, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    ordered = models.PositiveIntegerField(default=0)
+    paid = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=13, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        index_together = (('event', 'date'),)
+
+
+class StatisticsUpdate(models.Model):
+    """
+    Marks a day of an event whose statistics need to be computed again. A date of ``None`` means
+    that the statistics of the whole event need to be rebuilt.
+
+    This does not use a foreign key, as rows are created while the orders of an event are deleted
+    together with the event itself.
+
+    Rows are only ever inserted, never updated, and the same day may be marked more than once. A
+    refresh deletes exactly the rows it has read, so a day that is marked again by a transaction
+    that commits while the refresh is running will be computed again next time.
+    """
+    event_id = models.PositiveIntegerField(db_index=True)
+    date = models.DateField(null=True)
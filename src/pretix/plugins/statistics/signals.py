@@ -1,10 +1,16 @@
 from django.core.urlresolvers import resolve, reverse
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
-from pretix.base.signals import order_paid, order_placed
+from pretix.base.models import (
+    Event, Event_SettingsStore, Order, OrderPosition, Organizer_SettingsStore,
+)
+from pretix.base.signals import periodic_task
 from pretix.control.signals import nav_event
 
+from .tasks import mark_changed, mark_rebuild, refresh_statistics
+
 
 @receiver(nav_event, dispatch_uid="statistics_nav")
 def control_nav_import(sender, request=None, **kwargs):
@@ -24,12 +30,83 @@ def control_nav_import(sender, request=None, **kwargs):
     ]
 
 
-def clear_cache(sender, *args, **kwargs):
-    cache = sender.cache
-    cache.delete('statistics_obd_data')
-    cache.delete('statistics_obp_data')
-    cache.delete('statistics_rev_data')
+PLUGIN = 'pretix.plugins.statistics'
+
+
+def _active(order):
+    return PLUGIN in order.event.get_plugins()
+
+
+@receiver(post_init, sender=Order, dispatch_uid="statistics_order_init")
+def order_init(sender, instance, **kwargs):
+    # We do not use the attributes directly here, as this would load deferred fields
+    instance._statistics_initial = (instance.__dict__.get('datetime'), instance.__dict__.get('payment_date'))
+
+
+@receiver(post_save, sender=Order, dispatch_uid="statistics_order_saved")
+@receiver(post_delete, sender=Order, dispatch_uid="statistics_order_deleted")
+def order_changed(sender, instance, **kwargs):
+    if not _active(instance):
+        return
+    mark_changed(instance, instance.datetime, instance.payment_date, *getattr(instance, '_statistics_initial', ()))
+
+
+@receiver(post_save, sender=OrderPosition, dispatch_uid="statistics_position_saved")
+@receiver(post_delete, sender=OrderPosition, dispatch_uid="statistics_position_deleted")
+def position_changed(sender, instance, **kwargs):
+    try:
+        order = instance.order
+    except Order.DoesNotExist:
+        return
+    if not _active(order):
+        return
+    mark_changed(order, order.datetime, order.payment_date)
+
+
+@receiver(post_init, sender=Event, dispatch_uid="statistics_event_init")
+def event_init(sender, instance, **kwargs):
+    instance._statistics_plugins = instance.__dict__.get('plugins')
+
+
+@receiver(post_save, sender=Event, dispatch_uid="statistics_event_saved")
+def event_changed(sender, instance, created, **kwargs):
+    # Nothing has been recorded while the plugin was disabled, so we need to start from scratch
+    initial = getattr(instance, '_statistics_plugins', None) or ''
+    if not created and PLUGIN in instance.get_plugins() and PLUGIN not in initial.split(','):
+        mark_rebuild([instance.pk])
+    instance._statistics_plugins = instance.plugins
+
+
+def _timezone_changed(sender, instance):
+    # All days are computed in the event's timezone, so they are all wrong once it has been changed
+    if sender is Event_SettingsStore:
+        events = Event.objects.filter(pk=instance.object_id)
+    else:
+        events = Event.objects.filter(organizer_id=instance.object_id)
+    mark_rebuild(events.filter(plugins__contains=PLUGIN).values_list('pk', flat=True))
+
+
+@receiver(post_init, sender=Event_SettingsStore, dispatch_uid="statistics_event_settings_init")
+@receiver(post_init, sender=Organizer_SettingsStore, dispatch_uid="statistics_organizer_settings_init")
+def setting_init(sender, instance, **kwargs):
+    instance._statistics_value = instance.__dict__.get('value')
+
+
+@receiver(post_save, sender=Event_SettingsStore, dispatch_uid="statistics_event_settings_saved")
+@receiver(post_save, sender=Organizer_SettingsStore, dispatch_uid="statistics_organizer_settings_saved")
+def setting_saved(sender, instance, created, **kwargs):
+    if instance.key == 'timezone' and (created or instance.value != instance._statistics_value):
+        _timezone_changed(sender, instance)
+    instance._statistics_value = instance.value
+
+
+@receiver(post_delete, sender=Event_SettingsStore, dispatch_uid="statistics_event_settings_deleted")
+@receiver(post_delete, sender=Organizer_SettingsStore, dispatch_uid="statistics_organizer_settings_deleted")
+def setting_deleted(sender, instance, **kwargs):
+    if instance.key == 'timezone':
+        _timezone_changed(sender, instance)
 
 
-order_placed.connect(clear_cache)
-order_paid.connect(clear_cache)
+@receiver(signal=periodic_task, dispatch_uid="statistics_periodic")
+def periodic_refresh(sender, **kwargs):
+    refresh_statistics.apply_async()
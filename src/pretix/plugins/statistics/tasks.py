@@ -0,0 +1,160 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+import pytz
+from django.db import transaction
+from django.db.models import Q
+
+from pretix.base.models import Event, Order, OrderPosition
+from pretix.celery_app import app
+
+from .models import ItemDayStatistics, OrderDayStatistics, StatisticsUpdate
+
+DAYS_PER_QUERY = 50
+DELETE_BATCH_SIZE = 500
+
+
+def mark_changed(order: Order, *datetimes):
+    """
+    Marks the days of the given datetimes in the order's event as changed, so their statistics will be
+    computed again.
+    """
+    tz = pytz.timezone(order.event.settings.timezone)
+    StatisticsUpdate.objects.bulk_create([
+        StatisticsUpdate(event_id=order.event_id, date=d)
+        for d in {dt.astimezone(tz).date() for dt in datetimes if dt}
+    ])
+
+
+def mark_rebuild(event_ids):
+    """
+    Marks the statistics of the given events to be rebuilt completely, e.g. because all days are wrong
+    after the event's timezone has been changed.
+    """
+    StatisticsUpdate.objects.bulk_create([StatisticsUpdate(event_id=pk, date=None) for pk in event_ids])
+
+
+def _day_filter(field, days, tz):
+    q = Q()
+    for d in days:
+        q |= Q(**{
+            field + '__gte': tz.localize(datetime.combine(d, time.min)),
+            field + '__lt': tz.localize(datetime.combine(d + timedelta(days=1), time.min)),
+        })
+    return q
+
+
+def _aggregate(event: Event, days: list, tz):
+    def day(dt):
+        return dt.astimezone(tz).date()
+
+    def add(data, key, ordered=0, paid=0, revenue=Decimal('0.00')):
+        row = data.setdefault(key, [0, 0, Decimal('0.00')])
+        row[0] += ordered
+        row[1] += paid
+        row[2] += revenue
+
+    orders = {}
+    items = {}
+    placed = event.orders.all()
+    paid = event.orders.filter(payment_date__isnull=False)
+    positions = OrderPosition.objects.filter(order__event=event)
+    paid_positions = positions.filter(order__payment_date__isnull=False, subevent__isnull=False)
+    if days is not None:
+        placed = placed.filter(_day_filter('datetime', days, tz))
+        paid = paid.filter(_day_filter('payment_date', days, tz))
+        positions = positions.filter(_day_filter('order__datetime', days, tz))
+        paid_positions = paid_positions.filter(_day_filter('order__payment_date', days, tz))
+
+    for o in placed.values('datetime'):
+        add(orders, (None, day(o['datetime'])), ordered=1)
+
+    for o in paid.values('payment_date', 'status', 'total'):
+        add(orders, (None, day(o['payment_date'])), paid=1,
+            revenue=o['total'] if o['status'] == Order.STATUS_PAID else Decimal('0.00'))
+
+    seen = set()
+    for p in positions.values('order_id', 'order__datetime', 'order__status', 'subevent_id', 'item_id',
+                              'variation_id', 'price').iterator():
+        d = day(p['order__datetime'])
+        if p['order__status'] == Order.STATUS_PAID:
+            add(items, (p['subevent_id'], p['item_id'], p['variation_id'], d), ordered=1, paid=1, revenue=p['price'])
+        else:
+            add(items, (p['subevent_id'], p['item_id'], p['variation_id'], d), ordered=1)
+        if p['subevent_id'] and (p['order_id'], p['subevent_id']) not in seen:
+            seen.add((p['order_id'], p['subevent_id']))
+            add(orders, (p['subevent_id'], d), ordered=1)
+
+    seen = set()
+    for p in paid_positions.values('order_id', 'order__payment_date', 'order__status', 'subevent_id',
+                                   'price').iterator():
+        d = day(p['order__payment_date'])
+        if (p['order_id'], p['subevent_id']) not in seen:
+            seen.add((p['order_id'], p['subevent_id']))
+            add(orders, (p['subevent_id'], d), paid=1)
+        if p['order__status'] == Order.STATUS_PAID:
+            add(orders, (p['subevent_id'], d), revenue=p['price'])
+
+    return orders, items
+
+
+def compute_statistics(event: Event, days: set=None):
+    """
+    Computes the statistics of the given days of an event, or of all days if ``days`` is ``None``,
+    from the orders in the database and replaces the stored rows of these days.
+    """
+    tz = pytz.timezone(event.settings.timezone)
+    if days is None:
+        chunks = [None]
+    else:
+        days = sorted(days)
+        chunks = [days[i:i + DAYS_PER_QUERY] for i in range(0, len(days), DAYS_PER_QUERY)]
+
+    with transaction.atomic():
+        for chunk in chunks:
+            orders, items = _aggregate(event, chunk, tz)
+            oqs = OrderDayStatistics.objects.filter(event=event)
+            iqs = ItemDayStatistics.objects.filter(event=event)
+            if chunk is not None:
+                oqs = oqs.filter(date__in=chunk)
+                iqs = iqs.filter(date__in=chunk)
+            oqs.delete()
+            iqs.delete()
+            OrderDayStatistics.objects.bulk_create([
+                OrderDayStatistics(event=event, subevent_id=subevent, date=d, ordered=v[0], paid=v[1], revenue=v[2])
+                for (subevent, d), v in orders.items()
+            ])
+            ItemDayStatistics.objects.bulk_create([
+                ItemDayStatistics(event=event, subevent_id=subevent, item_id=item, variation_id=variation, date=d,
+                                  ordered=v[0], paid=v[1], revenue=v[2])
+                for (subevent, item, variation, d), v in items.items()
+            ])
+
+
+def refresh_event_statistics(event: Event):
+    """
+    Brings the statistics of an event up to date by computing all days that have been marked as
+    changed since the last run. This is cheap if nothing changed.
+    """
+    with transaction.atomic():
+        updates = list(StatisticsUpdate.objects.select_for_update().filter(event_id=event.pk))
+        if not updates:
+            return
+        if any(u.date is None for u in updates):
+            compute_statistics(event)
+        else:
+            compute_statistics(event, {u.date for u in updates})
+        # Only delete the markers we have read. Markers inserted by transactions that committed in the
+        # meantime stay in place, even if they are for the same days.
+        pks = [u.pk for u in updates]
+        for i in range(0, len(pks), DELETE_BATCH_SIZE):
+            StatisticsUpdate.objects.filter(pk__in=pks[i:i + DELETE_BATCH_SIZE]).delete()
+
+
+@app.task
+def refresh_statistics():
+    event_ids = set(StatisticsUpdate.objects.order_by().values_list('event_id', flat=True).distinct())
+    events = list(Event.objects.filter(pk__in=event_ids))
+    StatisticsUpdate.objects.filter(event_id__in=event_ids - {e.pk for e in events}).delete()
+    for event in events:
+        refresh_event_statistics(event)
@@ -1,9 +1,8 @@
-from io import BytesIO
-
 from django.utils.translation import ugettext as _
 
 from pretix.base.exporter import BaseExporter
 from pretix.base.models import Order, OrderPosition
+from pretix.base.ticketoutput import is_downloadable
 
 from .ticketoutput import PdfTicketOutput
 
@@ -16,17 +15,8 @@ class AllTicketsPDF(BaseExporter):
     def render(self, form_data):
         o = PdfTicketOutput(self.event)
         qs = OrderPosition.objects.filter(order__event=self.event, order__status=Order.STATUS_PAID).select_related(
-            'order', 'item', 'variation'
+            'order', 'item', 'variation', 'subevent', 'addon_to'
+        )
+        return 'tickets.pdf', 'application/pdf', o.render_positions(
+            op for op in qs.iterator() if is_downloadable(self.event, op)
         )
-        buffer = BytesIO()
-        p = o._create_canvas(buffer)
-        for op in qs:
-            if op.addon_to_id and not self.event.settings.ticket_download_addons:
-                continue
-            if not op.item.admission and not self.event.settings.ticket_download_nonadm:
-                continue
-            o._draw_page(p, op, op.order)
-
-        p.save()
-        outbuffer = o._render_with_background(buffer)
-        return 'tickets.pdf', 'application/pdf', outbuffer.read()
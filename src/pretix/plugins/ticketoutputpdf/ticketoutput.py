@@ -3,6 +3,7 @@ import logging
 import uuid
 from collections import OrderedDict
 from io import BytesIO
+from typing import Iterable
 
 from django.contrib.staticfiles import finders
 from django.core.files import File
@@ -10,6 +11,7 @@ from django.core.files.storage import default_storage
 from django.http import HttpRequest
 from django.template.loader import get_template
 from django.utils.formats import date_format, localize
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from pytz import timezone
 from reportlab.graphics import renderPDF
@@ -27,7 +29,7 @@ from reportlab.platypus import Paragraph
 
 from pretix.base.i18n import language
 from pretix.base.models import Order, OrderPosition
-from pretix.base.ticketoutput import BaseTicketOutput
+from pretix.base.ticketoutput import BaseTicketOutput, is_downloadable
 from pretix.plugins.ticketoutputpdf.signals import (
     get_fonts, layout_text_variables,
 )
@@ -156,6 +158,16 @@ DEFAULT_VARIABLES = OrderedDict((
 ))
 
 
+_registered_fonts = set()
+
+
+def _register_font(name, path):
+    # reportlab keeps a process-wide registry of fonts, so every font file only needs to be loaded once
+    if name not in _registered_fonts:
+        pdfmetrics.registerFont(TTFont(name, finders.find(path)))
+        _registered_fonts.add(name)
+
+
 def get_variables(event):
     v = copy.copy(DEFAULT_VARIABLES)
     for recv, res in layout_text_variables.send(sender=event):
@@ -175,19 +187,35 @@ class PdfTicketOutput(BaseTicketOutput):
         super().__init__(event)
 
     def _register_fonts(self):
-        pdfmetrics.registerFont(TTFont('Open Sans', finders.find('fonts/OpenSans-Regular.ttf')))
-        pdfmetrics.registerFont(TTFont('Open Sans I', finders.find('fonts/OpenSans-Italic.ttf')))
-        pdfmetrics.registerFont(TTFont('Open Sans B', finders.find('fonts/OpenSans-Bold.ttf')))
-        pdfmetrics.registerFont(TTFont('Open Sans B I', finders.find('fonts/OpenSans-BoldItalic.ttf')))
+        _register_font('Open Sans', 'fonts/OpenSans-Regular.ttf')
+        _register_font('Open Sans I', 'fonts/OpenSans-Italic.ttf')
+        _register_font('Open Sans B', 'fonts/OpenSans-Bold.ttf')
+        _register_font('Open Sans B I', 'fonts/OpenSans-BoldItalic.ttf')
 
         for family, styles in get_fonts().items():
-            pdfmetrics.registerFont(TTFont(family, finders.find(styles['regular']['truetype'])))
+            _register_font(family, styles['regular']['truetype'])
             if 'italic' in styles:
-                pdfmetrics.registerFont(TTFont(family + ' I', finders.find(styles['italic']['truetype'])))
+                _register_font(family + ' I', styles['italic']['truetype'])
             if 'bold' in styles:
-                pdfmetrics.registerFont(TTFont(family + ' B', finders.find(styles['bold']['truetype'])))
+                _register_font(family + ' B', styles['bold']['truetype'])
             if 'bolditalic' in styles:
-                pdfmetrics.registerFont(TTFont(family + ' B I', finders.find(styles['bolditalic']['truetype'])))
+                _register_font(family + ' B I', styles['bolditalic']['truetype'])
+
+    @cached_property
+    def layout(self) -> list:
+        """
+        The layout of this event, precompiled into a list of tuples of the layout object and the paragraph
+        style and vertical offset of text areas, so we only need to do this once for many tickets.
+        """
+        self._register_fonts()
+        objs = self.override_layout or self.settings.get('layout', as_type=list) or self._legacy_layout()
+        compiled = []
+        for o in objs:
+            if o['type'] == "barcodearea":
+                compiled.append((o, None, None))
+            elif o['type'] == "textarea":
+                compiled.append((o,) + self._compile_textarea(o))
+        return compiled
 
     def _draw_barcodearea(self, canvas: Canvas, op: OrderPosition, o: dict):
         reqs = float(o['size']) * mm
@@ -214,7 +242,7 @@ class PdfTicketOutput(BaseTicketOutput):
                 return '(error)'
         return ''
 
-    def _draw_textarea(self, canvas: Canvas, op: OrderPosition, order: Order, o: dict):
+    def _compile_textarea(self, o: dict):
         font = o['fontfamily']
         if o['bold']:
             font += ' B'
@@ -235,46 +263,47 @@ class PdfTicketOutput(BaseTicketOutput):
             textColor=Color(o['color'][0] / 255, o['color'][1] / 255, o['color'][2] / 255),
             alignment=align_map[o['align']]
         )
+        ad = getAscentDescent(font, float(o['fontsize']))
+        return style, ad[1]
 
+    def _draw_textarea(self, canvas: Canvas, op: OrderPosition, order: Order, o: dict, style: ParagraphStyle,
+                       descent: float):
         p = Paragraph(self._get_text_content(op, order, o) or "", style=style)
         p.wrapOn(canvas, float(o['width']) * mm, 1000 * mm)
         # p_size = p.wrap(float(o['width']) * mm, 1000 * mm)
-        ad = getAscentDescent(font, float(o['fontsize']))
-        p.drawOn(canvas, float(o['left']) * mm, float(o['bottom']) * mm - ad[1])
+        p.drawOn(canvas, float(o['left']) * mm, float(o['bottom']) * mm - descent)
 
     def _draw_page(self, canvas: Canvas, op: OrderPosition, order: Order):
-        objs = self.override_layout or self.settings.get('layout', as_type=list) or self._legacy_layout()
-        for o in objs:
+        for o, style, descent in self.layout:
             if o['type'] == "barcodearea":
                 self._draw_barcodearea(canvas, op, o)
             elif o['type'] == "textarea":
-                self._draw_textarea(canvas, op, order, o)
+                self._draw_textarea(canvas, op, order, o, style, descent)
 
         canvas.showPage()
 
-    def generate_order(self, order: Order):
+    def render_positions(self, positions: Iterable[OrderPosition]) -> bytes:
+        """
+        Renders all given positions into one PDF file with one page per position and returns its content.
+        The positions should be fetched with their orders and products.
+        """
         buffer = BytesIO()
         p = self._create_canvas(buffer)
-        with language(order.locale):
-            for op in order.positions.all():
-                if op.addon_to_id and not self.event.settings.ticket_download_addons:
-                    continue
-                if not op.item.admission and not self.event.settings.ticket_download_nonadm:
-                    continue
-                self._draw_page(p, op, order)
+        for op in positions:
+            self._draw_page(p, op, op.order)
         p.save()
-        outbuffer = self._render_with_background(buffer)
-        return 'order%s%s.pdf' % (self.event.slug, order.code), 'application/pdf', outbuffer.read()
+        return self._render_with_background(buffer).read()
+
+    def generate_order(self, order: Order):
+        with language(order.locale):
+            data = self.render_positions(op for op in order.positions.all() if is_downloadable(self.event, op))
+        return 'order%s%s.pdf' % (self.event.slug, order.code), 'application/pdf', data
 
     def generate(self, op):
-        buffer = BytesIO()
-        p = self._create_canvas(buffer)
         order = op.order
         with language(order.locale):
-            self._draw_page(p, op, order)
-        p.save()
-        outbuffer = self._render_with_background(buffer)
-        return 'order%s%s.pdf' % (self.event.slug, order.code), 'application/pdf', outbuffer.read()
+            data = self.render_positions([op])
+        return 'order%s%s.pdf' % (self.event.slug, order.code), 'application/pdf', data
 
     def _create_canvas(self, buffer):
         from reportlab.pdfgen import canvas
@@ -289,11 +318,10 @@ class PdfTicketOutput(BaseTicketOutput):
     def _get_default_background(self):
         return open(finders.find('pretixpresale/pdf/ticket_default_a4.pdf'), "rb")
 
-    def _render_with_background(self, buffer, title=_('Ticket')):
-        from PyPDF2 import PdfFileWriter, PdfFileReader
-        buffer.seek(0)
-        new_pdf = PdfFileReader(buffer)
-        output = PdfFileWriter()
+    @cached_property
+    def _background_page(self):
+        from PyPDF2 import PdfFileReader
+
         bg_file = self.settings.get('background', as_type=File)
         if self.override_background:
             bgf = default_storage.open(self.override_background.name, "rb")
@@ -301,10 +329,17 @@ class PdfTicketOutput(BaseTicketOutput):
             bgf = default_storage.open(bg_file.name, "rb")
         else:
             bgf = self._get_default_background()
-        bg_pdf = PdfFileReader(bgf)
+        with bgf:
+            return PdfFileReader(BytesIO(bgf.read())).getPage(0)
+
+    def _render_with_background(self, buffer, title=_('Ticket')):
+        from PyPDF2 import PdfFileWriter, PdfFileReader
+        buffer.seek(0)
+        new_pdf = PdfFileReader(buffer)
+        output = PdfFileWriter()
 
         for page in new_pdf.pages:
-            bg_page = copy.copy(bg_pdf.getPage(0))
+            bg_page = copy.copy(self._background_page)
             bg_page.mergePage(page)
             output.addPage(bg_page)
 
@@ -17,9 +17,8 @@ from django.utils.translation import ugettext as _
 from django.views.generic import TemplateView
 
 from pretix.base.i18n import language
-from pretix.base.models import (
-    CachedCombinedTicket, CachedFile, CachedTicket, InvoiceAddress,
-)
+from pretix.base.models import CachedFile, InvoiceAddress
+from pretix.base.services.tickets import invalidate_cachedtickets
 from pretix.control.permissions import EventPermissionRequiredMixin
 from pretix.helpers.database import rolledback_transaction
 from pretix.plugins.ticketoutputpdf.signals import get_fonts
@@ -146,12 +145,7 @@ class EditorView(EventPermissionRequiredMixin, TemplateView):
 
             request.event.settings.set('ticketoutput_{}_layout'.format(self.identifier), request.POST.get("data"))
 
-            CachedTicket.objects.filter(
-                order_position__order__event=self.request.event, provider=self.identifier
-            ).delete()
-            CachedCombinedTicket.objects.filter(
-                order__event=self.request.event, provider=self.identifier
-            ).delete()
+            invalidate_cachedtickets(self.request.event, self.identifier)
 
             return JsonResponse({'status': 'ok'})
         return HttpResponseBadRequest()
@@ -17,7 +17,7 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import TemplateView
 
-from pretix.base.models import ItemVariation, Quota
+from pretix.base.models import Item, ItemVariation, Quota
 from pretix.base.models.event import SubEvent
 from pretix.multidomain.urlreverse import eventreverse
 from pretix.presale.ical import get_ical
@@ -47,11 +47,9 @@ def item_group_by_category(items):
     )
 
 
-def get_grouped_items(event, subevent=None, voucher=None):
+def _get_item_queryset(event, subevent=None, voucher=None):
     items = event.items.all().filter(
         Q(active=True)
-        & Q(Q(available_from__isnull=True) | Q(available_from__lte=now()))
-        & Q(Q(available_until__isnull=True) | Q(available_until__gte=now()))
         & ~Q(category__is_addon=True)
     )
 
@@ -63,7 +61,7 @@ def get_grouped_items(event, subevent=None, voucher=None):
         elif voucher.quota_id:
             items = items.filter(quotas__in=[voucher.quota_id])
 
-    items = items.filter(vouchq).select_related(
+    return items.filter(vouchq).select_related(
         'category', 'tax_rule',  # for re-grouping
     ).prefetch_related(
         Prefetch('quotas',
@@ -81,16 +79,86 @@ def get_grouped_items(event, subevent=None, voucher=None):
     ).filter(
         quotac__gt=0
     ).order_by('category__position', 'category_id', 'position', 'name')
+
+
+def get_product_list_snapshot(event, subevent=None):
+    """
+    Returns the parts of the product list that only change if the event's products are
+    changed, i.e. all active products with their categories, tax rules, variations and quotas
+    as well as the price overrides of the subevent. The snapshot is stored in the event's
+    cache and is therefore thrown away whenever one of these objects is saved or deleted.
+    The availability of the products is not part of the snapshot.
+    """
+    key = 'product_list_snapshot_%s' % (subevent.pk if subevent else 'event')
+    snapshot = event.cache.get(key)
+    if snapshot is None:
+        snapshot = {
+            'items': list(_get_item_queryset(event, subevent)),
+            'item_price_override': subevent.item_price_overrides if subevent else {},
+            'var_price_override': subevent.var_price_overrides if subevent else {},
+        }
+        # The event object carries unpicklable state around, so we need to detach it first
+        _set_snapshot_event(snapshot, None)
+        event.cache.set(key, snapshot, 3600)
+    _set_snapshot_event(snapshot, event)
+    return snapshot
+
+
+def _set_snapshot_event(snapshot, event):
+    cache_name = Item._meta.get_field('event').get_cache_name()
+    for item in snapshot['items']:
+        objs = [item] + item._subevent_quotas
+        for var in item.available_variations:
+            objs += var._subevent_quotas
+        for o in objs:
+            if event is None:
+                o.__dict__.pop(cache_name, None)
+            else:
+                setattr(o, cache_name, event)
+
+
+def get_grouped_items(event, subevent=None, voucher=None):
+    if voucher:
+        items = _get_item_queryset(event, subevent, voucher)
+        if subevent:
+            item_price_override = subevent.item_price_overrides
+            var_price_override = subevent.var_price_overrides
+        else:
+            item_price_override = {}
+            var_price_override = {}
+    else:
+        snapshot = get_product_list_snapshot(event, subevent)
+        items = snapshot['items']
+        item_price_override = snapshot['item_price_override']
+        var_price_override = snapshot['var_price_override']
+
+    now_dt = now()
+    items = [
+        item for item in items
+        if (item.available_from is None or item.available_from <= now_dt)
+        and (item.available_until is None or item.available_until >= now_dt)
+    ]
+
     display_add_to_cart = False
     external_quota_cache = event.cache.get('item_quota_cache')
     quota_cache = external_quota_cache or {}
 
-    if subevent:
-        item_price_override = subevent.item_price_overrides
-        var_price_override = subevent.var_price_overrides
-    else:
-        item_price_override = {}
-        var_price_override = {}
+    if not voucher or not (voucher.allow_ignore_quota or voucher.block_quota):
+        # Compute the availability of all quotas involved in a constant number of queries
+        # instead of running the counting queries for every single quota
+        quotas_to_compute = {}
+        for item in items:
+            for q in item._subevent_quotas:
+                quotas_to_compute[q.pk] = q
+            for var in item.available_variations:
+                for q in var._subevent_quotas:
+                    quotas_to_compute[q.pk] = q
+        if quota_cache.get('_count_waitinglist', True) is not True:
+            quota_cache.clear()
+        quotas_to_compute = [q for pk, q in quotas_to_compute.items() if pk not in quota_cache]
+        if quotas_to_compute:
+            quota_cache.update(Quota.objects.compute_availability(quotas_to_compute))
+            quota_cache['_count_waitinglist'] = True
 
     for item in items:
         if voucher and voucher.item_id and voucher.variation_id:
@@ -101,6 +101,10 @@ PRETIX_PLUGINS_DEFAULT = config.get('pretix', 'plugins_default',
 
 FETCH_ECB_RATES = config.getboolean('pretix', 'ecb_rates', fallback=True)
 
+PRETIX_QUOTA_COUNTERS = config.getboolean('pretix', 'quota_counters', fallback=False)
+PRETIX_QUOTA_LOCKING = config.getboolean('pretix', 'quota_locking', fallback=False)
+PRETIX_CHECKIN_INDEX = config.getboolean('pretix', 'checkin_index', fallback=False)
+
 DEFAULT_CURRENCY = config.get('pretix', 'currency', fallback='EUR')
 CURRENCIES = list(currencies)
 
@@ -118,12 +122,26 @@ EMAIL_HOST_PASSWORD = config.get('mail', 'password', fallback='')
 EMAIL_USE_TLS = config.getboolean('mail', 'tls', fallback=False)
 EMAIL_USE_SSL = config.getboolean('mail', 'ssl', fallback=False)
 EMAIL_SUBJECT_PREFIX = '[pretix] '
+MAIL_BULK_RATE = config.getfloat('mail', 'bulk_rate', fallback=0)
+MAIL_POOL = config.getboolean('mail', 'pool', fallback=True)
+MAIL_POOL_MAX_MESSAGES = config.getint('mail', 'pool_max_messages', fallback=100)
+MAIL_POOL_IDLE_TIMEOUT = config.getfloat('mail', 'pool_idle_timeout', fallback=60)
+MAIL_POOL_KEEPALIVE = config.getfloat('mail', 'pool_keepalive', fallback=15)
+MAIL_BATCH_WAIT = config.getfloat('mail', 'batch_wait', fallback=0)
+MAIL_BATCH_SIZE = config.getint('mail', 'batch_size', fallback=50)
 
 ADMINS = [('Admin', n) for n in config.get('mail', 'admins', fallback='').split(",") if n]
 
 METRICS_ENABLED = config.get('metrics', 'enabled', fallback=False)
 METRICS_USER = config.get('metrics', 'user', fallback="metrics")
 METRICS_PASSPHRASE = config.get('metrics', 'passphrase', fallback="")
+METRICS_FLUSH_INTERVAL = config.getfloat('metrics', 'flush_interval', fallback=5)
+METRICS_MODEL_COUNTS = config.get('metrics', 'model_counts', fallback='estimated')
+METRICS_MODEL_COUNTS_CACHE = config.getint('metrics', 'model_counts_cache', fallback=300)
+METRICS_SLOW_REQUEST = config.getfloat('metrics', 'slow_request', fallback=0)
+
+LOCKING_FAIR = config.getboolean('locking', 'fair', fallback=False)
+LOCKING_MAX_WAIT = config.getfloat('locking', 'max_wait', fallback=10.0)
 
 CACHES = {
     'default': {
@@ -177,6 +195,7 @@ if HAS_CELERY:
     CELERY_RESULT_BACKEND = config.get('celery', 'backend')
 else:
     CELERY_TASK_ALWAYS_EAGER = True
+CELERY_RESULT_WAIT = config.getfloat('celery', 'result_wait', fallback=0)
 
 SESSION_COOKIE_DOMAIN = config.get('pretix', 'cookie_domain', fallback=None)
 
@@ -296,10 +315,15 @@ if METRICS_ENABLED:
 
 
 PROFILING_RATE = config.getfloat('django', 'profile', fallback=0)  # Percentage of requests to profile
-if PROFILING_RATE > 0:
+PROFILING_SAMPLE_INTERVAL = config.getfloat('django', 'profile_sampling', fallback=0)  # Seconds between samples
+if PROFILING_RATE > 0 or PROFILING_SAMPLE_INTERVAL > 0:
     if not os.path.exists(PROFILE_DIR):
         os.mkdir(PROFILE_DIR)
+if PROFILING_RATE > 0:
     MIDDLEWARE.insert(0, 'pretix.helpers.profile.middleware.CProfileMiddleware')
+if PROFILING_SAMPLE_INTERVAL > 0:
+    MIDDLEWARE.insert(MIDDLEWARE.index('pretix.multidomain.middlewares.MultiDomainMiddleware') + 1,
+                      'pretix.helpers.profile.middleware.SamplingProfilerMiddleware')
 
 
 # Security settings
@@ -521,15 +545,19 @@ CELERY_TASK_QUEUES = (
     Queue('checkout', routing_key='checkout.#'),
     Queue('mail', routing_key='mail.#'),
     Queue('background', routing_key='background.#'),
+    Queue('invoices', routing_key='invoices.#'),
 )
 CELERY_TASK_ROUTES = ([
     ('pretix.base.services.cart.*', {'queue': 'checkout'}),
     ('pretix.base.services.orders.*', {'queue': 'checkout'}),
     ('pretix.base.services.mail.*', {'queue': 'mail'}),
+    ('pretix.base.services.invoices.*', {'queue': 'invoices'}),
     ('pretix.base.services.style.*', {'queue': 'background'}),
     ('pretix.base.services.update_check.*', {'queue': 'background'}),
     ('pretix.base.services.quotas.*', {'queue': 'background'}),
     ('pretix.base.services.waitinglist.*', {'queue': 'background'}),
+    ('pretix.base.services.periodic.*', {'queue': 'background'}),
+    ('pretix.base.services.tickets.pregenerate_*', {'queue': 'background'}),
     ('pretix.plugins.banktransfer.*', {'queue': 'background'}),
 ],)
 
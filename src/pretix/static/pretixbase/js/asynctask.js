@@ -5,6 +5,7 @@ var async_task_check_url = null;
 var async_task_old_url = null;
 var async_task_is_download = false;
 var async_task_is_long = false;
+var async_task_check_delay = 100;
 
 function async_task_check() {
     "use strict";
@@ -32,9 +33,14 @@ function async_task_check_callback(data, jqXHR, status) {
         location.href = data.redirect;
         return;
     }
-    async_task_timeout = window.setTimeout(async_task_check, 250);
+    // The server does not wait for the task to finish, so we ask again with a growing delay
+    async_task_check_delay = Math.min(async_task_check_delay * 1.5, 1000);
+    async_task_timeout = window.setTimeout(async_task_check, async_task_check_delay);
 
-    if (async_task_is_long) {
+    if (typeof data.percentage === "number") {
+        $("#loadingmodal p").text(gettext('Your request is currently being processed. {percentage} % done.')
+                                  .replace(/\{percentage\}/, Math.round(data.percentage)));
+    } else if (async_task_is_long) {
         $("#loadingmodal p").text(gettext('Your request has been queued on the server and will now be ' +
                                           'processed. Depending on the size of your event, this might take up to a ' +
                                           'few minutes.'));
@@ -84,7 +90,8 @@ function async_task_callback(data, jqXHR, status) {
     }
     async_task_id = data.async_id;
     async_task_check_url = data.check_url;
-    async_task_timeout = window.setTimeout(async_task_check, 100);
+    async_task_check_delay = 100;
+    async_task_timeout = window.setTimeout(async_task_check, async_task_check_delay);
 
     if (async_task_is_long) {
         $("#loadingmodal p").text(gettext('Your request has been queued on the server and will now be ' +
@@ -124,7 +131,15 @@ function async_task_error(jqXHR, textStatus, errorThrown) {
 
 $(function () {
     "use strict";
+    $("body").on('click', 'form[data-asynctask] [type=submit]', function () {
+        // Buttons like "Preview" need a normal page load instead of an asynchronous task
+        $(this.form).data('asynctask-skip', $(this).is('[data-no-asynctask]'));
+    });
     $("body").on('submit', 'form[data-asynctask]', function (e) {
+        if ($(this).data('asynctask-skip')) {
+            $(this).data('asynctask-skip', false);
+            return;
+        }
         e.preventDefault();
         if ($("body").data('ajaxing')) {
             return;
@@ -0,0 +1,82 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.utils.timezone import now
+
+from pretix.base.exporters.json import JSONExporter
+from pretix.base.exporters.orderlist import OrderListExporter
+from pretix.base.models import (
+    CachedFile, Event, Item, Order, OrderPosition, Organizer, Quota,
+)
+from pretix.base.services.export import export
+from pretix.helpers.database import keyset_batches
+
+
+@pytest.fixture
+def event():
+    o = Organizer.objects.create(name='Dummy', slug='dummy')
+    event = Event.objects.create(
+        organizer=o, name='Dummy', slug='dummy',
+        date_from=now()
+    )
+    item = Item.objects.create(event=event, name='Ticket', default_price=Decimal('23.00'))
+    quota = Quota.objects.create(event=event, name='Tickets', size=10)
+    quota.items.add(item)
+    for i in range(5):
+        order = Order.objects.create(
+            code='FOO%d' % i, event=event, email='dummy@dummy.test', status=Order.STATUS_PAID,
+            datetime=now(), expires=now() + timedelta(days=10), total=Decimal('23.00'),
+        )
+        OrderPosition.objects.create(order=order, item=item, variation=None, price=Decimal('23.00'))
+    return event
+
+
+@pytest.mark.django_db
+def test_keyset_batches(event):
+    batches = list(keyset_batches(event.orders.all(), batch_size=2))
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert [o.pk for b in batches for o in b] == sorted(event.orders.values_list('pk', flat=True))
+
+
+@pytest.mark.django_db
+def test_json_export_stream(event):
+    filename, filetype, chunks = JSONExporter(event).render_stream({})
+    assert filename == 'dummy_pretixdata.json'
+    data = json.loads(''.join(chunks))
+    assert data['event']['slug'] == 'dummy'
+    assert [o['code'] for o in data['event']['orders']] == ['FOO%d' % i for i in range(5)]
+    assert len(data['event']['orders'][0]['positions']) == 1
+    assert data['event']['quotas'][0]['size'] == 10
+    assert json.loads(JSONExporter(event).render({})[2]) == data
+
+
+@pytest.mark.django_db
+def test_keyset_batches_order_field(event):
+    event.orders.filter(code='FOO0').update(datetime=now() + timedelta(days=1))
+    batches = list(keyset_batches(event.orders.all(), batch_size=2, order_field='datetime'))
+    assert [o.code for b in batches for o in b] == ['FOO1', 'FOO2', 'FOO3', 'FOO4', 'FOO0']
+
+
+@pytest.mark.django_db
+def test_orderlist_export_stream(event):
+    progress = []
+    ex = OrderListExporter(event)
+    ex.progress_callback = progress.append
+    filename, filetype, chunks = ex.render_stream({'paid_only': True})
+    lines = b''.join(chunks).decode().splitlines()
+    assert len(lines) == 6
+    assert lines[1].startswith('"FOO0"')
+    assert progress == [100]
+
+
+@pytest.mark.django_db
+def test_export_task_with_reports_plugin(event):
+    event.plugins = 'pretix.plugins.reports'
+    event.save()
+    cf = CachedFile.objects.create(expires=now() + timedelta(days=1), date=now())
+    export(event.pk, str(cf.pk), 'orderlistcsv', {'paid_only': True})
+    cf.refresh_from_db()
+    assert cf.filename == 'orders.csv'
+    assert len(cf.file.read().decode().splitlines()) == 6
@@ -15,7 +15,7 @@ from pretix.base.models import (
 from pretix.base.models.orders import OrderFee
 from pretix.base.services.invoices import (
     build_preview_invoice_pdf, generate_cancellation, generate_invoice,
-    invoice_pdf_task, regenerate_invoice,
+    invoice_pdf_batch_task, invoice_pdf_task, regenerate_invoice,
 )
 from pretix.base.services.orders import OrderChangeManager
 from pretix.base.settings import GlobalSettingsObject
@@ -251,6 +251,18 @@ def test_pdf_generation(env):
     assert invoice_pdf_task(cancellation.pk)
 
 
+@pytest.mark.django_db
+def test_pdf_batch_generation(env):
+    event, order = env
+    inv = generate_invoice(order, trigger_pdf=False)
+    cancellation = generate_cancellation(inv, trigger_pdf=False)
+    invoice_pdf_batch_task([inv.pk, cancellation.pk])
+    inv.refresh_from_db()
+    cancellation.refresh_from_db()
+    assert inv.file
+    assert cancellation.file
+
+
 @pytest.mark.django_db
 def test_pdf_generation_custom_text(env):
     event, order = env
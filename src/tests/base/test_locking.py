@@ -1,6 +1,9 @@
+import threading
 import time
 
 import pytest
+from django.db import connection
+from django.test import override_settings
 from django.utils.timezone import now
 
 from pretix.base.models import Event, Organizer
@@ -51,3 +54,303 @@ def test_lock_timeout_steal(event):
     locking.lock_event(ev)
     with pytest.raises(LockReleaseException):
         locking.release_event(event)
+
+
+@pytest.mark.django_db
+def test_named_lock_exclusive():
+    lock = locking.acquire_named_lock('job', 60)
+    assert lock is not None
+    assert locking.acquire_named_lock('job', 60) is None
+    other = locking.acquire_named_lock('other_job', 60)
+    assert other is not None
+    locking.release_named_lock(lock)
+    locking.release_named_lock(other)
+    lock = locking.acquire_named_lock('job', 60)
+    assert lock is not None
+    locking.release_named_lock(lock)
+
+
+@pytest.mark.django_db
+def test_named_lock_timeout_steal():
+    lock = locking.acquire_named_lock('job', 1)
+    time.sleep(1.5)
+    stolen = locking.acquire_named_lock('job', 1)
+    assert stolen is not None
+    locking.release_named_lock(lock)
+    assert locking.acquire_named_lock('job', 1) is None
+    locking.release_named_lock(stolen)
+
+
+@pytest.mark.django_db
+@override_settings(PRETIX_QUOTA_LOCKING=True)
+def test_quota_locking_different_quotas(event):
+    q1 = event.quotas.create(name='Q1', size=10)
+    q2 = event.quotas.create(name='Q2', size=10)
+    with event.lock(quotas=[q1]):
+        ev = Event.objects.get(id=event.id)
+        with ev.lock(quotas=[q2]):
+            pass
+
+
+@pytest.mark.django_db
+@override_settings(PRETIX_QUOTA_LOCKING=True)
+def test_quota_locking_overlapping_quotas(event):
+    q1 = event.quotas.create(name='Q1', size=10)
+    q2 = event.quotas.create(name='Q2', size=10)
+    with event.lock(quotas=[q1, q2]):
+        with pytest.raises(LockTimeoutException):
+            ev = Event.objects.get(id=event.id)
+            with ev.lock(quotas=[q2]):
+                pass
+    with event.lock(quotas=[q2]):
+        pass
+
+
+@pytest.mark.django_db
+@override_settings(PRETIX_QUOTA_LOCKING=True)
+def test_quota_locking_excludes_event_lock(event):
+    q1 = event.quotas.create(name='Q1', size=10)
+    with event.lock(quotas=[q1]):
+        with pytest.raises(LockTimeoutException):
+            ev = Event.objects.get(id=event.id)
+            with ev.lock():
+                pass
+    with event.lock():
+        with pytest.raises(LockTimeoutException):
+            ev = Event.objects.get(id=event.id)
+            with ev.lock(quotas=[q1]):
+                pass
+
+
+@pytest.mark.django_db
+def test_quota_locking_disabled(event):
+    q1 = event.quotas.create(name='Q1', size=10)
+    q2 = event.quotas.create(name='Q2', size=10)
+    with event.lock(quotas=[q1]):
+        with pytest.raises(LockTimeoutException):
+            ev = Event.objects.get(id=event.id)
+            with ev.lock(quotas=[q2]):
+                pass
+
+
+@pytest.mark.django_db
+@override_settings(PRETIX_QUOTA_LOCKING=False)
+def test_quota_callable_not_called_without_quota_locking(event):
+    def quotas():
+        raise AssertionError('Quotas should not be computed')
+
+    with event.lock(quotas=quotas):
+        with pytest.raises(LockTimeoutException):
+            ev = Event.objects.get(id=event.id)
+            with ev.lock():
+                pass
+
+
+@pytest.mark.django_db
+@override_settings(PRETIX_QUOTA_LOCKING=True)
+def test_quota_locking_callable(event):
+    q1 = event.quotas.create(name='Q1', size=10)
+    q2 = event.quotas.create(name='Q2', size=10)
+    with event.lock(quotas=lambda: [q1]):
+        ev = Event.objects.get(id=event.id)
+        with ev.lock(quotas=lambda: [q2]):
+            pass
+
+
+@pytest.mark.django_db
+@override_settings(METRICS_ENABLED=True)
+def test_lock_metrics(event, monkeypatch):
+    observed = []
+    monkeypatch.setattr(locking.pretix_lock_wait_seconds, 'observe',
+                        lambda amount, **kwargs: observed.append(('wait', kwargs)))
+    monkeypatch.setattr(locking.pretix_lock_hold_seconds, 'observe',
+                        lambda amount, **kwargs: observed.append(('hold', kwargs)))
+    monkeypatch.setattr(locking.pretix_lock_timeouts_total, 'inc',
+                        lambda amount, **kwargs: observed.append(('timeout', kwargs)))
+    with event.lock():
+        with pytest.raises(LockTimeoutException):
+            ev = Event.objects.get(id=event.id)
+            with ev.lock():
+                pass
+    assert observed == [
+        ('wait', {'lock_type': 'event'}),
+        ('timeout', {'lock_type': 'event'}),
+        ('hold', {'lock_type': 'event'}),
+    ]
+
+
+class FakeRedis:
+    """
+    Emulates the subset of redis commands used by the fair locks.
+    """
+
+    def __init__(self):
+        self.locks = {}
+        self.queues = {}
+        self.hashes = {}
+
+    def time(self):
+        t = time.time()
+        return int(t), int((t - int(t)) * 1000000)
+
+    def execute_command(self, command, key, nx, score, member):
+        assert (command, nx) == ('ZADD', 'NX')
+        self.queues.setdefault(key, {}).setdefault(member.encode(), score)
+
+    def expire(self, key, timeout):
+        pass
+
+    def zrange(self, key, start, end):
+        return sorted(self.queues.get(key, {}), key=self.queues.get(key, {}).get)[start:end + 1]
+
+    def zrem(self, key, member):
+        self.queues.get(key, {}).pop(member if isinstance(member, bytes) else member.encode(), None)
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field if isinstance(field, bytes) else field.encode()] = str(value).encode()
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field if isinstance(field, bytes) else field.encode(), None)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((getattr(self.redis, name), args))
+
+    def execute(self):
+        return [func(*args) for func, args in self.commands]
+
+
+class FakeLock:
+
+    def __init__(self, redis, name, timeout):
+        self.redis = redis
+        self.name = name
+
+    def acquire(self, blocking=True):
+        if self.name in self.redis.locks:
+            return False
+        self.redis.locks[self.name] = self
+        return True
+
+    def release(self):
+        assert self.redis.locks.pop(self.name) is self
+
+
+@pytest.fixture
+def fair_redis(monkeypatch):
+    import django_redis
+    import redis.lock
+
+    rc = FakeRedis()
+    monkeypatch.setattr(django_redis, 'get_redis_connection', lambda alias: rc)
+    monkeypatch.setattr(redis.lock, 'Lock', FakeLock)
+    with override_settings(HAS_REDIS=True, LOCKING_FAIR=True, LOCKING_MAX_WAIT=0.2):
+        yield rc
+
+
+@pytest.mark.django_db
+def test_fair_locking_exclusive(event, fair_redis):
+    with event.lock():
+        with pytest.raises(LockTimeoutException):
+            ev = Event.objects.get(id=event.id)
+            with ev.lock():
+                pass
+    with event.lock():
+        pass
+    assert not any(fair_redis.queues.values())
+    assert not any(fair_redis.hashes.values())
+
+
+@pytest.mark.django_db
+def test_fair_locking_dead_waiter(event, fair_redis):
+    queue = 'pretix_lockqueue_%d' % event.pk
+    fair_redis.queues[queue] = {b'dead': time.time() - 1}
+    fair_redis.hset(queue + '_heartbeats', 'dead', time.time() - locking.HEARTBEAT_TIMEOUT - 1)
+    with event.lock():
+        pass
+    assert b'dead' not in fair_redis.queues[queue]
+
+
+@pytest.mark.django_db
+def test_fair_locking_waits_in_line(event, fair_redis):
+    queue = 'pretix_lockqueue_%d' % event.pk
+    fair_redis.queues[queue] = {b'alive': time.time() - 1}
+    fair_redis.hset(queue + '_heartbeats', 'alive', time.time() + 10)
+    with pytest.raises(LockTimeoutException):
+        with event.lock():
+            pass
+
+
+@pytest.mark.django_db
+@override_settings(PRETIX_QUOTA_LOCKING=True)
+def test_fair_locking_single_deadline(event, fair_redis, monkeypatch):
+    q1 = event.quotas.create(name='Q1', size=10)
+    q2 = event.quotas.create(name='Q2', size=10)
+    deadlines = []
+    lock_key = locking.lock_key_redis_fair
+
+    def record(key, deadline=None):
+        deadlines.append(deadline)
+        return lock_key(key, deadline)
+
+    monkeypatch.setattr(locking, 'lock_key_redis_fair', record)
+    with event.lock(quotas=[q1, q2]):
+        pass
+    assert len(deadlines) == 2
+    assert deadlines[0] == deadlines[1]
+
+    fair_redis.locks['pretix_event_quota_%d' % q1.pk] = None
+    t0 = time.perf_counter()
+    with pytest.raises(LockTimeoutException):
+        locking.lock_key_redis_fair('quota_%d' % q1.pk, t0)
+    assert time.perf_counter() - t0 < 0.1
+
+
+@pytest.mark.django_db
+@override_settings(LOCKING_FAIR=True, HAS_REDIS=False)
+def test_fair_locking_unavailable(event, caplog):
+    if connection.vendor == 'postgresql':
+        pytest.skip('Fair locking is available on PostgreSQL')
+    locking._warn_fair_unavailable.cache_clear()
+    with event.lock():
+        pass
+    assert 'Fair locking is enabled' in caplog.text
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(LOCKING_FAIR=True, HAS_REDIS=False, LOCKING_MAX_WAIT=0.2)
+def test_advisory_locking(event):
+    if connection.vendor != 'postgresql':
+        pytest.skip('Advisory locks require PostgreSQL')
+    results = []
+
+    def lock_in_thread():
+        try:
+            ev = Event.objects.get(id=event.id)
+            with ev.lock():
+                results.append(True)
+        except LockTimeoutException:
+            results.append(False)
+        finally:
+            connection.close()
+
+    with event.lock():
+        t = threading.Thread(target=lock_in_thread)
+        t.start()
+        t.join()
+    t = threading.Thread(target=lock_in_thread)
+    t.start()
+    t.join()
+    assert results == [False, True]
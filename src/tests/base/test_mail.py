@@ -1,13 +1,22 @@
 import os
+import threading
+from datetime import timedelta
+from smtplib import SMTPRecipientsRefused
+from unittest import mock
 
 import pytest
 from django.conf import settings
 from django.core import mail as djmail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.smtp import EmailBackend
+from django.test import override_settings
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
-from pretix.base.models import Event, Organizer, User
-from pretix.base.services.mail import mail
+from pretix.base.email import SMTPConnectionPool
+from pretix.base.models import Event, Order, Organizer, User
+from pretix.base.services import mail as mail_module
+from pretix.base.services.mail import mail, mail_send_task, render_mail_html
 
 
 @pytest.fixture
@@ -100,3 +109,111 @@ def test_sendmail_placeholder(env):
     assert len(djmail.outbox) == 1
     assert djmail.outbox[0].to == [user.email]
     assert djmail.outbox[0].subject == 'Dummy Test subject'
+
+
+@pytest.mark.django_db
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+def test_mail_html_wrapper_cached(env, mocker):
+    event, user, organizer = env
+    event.settings.primary_color = '#123456'
+    orders = [
+        Order.objects.create(
+            code=code, event=event, email='dummy@dummy.test', status=Order.STATUS_PENDING,
+            datetime=now(), expires=now() + timedelta(days=10), total=0,
+        ) for code in ('FOO', 'BAR')
+    ]
+    htmlctx = {'site': 'pretix', 'site_url': 'https://example.com', 'color': '#123456', 'event': event}
+    spy = mocker.spy(mail_module, 'inline_css')
+    html1 = render_mail_html(htmlctx, '<p>Hello <a href="https://example.org">you</a></p>', orders[0])
+    html2 = render_mail_html(htmlctx, '<p>Bye &amp; thanks</p>', orders[1])
+    assert spy.call_count == 3  # wrapper once, body twice
+
+    assert 'FOO' in html1 and 'BAR' not in html1
+    assert 'BAR' in html2 and 'Bye &amp; thanks' in html2
+    link = html1[html1.index('<a href="https://example.org"'):]
+    assert '#123456' in link[:link.index('>')]
+    assert 'placeholder' not in html1 + html2
+    assert '<style' not in html1
+
+
+@pytest.mark.django_db
+def test_mail_send_task_inlines_css(env):
+    djmail.outbox = []
+    mail_send_task(to=['dummy@dummy.dummy'], subject='Test', body='Test', sender='dummy@dummy.dummy',
+                   html='<html><head><style>p { color: red; }</style></head><body><p>Test</p></body></html>')
+    html = djmail.outbox[0].alternatives[0][0]
+    assert '<style' not in html
+    assert 'red' in html[html.index('<p'):html.index('Test')]
+
+
+class DummySMTPBackend(EmailBackend):
+    opened = 0
+    sent = []
+
+    def open(self):
+        if self.connection:
+            return False
+        DummySMTPBackend.opened += 1
+        self.connection = mock.Mock(**{'noop.return_value': (250, b'OK')})
+        return True
+
+    def close(self):
+        self.connection = None
+
+    def send_messages(self, email_messages):
+        for m in email_messages:
+            if 'fail@example.org' in m.to:
+                raise SMTPRecipientsRefused({'fail@example.org': (550, b'No such user')})
+            DummySMTPBackend.sent.append(m.to[0])
+        return len(email_messages)
+
+
+@pytest.fixture
+def pool():
+    DummySMTPBackend.opened = 0
+    DummySMTPBackend.sent = []
+    p = SMTPConnectionPool()
+    yield p
+    p.close_all()
+
+
+@override_settings(MAIL_POOL_MAX_MESSAGES=3)
+def test_mail_pool_reuses_connections(pool):
+    for i in range(5):
+        assert pool.send(DummySMTPBackend(host='smtp.example.org'), EmailMessage(to=['foo@example.org']))
+    assert DummySMTPBackend.opened == 2
+    pool.send(DummySMTPBackend(host='smtp.example.com'), EmailMessage(to=['foo@example.org']))
+    assert DummySMTPBackend.opened == 3
+
+
+def test_mail_pool_evicts_idle_connections(pool):
+    pool.send(DummySMTPBackend(), EmailMessage(to=['foo@example.org']))
+    pool.evict(max_idle=-1)
+    pool.send(DummySMTPBackend(), EmailMessage(to=['foo@example.org']))
+    assert DummySMTPBackend.opened == 2
+
+
+@override_settings(MAIL_BATCH_WAIT=5, MAIL_BATCH_SIZE=3)
+def test_mail_pool_batches_concurrent_messages(pool):
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(pool.send(DummySMTPBackend(), EmailMessage(to=['a@b.c']))))
+        for i in range(3)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [True, True, True]
+    assert DummySMTPBackend.sent == ['a@b.c'] * 3
+    assert DummySMTPBackend.opened == 1
+
+
+@pytest.mark.parametrize('use_pool', [True, False])
+def test_mail_pool_failure_does_not_resend(pool, use_pool):
+    recipients = ['a@example.org', 'b@example.org', 'fail@example.org', 'd@example.org', 'e@example.org']
+    messages = [EmailMessage(to=[r]) for r in recipients]
+    with override_settings(MAIL_POOL=use_pool):
+        failed = pool.send_messages(DummySMTPBackend(), messages)
+    assert failed == [messages[2]]
+    assert DummySMTPBackend.sent == ['a@example.org', 'b@example.org', 'd@example.org', 'e@example.org']
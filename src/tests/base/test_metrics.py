@@ -34,7 +34,7 @@ class FakeRedis(object):
         pass
 
 
-@override_settings(HAS_REDIS=True)
+@override_settings(HAS_REDIS=True, METRICS_FLUSH_INTERVAL=0)
 def test_counter(monkeypatch):
 
     fake_redis = FakeRedis()
@@ -73,7 +73,7 @@ def test_counter(monkeypatch):
     assert fake_redis.storage[fullname_dimless] == 20
 
 
-@override_settings(HAS_REDIS=True)
+@override_settings(HAS_REDIS=True, METRICS_FLUSH_INTERVAL=0)
 def test_gauge(monkeypatch):
 
     fake_redis = FakeRedis()
@@ -131,7 +131,7 @@ def test_gauge(monkeypatch):
     assert fake_redis.storage[fullname_dimless] == 20
 
 
-@override_settings(HAS_REDIS=True)
+@override_settings(HAS_REDIS=True, METRICS_FLUSH_INTERVAL=0)
 def test_histogram(monkeypatch):
 
     fake_redis = FakeRedis()
@@ -166,8 +166,41 @@ def test_histogram(monkeypatch):
     assert fake_redis.storage['my_histogram_bucket{dimension="two",le="1.0"}'] == 1
 
 
+@override_settings(HAS_REDIS=True, METRICS_FLUSH_INTERVAL=3600)
+def test_buffered(monkeypatch):
+
+    fake_redis = FakeRedis()
+
+    monkeypatch.setattr(metrics, "redis", fake_redis, raising=False)
+    monkeypatch.setattr(metrics, "buffer", metrics.MetricsBuffer())
+
+    test_counter = metrics.Counter("my_counter", "this is a helpstring")
+    test_gauge = metrics.Gauge("my_gauge", "this is a helpstring")
+    test_hist = metrics.Histogram("my_histogram", "this is a helpstring")
+
+    test_counter.inc(3)
+    test_counter.inc(4)
+    test_gauge.inc(5)
+    test_gauge.set(2)
+    test_gauge.inc(1)
+    test_hist.observe(0.9)
+    test_hist.observe(3.0)
+    metrics.flush_metrics()
+    assert fake_redis.storage == {}
+
+    metrics.buffer.flush()
+    assert fake_redis.storage['my_counter'] == 7
+    assert fake_redis.storage['my_gauge'] == 3
+    assert fake_redis.storage['my_histogram_count'] == 2
+    assert fake_redis.storage['my_histogram_bucket{le="1.0"}'] == 1
+
+    test_counter.inc(1)
+    metrics.buffer.flush()
+    assert fake_redis.storage['my_counter'] == 8
+
+
 @pytest.mark.django_db
-@override_settings(HAS_REDIS=True, METRICS_USER="foo", METRICS_PASSPHRASE="bar")
+@override_settings(HAS_REDIS=True, METRICS_FLUSH_INTERVAL=0, METRICS_USER="foo", METRICS_PASSPHRASE="bar")
 def test_metrics_view(monkeypatch, client):
 
     fake_redis = FakeRedis()
@@ -189,3 +222,31 @@ def test_metrics_view(monkeypatch, client):
     # test metrics-view
     basic_auth = {"HTTP_AUTHORIZATION": base64.b64encode(bytes("foo:bar", "utf-8"))}
     assert "{} {}".format(fullname, counter_value) not in client.get("/metrics", headers=basic_auth)
+
+
+@pytest.mark.django_db
+@override_settings(METRICS_MODEL_COUNTS='estimated', METRICS_MODEL_COUNTS_CACHE=0)
+def test_model_counts():
+    from pretix.base.models import Organizer
+
+    Organizer.objects.create(name='Dummy', slug='dummy')
+    counts = metrics.model_counts()
+    # SQLite has no estimates, so the rows are counted
+    assert counts['pretixbase.organizer'] == 1
+
+    with override_settings(METRICS_MODEL_COUNTS='off'):
+        assert metrics.model_counts() == {}
+
+
+@pytest.mark.django_db
+@override_settings(METRICS_MODEL_COUNTS='estimated', METRICS_MODEL_COUNTS_CACHE=0)
+def test_model_counts_small_tables(monkeypatch):
+    from pretix.base.models import Organizer
+
+    Organizer.objects.create(name='Dummy', slug='dummy')
+    # Tables that have never been analyzed are estimated to be empty
+    monkeypatch.setattr(metrics, '_estimated_table_sizes', lambda tables: {'pretixbase_organizer': 0})
+    assert metrics.model_counts()['pretixbase.organizer'] == 1
+
+    monkeypatch.setattr(metrics, '_estimated_table_sizes', lambda tables: {'pretixbase_organizer': 50000})
+    assert metrics.model_counts()['pretixbase.organizer'] == 50000
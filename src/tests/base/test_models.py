@@ -9,7 +9,7 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils.timezone import now
 
 from pretix.base.models import (
@@ -18,11 +18,14 @@ from pretix.base.models import (
     Voucher, WaitingListEntry,
 )
 from pretix.base.models.event import SubEvent
-from pretix.base.models.items import SubEventItem, SubEventItemVariation
+from pretix.base.models.items import (
+    QuotaCounter, SubEventItem, SubEventItemVariation,
+)
 from pretix.base.reldate import RelativeDate, RelativeDateWrapper
 from pretix.base.services.orders import (
     OrderError, cancel_order, mark_order_paid, perform_order,
 )
+from pretix.base.services.quotas import reconcile_quota_counters
 
 
 class UserTestCase(TestCase):
@@ -438,9 +441,196 @@ class QuotaTestCase(BaseQuotaTestCase):
         self.assertEqual(self.item1.check_quotas(subevent=se2), (Quota.AVAILABILITY_OK, 50 - 2 - 4 - 5 - 13))
         self.assertEqual(q1.availability(), (Quota.AVAILABILITY_OK, 50 - 5 - 6 - 8 - 16))
         self.assertEqual(q2.availability(), (Quota.AVAILABILITY_OK, 50 - 2 - 4 - 5 - 13))
+
+        with self.assertNumQueries(6):
+            res = Quota.objects.compute_availability([q1, q2])
+        self.assertEqual(res, {
+            q1.pk: (Quota.AVAILABILITY_OK, 50 - 5 - 6 - 8 - 16),
+            q2.pk: (Quota.AVAILABILITY_OK, 50 - 2 - 4 - 5 - 13),
+        })
+        self.assertEqual(Quota.objects.compute_availability([q1, q2], count_waitinglist=False), {
+            q1.pk: (Quota.AVAILABILITY_OK, 50 - 5 - 6 - 8),
+            q2.pk: (Quota.AVAILABILITY_OK, 50 - 2 - 4 - 5),
+        })
         self.event.has_subevents = False
         self.event.save()
 
+    def test_compute_availability(self):
+        quota2 = Quota.objects.create(event=self.event, name="Test 2", size=10)
+        quota3 = Quota.objects.create(event=self.event, name="Test 3", size=None)
+        quota4 = Quota.objects.create(event=self.event, name="Test 4", size=4)
+        self.quota.size = 5
+        self.quota.save()
+        self.quota.items.add(self.item1)
+        self.quota.items.add(self.item2)
+        self.quota.variations.add(self.var1)
+        quota2.items.add(self.item1)
+        quota2.items.add(self.item2)
+        quota2.variations.add(self.var1)
+        quota2.variations.add(self.var2)
+        quota3.items.add(self.item1)
+        quota4.items.add(self.item3)
+        quota4.variations.add(self.var3)
+
+        order = Order.objects.create(event=self.event, status=Order.STATUS_PAID,
+                                     expires=now() + timedelta(days=3), total=4)
+        OrderPosition.objects.create(order=order, item=self.item1, price=2)
+        OrderPosition.objects.create(order=order, item=self.item2, variation=self.var2, price=2)
+        order = Order.objects.create(event=self.event, status=Order.STATUS_PENDING,
+                                     expires=now() + timedelta(days=3), total=4)
+        OrderPosition.objects.create(order=order, item=self.item2, variation=self.var1, price=2)
+        OrderPosition.objects.create(order=order, item=self.item3, variation=self.var3, price=2)
+        Voucher.objects.create(quota=quota2, event=self.event, block_quota=True, max_usages=3, redeemed=1)
+        Voucher.objects.create(item=self.item2, event=self.event, block_quota=True)
+        v = Voucher.objects.create(quota=quota4, event=self.event, block_quota=True)
+        CartPosition.objects.create(event=self.event, item=self.item3, variation=self.var3, price=2,
+                                    expires=now() + timedelta(days=3), voucher=v)
+        CartPosition.objects.create(event=self.event, item=self.item1, price=2,
+                                    expires=now() + timedelta(days=3))
+        CartPosition.objects.create(event=self.event, item=self.item1, price=2,
+                                    expires=now() - timedelta(days=3))
+        WaitingListEntry.objects.create(event=self.event, item=self.item2, variation=self.var1, email='foo@bar.com')
+
+        quotas = [self.quota, quota2, quota3, quota4]
+        expected = {q.pk: q.availability() for q in quotas}
+        self.assertEqual(Quota.objects.compute_availability(quotas), expected)
+        self.assertEqual(expected[quota3.pk], (Quota.AVAILABILITY_OK, None))
+        self.assertEqual(expected[self.quota.pk], (Quota.AVAILABILITY_RESERVED, 0))
+
+        expected = {q.pk: q.availability(count_waitinglist=False) for q in quotas}
+        self.assertEqual(Quota.objects.compute_availability(quotas, count_waitinglist=False), expected)
+
+
+@override_settings(PRETIX_QUOTA_COUNTERS=True)
+class QuotaCounterTestCase(BaseQuotaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.quota.size = 10
+        self.quota.save()
+        self.quota.items.add(self.item1)
+        self.quota.items.add(self.item2)
+        self.quota.variations.add(self.var1)
+        self.quota2 = Quota.objects.create(event=self.event, name="Test 2", size=10)
+        self.quota2.items.add(self.item2)
+        self.quota2.variations.add(self.var2)
+
+    def _assert_counters(self, quota, paid, pending, waitinglist):
+        c = QuotaCounter.objects.get(quota=quota)
+        self.assertEqual((c.paid_orders, c.pending_orders, c.waitinglist), (paid, pending, waitinglist))
+        with override_settings(PRETIX_QUOTA_COUNTERS=False):
+            expected = quota.availability()
+        self.assertEqual(quota.availability(), expected)
+        self.assertEqual(Quota.objects.compute_availability([quota]), {quota.pk: expected})
+
+    def test_reconcile(self):
+        order = Order.objects.create(event=self.event, status=Order.STATUS_PAID,
+                                     expires=now() + timedelta(days=3), total=4)
+        OrderPosition.objects.create(order=order, item=self.item1, price=2)
+        OrderPosition.objects.create(order=order, item=self.item2, variation=self.var2, price=2)
+        WaitingListEntry.objects.create(event=self.event, item=self.item1, email='foo@bar.com')
+        self.assertFalse(QuotaCounter.objects.exists())
+
+        reconcile_quota_counters()
+        self._assert_counters(self.quota, 1, 0, 1)
+        self._assert_counters(self.quota2, 1, 0, 0)
+
+        with self.assertNumQueries(1):
+            reconcile_quota_counters()
+
+    def test_order_lifecycle(self):
+        reconcile_quota_counters()
+        order = Order.objects.create(event=self.event, status=Order.STATUS_PENDING,
+                                     expires=now() + timedelta(days=3), total=4)
+        OrderPosition.objects.create(order=order, item=self.item1, price=2)
+        p = OrderPosition.objects.create(order=order, item=self.item2, variation=self.var1, price=2)
+        self._assert_counters(self.quota, 0, 2, 0)
+        self._assert_counters(self.quota2, 0, 0, 0)
+
+        p = OrderPosition.objects.get(pk=p.pk)
+        p.variation = self.var2
+        p.save()
+        self._assert_counters(self.quota, 0, 1, 0)
+        self._assert_counters(self.quota2, 0, 1, 0)
+
+        order = Order.objects.get(pk=order.pk)
+        mark_order_paid(order)
+        self._assert_counters(self.quota, 1, 0, 0)
+        self._assert_counters(self.quota2, 1, 0, 0)
+
+        order.status = Order.STATUS_REFUNDED
+        order.save()
+        self._assert_counters(self.quota, 0, 0, 0)
+        self._assert_counters(self.quota2, 0, 0, 0)
+
+    def test_refresh_from_db(self):
+        reconcile_quota_counters()
+        order = Order.objects.create(event=self.event, status=Order.STATUS_PENDING,
+                                     expires=now() + timedelta(days=3), total=4)
+        OrderPosition.objects.create(order=order, item=self.item1, price=2)
+        stale = Order.objects.get(pk=order.pk)
+        mark_order_paid(order)
+        self._assert_counters(self.quota, 1, 0, 0)
+
+        # The status loaded by refresh_from_db() is the base for the next change
+        stale.refresh_from_db()
+        stale.status = Order.STATUS_REFUNDED
+        stale.save()
+        self._assert_counters(self.quota, 0, 0, 0)
+
+    def test_cancel_and_delete(self):
+        reconcile_quota_counters()
+        order = Order.objects.create(event=self.event, status=Order.STATUS_PENDING,
+                                     expires=now() + timedelta(days=3), total=4)
+        OrderPosition.objects.create(order=order, item=self.item1, price=2)
+        p = OrderPosition.objects.create(order=order, item=self.item1, price=2)
+        self._assert_counters(self.quota, 0, 2, 0)
+        OrderPosition.objects.get(pk=p.pk).delete()
+        self._assert_counters(self.quota, 0, 1, 0)
+        cancel_order(order.pk)
+        self._assert_counters(self.quota, 0, 0, 0)
+
+    def test_waitinglist(self):
+        reconcile_quota_counters()
+        wle = WaitingListEntry.objects.create(event=self.event, item=self.item2, variation=self.var1,
+                                              email='foo@bar.com')
+        WaitingListEntry.objects.create(event=self.event, item=self.item1, email='foo@bar.com')
+        self._assert_counters(self.quota, 0, 0, 2)
+        wle = WaitingListEntry.objects.get(pk=wle.pk)
+        wle.send_voucher()
+        self._assert_counters(self.quota, 0, 0, 1)
+        wle.delete()
+        self._assert_counters(self.quota, 0, 0, 1)
+
+    def test_reset_on_product_change(self):
+        reconcile_quota_counters()
+        self.assertTrue(QuotaCounter.objects.filter(quota=self.quota2).exists())
+        self.quota2.items.add(self.item1)
+        self.assertFalse(QuotaCounter.objects.filter(quota=self.quota2).exists())
+        self.assertTrue(QuotaCounter.objects.filter(quota=self.quota).exists())
+        self.item3.quotas.add(self.quota)
+        self.assertFalse(QuotaCounter.objects.filter(quota=self.quota).exists())
+
+    def test_reset_on_quota_change(self):
+        reconcile_quota_counters()
+        quota = Quota.objects.get(pk=self.quota.pk)
+        quota.name = "Renamed"
+        quota.save()
+        self.assertTrue(QuotaCounter.objects.filter(quota=self.quota).exists())
+        quota.size = 5
+        quota.save()
+        self.assertFalse(QuotaCounter.objects.filter(quota=self.quota).exists())
+
+    def test_unreconciled_counter_ignored(self):
+        order = Order.objects.create(event=self.event, status=Order.STATUS_PAID,
+                                     expires=now() + timedelta(days=3), total=2)
+        OrderPosition.objects.create(order=order, item=self.item1, price=2)
+        QuotaCounter.objects.create(quota=self.quota)
+        self.assertEqual(self.quota.availability(), (Quota.AVAILABILITY_OK, 9))
+        self.assertEqual(Quota.objects.compute_availability([self.quota]),
+                         {self.quota.pk: (Quota.AVAILABILITY_OK, 9)})
+        reconcile_quota_counters()
+        self._assert_counters(self.quota, 1, 0, 0)
+
 
 class WaitingListTestCase(BaseQuotaTestCase):
 
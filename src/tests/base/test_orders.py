@@ -4,7 +4,7 @@ from decimal import Decimal
 import pytest
 import pytz
 from django.core import mail as djmail
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils.timezone import make_aware, now
 from django_countries.fields import Country
 
@@ -19,8 +19,9 @@ from pretix.base.reldate import RelativeDate, RelativeDateWrapper
 from pretix.base.services.invoices import generate_invoice
 from pretix.base.services.orders import (
     OrderChangeManager, OrderError, _create_order, expire_orders,
-    send_download_reminders,
+    mark_orders_paid, send_download_reminders,
 )
+from pretix.base.services.stats import order_overview
 
 
 @pytest.fixture
@@ -183,6 +184,56 @@ def test_expiring_auto_disabled(event):
     assert o2.status == Order.STATUS_PENDING
 
 
+@pytest.mark.django_db
+def test_mark_orders_paid_changed_concurrently(event):
+    o1 = Order.objects.create(
+        code='FOO', event=event, email='dummy@dummy.test',
+        status=Order.STATUS_PENDING,
+        datetime=now(), expires=now() + timedelta(days=10),
+        total=0, payment_provider='banktransfer'
+    )
+    o2 = Order.objects.create(
+        code='FO2', event=event, email='dummy@dummy.test',
+        status=Order.STATUS_PENDING,
+        datetime=now(), expires=now() + timedelta(days=10),
+        total=0, payment_provider='banktransfer'
+    )
+    Order.objects.filter(pk=o1.pk).update(status=Order.STATUS_CANCELED, email='other@dummy.test')
+    results = []
+    errors = mark_orders_paid(event, [(o1, '{}'), (o2, '{}')], provider='banktransfer', send_mail=False,
+                              on_result=lambda order, error: results.append(order.code))
+    assert errors == {}
+    assert results == ['FO2']
+    o1 = Order.objects.get(id=o1.id)
+    assert o1.status == Order.STATUS_CANCELED
+    assert o1.email == 'other@dummy.test'
+    o2 = Order.objects.get(id=o2.id)
+    assert o2.status == Order.STATUS_PAID
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+def test_order_overview_cached(event):
+    item = Item.objects.create(event=event, name='Ticket', default_price=Decimal('23.00'))
+    order = Order.objects.create(
+        code='FOO', event=event, email='dummy@dummy.test', status=Order.STATUS_PENDING,
+        datetime=now(), expires=now() + timedelta(days=10), total=Decimal('23.00'),
+    )
+    OrderPosition.objects.create(order=order, item=item, variation=None, price=Decimal('23.00'))
+    assert order_overview(event)[1]['num_pending'][0] == 1
+
+    # Changes that bypass the models are not seen until the cache is invalidated
+    Order.objects.filter(pk=order.pk).update(status=Order.STATUS_CANCELED)
+    assert order_overview(event)[1]['num_pending'][0] == 1
+
+    order = Order.objects.get(pk=order.pk)
+    order.status = Order.STATUS_PAID
+    order.save()
+    items_by_category, total = order_overview(event)
+    assert total['num_pending'][0] == 0
+    assert total['num_paid'][:2] == (1, Decimal('23.00'))
+
+
 class DownloadReminderTests(TestCase):
     def setUp(self):
         super().setUp()
@@ -0,0 +1,78 @@
+import pytest
+from django.core.management import call_command
+from django.test import override_settings
+
+from pretix.base.services.locking import (
+    acquire_named_lock, release_named_lock,
+)
+from pretix.base.services.periodic import (
+    minimum_interval, receiver_name, run_periodic_receiver, run_periodic_tasks,
+)
+from pretix.base.signals import periodic_task
+
+calls = []
+
+
+@minimum_interval(60)
+def hourly(sender, **kwargs):
+    calls.append('hourly')
+
+
+def failing(sender, **kwargs):
+    calls.append('failing')
+    raise ValueError()
+
+
+@pytest.fixture
+def receivers():
+    calls.clear()
+    periodic_task.connect(hourly, dispatch_uid='test_periodic_hourly')
+    periodic_task.connect(failing, dispatch_uid='test_periodic_failing')
+    yield
+    periodic_task.disconnect(dispatch_uid='test_periodic_hourly')
+    periodic_task.disconnect(dispatch_uid='test_periodic_failing')
+
+
+@pytest.mark.django_db
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+def test_minimum_interval(receivers):
+    scheduled = run_periodic_tasks()
+    assert receiver_name(hourly) in scheduled
+    assert receiver_name(failing) in scheduled
+    assert calls.count('hourly') == 1
+    assert calls.count('failing') == 1
+
+    scheduled = run_periodic_tasks()
+    assert receiver_name(hourly) not in scheduled
+    assert calls.count('hourly') == 1
+    assert calls.count('failing') == 2
+
+
+@pytest.mark.django_db
+def test_skip_running(receivers):
+    lock = acquire_named_lock('periodic_%s' % receiver_name(failing), 3600)
+    assert lock is not None
+    run_periodic_receiver(receiver_name(failing))
+    assert calls == []
+    release_named_lock(lock)
+
+    run_periodic_receiver(receiver_name(failing))
+    assert calls == ['failing']
+
+
+@pytest.mark.django_db
+def test_lock_released_after_failure(receivers):
+    run_periodic_receiver(receiver_name(failing))
+    run_periodic_receiver(receiver_name(failing))
+    assert calls == ['failing', 'failing']
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+def test_skip_overlapping_runs(receivers):
+    from django.core.cache import cache
+
+    cache.set('pretix_periodic_scheduler', True)
+    assert run_periodic_tasks() is None
+    call_command('runperiodic')
+    assert calls == []
+    cache.delete('pretix_periodic_scheduler')
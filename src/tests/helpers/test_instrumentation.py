@@ -0,0 +1,46 @@
+import pytest
+from django.test import override_settings
+
+from pretix.base.cache import NamespacedCache
+from pretix.base.models import Organizer
+from pretix.helpers.metrics import instrumentation
+
+
+@pytest.mark.django_db
+@override_settings(METRICS_ENABLED=True)
+def test_collect_queries():
+    instrumentation.install()
+    with instrumentation.collect(keep_queries=True) as stats:
+        Organizer.objects.create(name='Dummy', slug='dummy')
+        list(Organizer.objects.all())
+    assert stats.db_queries >= 2
+    assert stats.db_time > 0
+    assert len(stats.slowest_queries()) == stats.db_queries
+
+    list(Organizer.objects.all())
+    assert instrumentation.current() is None
+
+
+def test_collect_cache():
+    cache = NamespacedCache('instrumentation_test')
+    with instrumentation.collect() as stats:
+        cache.set('foo', 'bar')
+        cache.get('foo')
+    assert stats.cache_calls == 2
+
+
+def test_nested_signals():
+    with instrumentation.collect() as stats:
+        with instrumentation.signal_timer():
+            with instrumentation.signal_timer():
+                pass
+            inner = stats.signal_time
+    assert inner == 0
+    assert stats.signal_time > 0
+
+
+def test_slowest_queries():
+    stats = instrumentation.RequestStats(keep_queries=True)
+    for i in range(20):
+        stats.query('SELECT %d' % i, i)
+    assert [sql for duration, sql in stats.slowest_queries()] == ['SELECT %d' % i for i in range(19, 9, -1)]
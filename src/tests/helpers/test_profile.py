@@ -0,0 +1,63 @@
+import threading
+
+from django.core.management import call_command
+from django.test import RequestFactory, override_settings
+from django.utils.six import StringIO
+
+from pretix.helpers.profile.middleware import SamplingProfilerMiddleware
+from pretix.helpers.profile.sampling import SamplingProfiler, read_stacks
+
+
+def _busy(profiler):
+    profiler.sample()
+
+
+@override_settings(PROFILING_SAMPLE_INTERVAL=0)
+def test_sampling_profiler(tmpdir):
+    profiler = SamplingProfiler()
+    profiler.sample()
+    with profiler.activate('presale:event.index'):
+        _busy(profiler)
+        _busy(profiler)
+    profiler.sample()
+
+    with override_settings(PROFILE_DIR=str(tmpdir)):
+        profiler.write()
+        stacks = read_stacks()
+        assert len(stacks) == 1
+        stack, count = stacks.popitem()
+        assert count == 2
+        assert stack.startswith('presale:event.index;')
+        assert stack.endswith('tests.helpers.test_profile:_busy;pretix.helpers.profile.sampling:sample')
+        assert read_stacks('celery:foo') == {}
+
+        out = StringIO()
+        call_command('profilestacks', '--clear', stdout=out)
+        assert out.getvalue() == '{} 2\n'.format(stack)
+        assert read_stacks() == {}
+
+
+@override_settings(PROFILING_SAMPLE_INTERVAL=0)
+def test_sampling_profiler_other_threads():
+    profiler = SamplingProfiler()
+    started = threading.Event()
+    done = threading.Event()
+
+    def work():
+        with profiler.activate('celery:foo'):
+            started.set()
+            done.wait(5)
+
+    t = threading.Thread(target=work)
+    t.start()
+    started.wait(5)
+    profiler.sample()
+    done.set()
+    t.join()
+    assert [s.split(';', 1)[0] for s in profiler._stacks] == ['celery:foo']
+
+
+def test_sampling_middleware_unknown_url():
+    response = object()
+    middleware = SamplingProfilerMiddleware(lambda request: response)
+    assert middleware(RequestFactory().get('/this/does/not/exist/')) is response
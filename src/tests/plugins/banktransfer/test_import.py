@@ -9,7 +9,7 @@ from django.utils.timezone import now
 from pretix.base.models import (
     Event, Item, Order, OrderPosition, Organizer, Quota, Team, User,
 )
-from pretix.plugins.banktransfer.models import BankImportJob
+from pretix.plugins.banktransfer.models import BankImportJob, BankTransaction
 from pretix.plugins.banktransfer.tasks import process_banktransfers
 
 
@@ -221,6 +221,70 @@ def test_mark_paid_organizer_weird_slug(env, orga_job):
     assert env[2].status == Order.STATUS_PAID
 
 
+@pytest.mark.django_db
+def test_statement_with_many_transactions(env, job):
+    process_banktransfers(job, [{
+        'payer': 'Karla Kundin',
+        'reference': 'Bestellung DUMMY1Z3AS',
+        'date': '2016-01-26',
+        'amount': '23.50'
+    }, {
+        'payer': 'Karla Kundin',
+        'reference': 'Bestellung DUMMY1234S',
+        'date': '2016-01-26',
+        'amount': '23.00'
+    }, {
+        'payer': 'Karl Kunde',
+        'reference': 'Bestellung DUMMY1Z3AS',
+        'date': '2016-01-27',
+        'amount': '23.00'
+    }, {
+        'payer': 'Karla Kundin',
+        'reference': 'Bestellung DUMMY6789Z',
+        'date': '2016-01-26',
+        'amount': '23.00'
+    }, {
+        'payer': 'Karla Kundin',
+        'reference': 'Bestellung DUMMYABCDE',
+        'date': '2016-01-26',
+        'amount': '23.00'
+    }])
+    env[2].refresh_from_db()
+    assert env[2].status == Order.STATUS_PAID
+    states = list(BankTransaction.objects.order_by('pk').values_list('state', flat=True))
+    assert states == [
+        BankTransaction.STATE_INVALID, BankTransaction.STATE_VALID, BankTransaction.STATE_DUPLICATE,
+        BankTransaction.STATE_ERROR, BankTransaction.STATE_NOMATCH
+    ]
+
+
+@pytest.mark.django_db
+def test_payment_actions_fail(env, job, monkeypatch):
+    def fail(*args, **kwargs):
+        raise Exception('Something went wrong')
+
+    monkeypatch.setattr('pretix.base.services.orders._order_paid_actions', fail)
+    process_banktransfers(job, [{
+        'payer': 'Karla Kundin',
+        'reference': 'Bestellung DUMMY1Z3AS',
+        'date': '2016-01-26',
+        'amount': '23.00'
+    }])
+    env[2].refresh_from_db()
+    assert env[2].status == Order.STATUS_PAID
+    assert BankTransaction.objects.get().state == BankTransaction.STATE_VALID
+    assert BankImportJob.objects.get(pk=job).state == BankImportJob.STATE_COMPLETED
+
+    # Running the import again does not touch the applied payment
+    process_banktransfers(BankImportJob.objects.create(event=env[0]).pk, [{
+        'payer': 'Karla Kundin',
+        'reference': 'Bestellung DUMMY1Z3AS',
+        'date': '2016-01-26',
+        'amount': '23.00'
+    }])
+    assert BankTransaction.objects.get().state == BankTransaction.STATE_VALID
+
+
 @pytest.mark.django_db
 def test_wrong_event_organizer(env, orga_job):
     Event.objects.create(
@@ -0,0 +1,276 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.utils.timezone import now
+
+from pretix.base.models import (
+    Checkin, Event, Item, Order, OrderPosition, Organizer,
+)
+from pretix.plugins.pretixdroid.index import (
+    SecretIndex, checkins_created, invalidate_list,
+)
+from pretix.plugins.pretixdroid.models import AppConfiguration
+
+
+def _bytes(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class FakeRedis(object):
+    """
+    Emulates the subset of redis commands used by the secret index.
+    """
+
+    def __init__(self):
+        self.storage = {}
+
+    def exists(self, key):
+        return key in self.storage
+
+    def delete(self, *keys):
+        for key in keys:
+            self.storage.pop(key, None)
+
+    def expire(self, key, timeout):
+        return key in self.storage
+
+    def get(self, key):
+        return self.storage.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.storage:
+            return None
+        self.storage[key] = _bytes(value)
+        return True
+
+    def incr(self, key):
+        self.storage[key] = _bytes(int(self.storage.get(key, b'0')) + 1)
+        return int(self.storage[key])
+
+    def rename(self, src, dst):
+        self.storage[dst] = self.storage.pop(src)
+
+    def hget(self, key, field):
+        return self.storage.get(key, {}).get(_bytes(field))
+
+    def hmget(self, key, fields):
+        return [self.hget(key, f) for f in fields]
+
+    def hset(self, key, field, value):
+        self.storage.setdefault(key, {})[_bytes(field)] = _bytes(value)
+
+    def hsetnx(self, key, field, value):
+        h = self.storage.setdefault(key, {})
+        if _bytes(field) in h:
+            return 0
+        h[_bytes(field)] = _bytes(value)
+        return 1
+
+    def hmset(self, key, mapping):
+        for field, value in mapping.items():
+            self.hset(key, field, value)
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.storage.get(key, {}).pop(_bytes(field), None)
+
+    def sadd(self, key, *values):
+        self.storage.setdefault(key, set()).update(_bytes(v) for v in values)
+
+    def smembers(self, key):
+        return set(self.storage.get(key, set()))
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+        self.immediate = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.reset()
+
+    def __getattr__(self, name):
+        func = getattr(self.redis, name)
+
+        def call(*args, **kwargs):
+            if self.immediate:
+                return func(*args, **kwargs)
+            self.commands.append((func, args, kwargs))
+            return self
+        return call
+
+    def watch(self, *keys):
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def reset(self):
+        self.commands = []
+        self.immediate = False
+
+    def execute(self):
+        results = [func(*args, **kwargs) for func, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake_redis = FakeRedis()
+    monkeypatch.setattr('pretix.plugins.pretixdroid.index._redis', lambda: fake_redis)
+    monkeypatch.setattr('pretix.plugins.pretixdroid.views.index_enabled', lambda: True)
+    return fake_redis
+
+
+@pytest.fixture
+def env():
+    o = Organizer.objects.create(name='Dummy', slug='dummy')
+    event = Event.objects.create(
+        organizer=o, name='Dummy', slug='dummy',
+        date_from=now(), plugins='pretix.plugins.pretixdroid'
+    )
+    ticket = Item.objects.create(event=event, name='Ticket', default_price=23)
+    o1 = Order.objects.create(
+        code='FOO', event=event, status=Order.STATUS_PAID,
+        datetime=now(), expires=now() + timedelta(days=10),
+        total=23, payment_provider='banktransfer'
+    )
+    op = OrderPosition.objects.create(order=o1, item=ticket, price=23, attendee_name="Peter", secret='1234')
+    cl = event.checkin_lists.create(name="Foo", all_products=True)
+    AppConfiguration.objects.create(event=event, key='abcdefg', list=cl)
+    return event, op, cl
+
+
+def _scan(client, secret, **kwargs):
+    resp = client.post('/pretixdroid/api/dummy/dummy/redeem/?key=abcdefg', data=dict(secret=secret, **kwargs))
+    return json.loads(resp.content.decode("utf-8"))
+
+
+@pytest.mark.django_db
+def test_index_scan(client, env, fake_redis):
+    event, op, cl = env
+    jdata = _scan(client, '1234')
+    assert jdata['status'] == 'ok'
+    assert jdata['data']['attendee_name'] == 'Peter'
+    assert Checkin.objects.filter(position=op, list=cl).count() == 1
+    assert SecretIndex(cl, rc=fake_redis).get('1234')['position'] == op.pk
+
+    jdata = _scan(client, 'unknown')
+    assert jdata['status'] == 'error'
+    assert jdata['reason'] == 'unknown_ticket'
+
+
+@pytest.mark.django_db
+def test_index_scan_unpaid(client, env, fake_redis):
+    event, op, cl = env
+    op.order.status = Order.STATUS_PENDING
+    op.order.save()
+    jdata = _scan(client, '1234')
+    assert jdata['reason'] == 'unpaid'
+    assert jdata['data']['attendee_name'] == 'Peter'
+    assert not jdata['data']['redeemed']
+    assert not Checkin.objects.exists()
+
+
+@pytest.mark.django_db
+def test_index_double_scan(client, env, fake_redis):
+    event, op, cl = env
+    assert _scan(client, '1234', nonce='foo')['status'] == 'ok'
+    assert _scan(client, '1234', nonce='foo')['status'] == 'ok'
+    jdata = _scan(client, '1234', nonce='bar')
+    assert jdata['status'] == 'error'
+    assert jdata['reason'] == 'already_redeemed'
+    assert Checkin.objects.filter(position=op, list=cl).count() == 1
+
+
+@pytest.mark.django_db
+def test_index_rebuild_after_invalidation(client, env, fake_redis):
+    event, op, cl = env
+    assert _scan(client, '1234')['status'] == 'ok'
+
+    invalidate_list(cl)
+    idx = SecretIndex(cl, rc=fake_redis)
+    assert not fake_redis.exists(idx.entries_key)
+    assert fake_redis.exists(idx.checkins_key)
+    assert _scan(client, '1234')['reason'] == 'already_redeemed'
+    assert fake_redis.exists(idx.entries_key)
+
+    # The check-ins are merged in from the database if their hash is gone as well
+    fake_redis.delete(idx.checkins_key)
+    invalidate_list(cl)
+    assert _scan(client, '1234')['reason'] == 'already_redeemed'
+    assert Checkin.objects.filter(position=op, list=cl).count() == 1
+
+
+@pytest.mark.django_db
+def test_index_build_keeps_claimed_checkins(env, fake_redis):
+    event, op, cl = env
+    idx = SecretIndex(cl, rc=fake_redis)
+    assert idx.build()
+    # Claimed by a device, but not yet in the database
+    assert idx.checkin('1234', 'foo') == (True, 'foo')
+    idx.invalidate()
+    assert idx.build()
+    assert idx.checkin('1234', 'bar') == (False, 'foo')
+
+
+@pytest.mark.django_db
+def test_index_build_locked(client, env, fake_redis):
+    event, op, cl = env
+    idx = SecretIndex(cl, rc=fake_redis)
+    fake_redis.set(idx.build_key, 'someone else')
+    assert not idx.build()
+    assert idx.get('1234') is None
+    # Scans fall back to the database while someone else builds the index
+    assert _scan(client, '1234')['status'] == 'ok'
+    assert _scan(client, '1234')['reason'] == 'already_redeemed'
+
+
+@pytest.mark.django_db
+def test_index_invalidated_while_building(env, fake_redis, monkeypatch):
+    event, op, cl = env
+    idx = SecretIndex(cl, rc=fake_redis)
+    entry = SecretIndex._entry
+
+    def entry_and_invalidate(self, *args):
+        idx.invalidate()
+        return entry(self, *args)
+
+    monkeypatch.setattr(SecretIndex, '_entry', entry_and_invalidate)
+    assert not idx.build()
+    assert not fake_redis.exists(idx.entries_key)
+    assert not fake_redis.exists(idx.build_key)
+
+
+@pytest.mark.django_db
+def test_index_scan_not_indexed_again(client, env, fake_redis, monkeypatch):
+    event, op, cl = env
+    calls = []
+    monkeypatch.setattr('pretix.plugins.pretixdroid.signals.index_enabled', lambda: True)
+    monkeypatch.setattr('pretix.plugins.pretixdroid.signals.after_commit', lambda func, *args: calls.append(func))
+    assert _scan(client, '1234')['status'] == 'ok'
+    assert calls == []
+
+
+@pytest.mark.django_db
+def test_index_checkins_keep_nonce(env, fake_redis):
+    event, op, cl = env
+    idx = SecretIndex(cl, rc=fake_redis)
+    assert idx.build()
+    checkins_created(cl, [('1234', 'foo')])
+    assert idx.checkin('1234', 'bar') == (False, 'foo')
+
+    Checkin.objects.create(position=op, list=cl, nonce='foo')
+    idx.revert_checkin('1234')
+    idx.update([op.pk])
+    assert idx.checkin('1234', 'bar') == (False, 'foo')
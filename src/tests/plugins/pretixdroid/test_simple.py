@@ -258,6 +258,60 @@ def test_search_invoice_name(client, env):
     assert set([r['attendee_name'] for r in jdata['results']]) == {'John', 'Peter'}
 
 
+@pytest.mark.django_db
+def test_redeem_batch(client, env):
+    AppConfiguration.objects.create(event=env[0], key='abcdefg', list=env[5])
+    env[2].status = Order.STATUS_PENDING
+    env[2].save()
+    Checkin.objects.create(position=env[4], list=env[5], nonce='foo')
+    o2 = Order.objects.create(
+        code='BAR', event=env[0], status=Order.STATUS_PAID,
+        datetime=now(), expires=now() + timedelta(days=10),
+        total=0, payment_provider='banktransfer'
+    )
+    OrderPosition.objects.create(order=o2, item=env[4].item, price=23, secret='abcdef')
+    dt = (now() - timedelta(hours=1)).replace(microsecond=0)
+    resp = client.post(
+        '/pretixdroid/api/%s/%s/redeem/batch/?key=%s' % (env[0].organizer.slug, env[0].slug, 'abcdefg'),
+        data=json.dumps([
+            {'secret': '1234'},
+            {'secret': '1234', 'force': True},
+            {'secret': '5678910', 'nonce': 'foo'},
+            {'secret': 'abcdef', 'datetime': dt.isoformat(), 'nonce': 'bar'},
+            {'secret': 'abcdef'},
+            {'secret': 'unknown'},
+        ]), content_type='application/json'
+    )
+    jdata = json.loads(resp.content.decode("utf-8"))
+    assert jdata['version'] == API_VERSION
+    assert [(r['status'], r.get('reason')) for r in jdata['results']] == [
+        ('error', 'unpaid'),
+        ('ok', None),
+        ('ok', None),
+        ('ok', None),
+        ('error', 'already_redeemed'),
+        ('error', 'unknown_ticket'),
+    ]
+    assert jdata['results'][3]['data']['order'] == 'BAR'
+    # Errors come with the ticket's data, just like single scans
+    assert jdata['results'][0]['data']['secret'] == '1234'
+    assert not jdata['results'][0]['data']['redeemed']
+    assert 'data' not in jdata['results'][5]
+    assert Checkin.objects.count() == 3
+    assert Checkin.objects.get(position__secret='abcdef').datetime == dt
+    assert env[0].logentry_set.filter(action_type='pretix.plugins.pretixdroid.scan').count() == 3
+
+
+@pytest.mark.django_db
+def test_redeem_batch_invalid(client, env):
+    AppConfiguration.objects.create(event=env[0], key='abcdefg', list=env[5])
+    resp = client.post(
+        '/pretixdroid/api/%s/%s/redeem/batch/?key=%s' % (env[0].organizer.slug, env[0].slug, 'abcdefg'),
+        data=json.dumps({'secret': '1234'}), content_type='application/json'
+    )
+    assert resp.status_code == 400
+
+
 @pytest.mark.django_db
 def test_download_all_data(client, env):
     AppConfiguration.objects.create(event=env[0], key='abcdefg', list=env[5])
@@ -290,6 +344,52 @@ def test_download_item_restricted_list(client, env):
     assert jdata['results'][0]['secret'] == env[4].secret
 
 
+@pytest.mark.django_db
+def test_download_delta(client, env):
+    AppConfiguration.objects.create(event=env[0], key='abcdefg', list=env[5])
+    o2 = Order.objects.create(
+        code='BAR', event=env[0], status=Order.STATUS_PAID,
+        datetime=now(), expires=now() + timedelta(days=10),
+        total=0, payment_provider='banktransfer'
+    )
+    OrderPosition.objects.create(order=o2, item=env[4].item, price=23, secret='abcdef')
+    since = (now() - timedelta(minutes=5)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    Order.objects.update(last_modified=now() - timedelta(days=1))
+    OrderPosition.objects.update(last_modified=now() - timedelta(days=1))
+
+    resp = client.get('/pretixdroid/api/%s/%s/download/?key=%s&since=%s' % (
+        env[0].organizer.slug, env[0].slug, 'abcdefg', since))
+    jdata = json.loads(resp.content.decode("utf-8"))
+    assert jdata['orders'] == []
+    assert jdata['results'] == []
+    assert jdata['next'] is None
+    assert jdata['sync_token']
+
+    Checkin.objects.create(position=env[3], list=env[5])
+    o2.status = Order.STATUS_CANCELED
+    o2.save()
+    resp = client.get('/pretixdroid/api/%s/%s/download/?key=%s&since=%s&page_size=1' % (
+        env[0].organizer.slug, env[0].slug, 'abcdefg', since))
+    jdata = json.loads(resp.content.decode("utf-8"))
+    assert jdata['orders'] == ['FOO']
+    assert [r['secret'] for r in jdata['results']] == ['1234', '5678910']
+    assert jdata['results'][0]['redeemed']
+    resp = client.get(jdata['next'])
+    jdata2 = json.loads(resp.content.decode("utf-8"))
+    assert jdata2['orders'] == ['BAR']
+    assert jdata2['results'] == []
+    assert jdata2['next'] is None
+    assert jdata2['sync_token'] == jdata['sync_token']
+
+
+@pytest.mark.django_db
+def test_download_invalid_token(client, env):
+    AppConfiguration.objects.create(event=env[0], key='abcdefg', list=env[5])
+    resp = client.get('/pretixdroid/api/%s/%s/download/?key=%s&since=foo' % (
+        env[0].organizer.slug, env[0].slug, 'abcdefg'))
+    assert resp.status_code == 400
+
+
 @pytest.mark.django_db
 def test_status(client, env):
     AppConfiguration.objects.create(event=env[0], key='abcdefg', list=env[5])
@@ -1,12 +1,16 @@
 import datetime
+from smtplib import SMTPRecipientsRefused
 
 import pytest
 from django.core import mail as djmail
+from django.core.mail.backends.locmem import EmailBackend
 from django.utils.timezone import now
 
 from pretix.base.models import (
     Event, Item, ItemCategory, Order, OrderPosition, Organizer, Team, User,
 )
+from pretix.base.services.mail import SendMailException
+from pretix.plugins.sendmail.tasks import send_mails
 
 
 @pytest.fixture
@@ -230,3 +234,55 @@ def test_sendmail_placeholder(logged_in_client, sendmail_url, event, order):
     assert 'ORDER1234' in response.rendered_content
 
     assert len(djmail.outbox) == 0
+
+
+@pytest.mark.django_db
+def test_sendmail_batches(logged_in_client, sendmail_url, event, order, item, monkeypatch):
+    monkeypatch.setattr('pretix.plugins.sendmail.tasks.BATCH_SIZE', 2)
+    for i in range(4):
+        o = Order.objects.create(event=event, status=Order.STATUS_PENDING,
+                                 expires=now() + datetime.timedelta(hours=1),
+                                 total=13, code='DUMMY%d' % i, email='dummy%d@dummy.test' % i,
+                                 datetime=now(), payment_provider='banktransfer', locale='en')
+        OrderPosition.objects.create(order=o, item=item, price=13)
+    djmail.outbox = []
+    response = logged_in_client.post(sendmail_url,
+                                     {'sendto': 'n',
+                                      'subject_0': 'Test subject',
+                                      'message_0': 'Hello {code}'
+                                      },
+                                     follow=True)
+    assert 'alert-success' in response.rendered_content
+    assert sorted(m.to[0] for m in djmail.outbox) == ['dummy%d@dummy.test' % i for i in range(4)] + ['dummy@dummy.test']
+    assert 'Hello DUMMY0' in [m for m in djmail.outbox if m.to[0] == 'dummy0@dummy.test'][0].body
+    logs = event.logentry_set.filter(action_type='pretix.plugins.sendmail.order.email.sent')
+    assert logs.count() == 5
+    assert logs.get(object_id=order.pk).parsed_data['recipient'] == 'dummy@dummy.test'
+
+
+class FailingEmailBackend(EmailBackend):
+
+    def send_messages(self, messages):
+        for m in messages:
+            if m.to[0] == 'fail@dummy.test':
+                raise SMTPRecipientsRefused({m.to[0]: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+@pytest.mark.django_db
+def test_sendmail_failure_does_not_resend(event, order, item, monkeypatch):
+    monkeypatch.setattr(Event, 'get_mail_backend', lambda self: FailingEmailBackend())
+    for i, email in enumerate(['a@dummy.test', 'fail@dummy.test', 'c@dummy.test', 'd@dummy.test']):
+        o = Order.objects.create(event=event, status=Order.STATUS_PENDING,
+                                 expires=now() + datetime.timedelta(hours=1),
+                                 total=13, code='DUMMY%d' % i, email=email,
+                                 datetime=now(), payment_provider='banktransfer', locale='en')
+        OrderPosition.objects.create(order=o, item=item, price=13)
+    djmail.outbox = []
+    with pytest.raises(SendMailException) as excinfo:
+        send_mails(event.pk, None, {'en': 'Test subject'}, {'en': 'Hello {code}'}, ['n'])
+    assert 'fail@dummy.test' in str(excinfo.value)
+    assert sorted(m.to[0] for m in djmail.outbox) == ['a@dummy.test', 'c@dummy.test', 'd@dummy.test',
+                                                      'dummy@dummy.test']
+    logs = event.logentry_set.filter(action_type='pretix.plugins.sendmail.order.email.sent')
+    assert logs.count() == 4
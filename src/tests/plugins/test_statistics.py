@@ -0,0 +1,135 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+import pytz
+from django.utils.timezone import now
+
+from pretix.base.models import (
+    Event, Item, Order, OrderPosition, Organizer, Quota, Team, User,
+)
+from pretix.base.services.orders import mark_order_paid
+from pretix.plugins.statistics.models import (
+    ItemDayStatistics, OrderDayStatistics, StatisticsUpdate,
+)
+from pretix.plugins.statistics.tasks import refresh_event_statistics
+
+
+@pytest.fixture
+def env():
+    o = Organizer.objects.create(name='Dummy', slug='dummy')
+    event = Event.objects.create(
+        organizer=o, name='Dummy', slug='dummy',
+        date_from=now(), plugins='pretix.plugins.statistics'
+    )
+    user = User.objects.create_user('dummy@dummy.dummy', 'dummy')
+    t = Team.objects.create(organizer=o, can_view_orders=True)
+    t.members.add(user)
+    t.limit_events.add(event)
+    item = Item.objects.create(event=event, name='Ticket', default_price=Decimal('23.00'))
+    quota = Quota.objects.create(event=event, name='Tickets', size=10)
+    quota.items.add(item)
+    for i in range(3):
+        order = Order.objects.create(
+            code='FOO%d' % i, event=event, email='dummy@dummy.test', status=Order.STATUS_PENDING,
+            datetime=now() - timedelta(days=i), expires=now() + timedelta(days=10), total=Decimal('23.00'),
+        )
+        OrderPosition.objects.create(order=order, item=item, variation=None, price=Decimal('23.00'))
+    return event, user, item
+
+
+@pytest.mark.django_db
+def test_statistics_incremental(env):
+    event, user, item = env
+    assert StatisticsUpdate.objects.filter(event_id=event.pk).values('date').distinct().count() == 3
+    refresh_event_statistics(event)
+    assert not StatisticsUpdate.objects.filter(event_id=event.pk).exists()
+    assert OrderDayStatistics.objects.filter(event=event, subevent=None).count() == 3
+    assert sum(OrderDayStatistics.objects.filter(event=event).values_list('ordered', flat=True)) == 3
+
+    mark_order_paid(event.orders.get(code='FOO2'))
+    assert StatisticsUpdate.objects.filter(event_id=event.pk).values('date').distinct().count() == 2
+    refresh_event_statistics(event)
+    today = OrderDayStatistics.objects.filter(event=event).latest('date')
+    assert today.ordered == 1
+    assert today.paid == 1
+    assert today.revenue == Decimal('23.00')
+    s = ItemDayStatistics.objects.get(event=event, item=item, date=today.date - timedelta(days=2))
+    assert (s.ordered, s.paid, s.revenue) == (1, 1, Decimal('23.00'))
+
+
+@pytest.mark.django_db
+def test_statistics_marked_during_refresh(env, monkeypatch):
+    event, user, item = env
+    from pretix.plugins.statistics import tasks
+    compute = tasks.compute_statistics
+    day = now().astimezone(pytz.timezone(event.settings.timezone)).date()
+
+    def compute_and_mark(event, days=None):
+        compute(event, days)
+        # Another transaction marks the same day again after the day has been computed
+        StatisticsUpdate.objects.create(event_id=event.pk, date=day)
+
+    monkeypatch.setattr(tasks, 'compute_statistics', compute_and_mark)
+    refresh_event_statistics(event)
+    assert list(StatisticsUpdate.objects.filter(event_id=event.pk).values_list('date', flat=True)) == [day]
+
+
+@pytest.mark.django_db
+def test_statistics_full_rebuild(env):
+    event, user, item = env
+    refresh_event_statistics(event)
+    OrderDayStatistics.objects.all().delete()
+    StatisticsUpdate.objects.create(event_id=event.pk, date=None)
+    refresh_event_statistics(event)
+    assert sum(OrderDayStatistics.objects.filter(event=event).values_list('ordered', flat=True)) == 3
+
+
+@pytest.mark.django_db
+def test_statistics_view(client, env):
+    client.login(email='dummy@dummy.dummy', password='dummy')
+    r = client.get('/control/event/dummy/dummy/statistics/')
+    assert r.status_code == 200
+    assert b'"ordered": 3' in r.content
+
+
+@pytest.mark.django_db
+def test_statistics_plugin_enabled(env):
+    event, user, item = env
+    event.plugins = ''
+    event.save()
+    refresh_event_statistics(event)
+    OrderDayStatistics.objects.all().delete()
+
+    event = Event.objects.get(pk=event.pk)
+    event.plugins = 'pretix.plugins.statistics'
+    event.save()
+    assert StatisticsUpdate.objects.get(event_id=event.pk).date is None
+    refresh_event_statistics(event)
+    assert sum(OrderDayStatistics.objects.filter(event=event).values_list('ordered', flat=True)) == 3
+
+
+@pytest.mark.django_db
+def test_statistics_timezone_changed(env):
+    event, user, item = env
+    refresh_event_statistics(event)
+    event.settings.set('timezone', 'Pacific/Kiritimati')
+    assert StatisticsUpdate.objects.get(event_id=event.pk).date is None
+
+    refresh_event_statistics(event)
+    event.settings.set('timezone', 'Pacific/Kiritimati')
+    assert not StatisticsUpdate.objects.filter(event_id=event.pk).exists()
+
+
+@pytest.mark.django_db
+def test_statistics_plugin_inactive(env):
+    event, user, item = env
+    StatisticsUpdate.objects.all().delete()
+    event.plugins = ''
+    event.save()
+    order = Order.objects.create(
+        code='BAR', event=event, email='dummy@dummy.test', status=Order.STATUS_PENDING,
+        datetime=now(), expires=now() + timedelta(days=10), total=Decimal('23.00'),
+    )
+    OrderPosition.objects.create(order=order, item=item, variation=None, price=Decimal('23.00'))
+    assert not StatisticsUpdate.objects.exists()
@@ -3,11 +3,16 @@ from decimal import Decimal
 from io import BytesIO
 
 import pytest
+from django.test import override_settings
 from django.utils.timezone import now
 from PyPDF2 import PdfFileReader
 
 from pretix.base.models import (
-    Event, Item, ItemVariation, Order, OrderPosition, Organizer,
+    CachedCombinedTicket, CachedTicket, Event, Item, ItemVariation, Order,
+    OrderPosition, Organizer,
+)
+from pretix.base.services.tickets import (
+    get_cachedticket_for_position, pregenerate_orders,
 )
 from pretix.plugins.ticketoutputpdf.ticketoutput import PdfTicketOutput
 
@@ -49,3 +54,117 @@ def test_generate_pdf(env):
     assert ftype == 'application/pdf'
     pdf = PdfFileReader(BytesIO(buf))
     assert pdf.numPages == 1
+
+
+@pytest.mark.django_db
+def test_generate_pdf_batch(env):
+    event, order = env
+    o = PdfTicketOutput(event)
+    results = list(o.generate_batch(order.positions.select_related('order', 'item')))
+    assert [op for op, result in results] == list(order.positions.all())
+    for op, (fname, ftype, buf) in results:
+        assert ftype == 'application/pdf'
+        assert PdfFileReader(BytesIO(buf)).numPages == 1
+
+
+@pytest.mark.django_db
+def test_render_positions(env):
+    event, order = env
+    o = PdfTicketOutput(event)
+    pdf = PdfFileReader(BytesIO(o.render_positions(order.positions.select_related('order', 'item'))))
+    assert pdf.numPages == 2
+
+
+@pytest.mark.django_db
+def test_pregenerate_orders(env):
+    event, order = env
+    event.plugins += ',pretix.plugins.ticketoutputpdf'
+    event.save()
+    event.settings.set('ticket_download', True)
+    event.settings.set('ticket_download_nonadm', True)
+    event.settings.set('ticketoutput_pdf__enabled', True)
+    order.status = Order.STATUS_PAID
+    order.save()
+
+    pregenerate_orders([order.pk])
+    cts = CachedTicket.objects.filter(order_position__order=order, provider='pdf')
+    assert cts.count() == 2
+    assert all(ct.file for ct in cts)
+    assert CachedCombinedTicket.objects.get(order=order, provider='pdf').file
+
+    ids = set(cts.values_list('pk', flat=True))
+    pregenerate_orders([order.pk])
+    assert set(cts.values_list('pk', flat=True)) == ids
+
+
+@pytest.mark.django_db
+def test_pregenerate_skips_pending(env):
+    event, order = env
+    event.plugins += ',pretix.plugins.ticketoutputpdf'
+    event.save()
+    event.settings.set('ticket_download', True)
+    event.settings.set('ticket_download_nonadm', True)
+    event.settings.set('ticketoutput_pdf__enabled', True)
+    order.status = Order.STATUS_PAID
+    order.save()
+    pending = order.positions.first()
+    CachedTicket.objects.create(order_position=pending, provider='pdf', extension='', type='', file=None)
+
+    pregenerate_orders([order.pk])
+    assert not CachedTicket.objects.get(order_position=pending, provider='pdf').file
+    assert CachedTicket.objects.get(order_position=order.positions.last(), provider='pdf').file
+
+
+@pytest.mark.django_db
+def test_pregenerate_skips_non_admission(env):
+    event, order = env
+    event.plugins += ',pretix.plugins.ticketoutputpdf'
+    event.save()
+    event.settings.set('ticket_download', True)
+    event.settings.set('ticket_download_nonadm', False)
+    event.settings.set('ticketoutput_pdf__enabled', True)
+    order.status = Order.STATUS_PAID
+    order.save()
+
+    pregenerate_orders([order.pk])
+    assert not CachedTicket.objects.filter(order_position__order=order, provider='pdf').exists()
+
+
+@pytest.mark.django_db
+def test_pregenerate_discards_outdated(env, monkeypatch):
+    event, order = env
+    event.plugins += ',pretix.plugins.ticketoutputpdf'
+    event.save()
+    event.settings.set('ticket_download', True)
+    event.settings.set('ticket_download_nonadm', True)
+    event.settings.set('ticketoutput_pdf__enabled', True)
+    order.status = Order.STATUS_PAID
+    order.save()
+    generate_batch = PdfTicketOutput.generate_batch
+
+    def invalidating_batch(self, positions):
+        # The layout is changed and another run claims the tickets while we are still rendering
+        CachedTicket.objects.filter(order_position__order=order).delete()
+        for op in positions:
+            CachedTicket.objects.create(order_position=op, provider='pdf', extension='', type='', file=None)
+        yield from generate_batch(self, positions)
+
+    monkeypatch.setattr(PdfTicketOutput, 'generate_batch', invalidating_batch)
+    pregenerate_orders([order.pk])
+    cts = CachedTicket.objects.filter(order_position__order=order, provider='pdf')
+    assert cts.count() == 2
+    assert not any(ct.file for ct in cts)
+
+
+@pytest.mark.django_db
+@override_settings(REAL_CACHE_USED=False)
+def test_download_pending_without_cache(env):
+    event, order = env
+    event.plugins += ',pretix.plugins.ticketoutputpdf'
+    event.save()
+    event.settings.set('ticketoutput_pdf__enabled', True)
+    pending = order.positions.first()
+    CachedTicket.objects.create(order_position=pending, provider='pdf', extension='', type='', file=None)
+
+    get_cachedticket_for_position(pending, 'pdf')
+    assert CachedTicket.objects.get(order_position=pending, provider='pdf').file
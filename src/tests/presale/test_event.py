@@ -2,11 +2,12 @@ import datetime
 import re
 from decimal import Decimal
 from json import loads
+from unittest import mock
 
 from django.conf import settings
 from django.core import mail
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils.timezone import now
 from pytz import timezone
 from tests.base import SoupTest
@@ -16,6 +17,7 @@ from pretix.base.models import (
     User, WaitingListEntry,
 )
 from pretix.base.models.items import SubEventItem, SubEventItemVariation
+from pretix.presale.views.event import get_grouped_items
 
 
 class EventTestMixin:
@@ -138,6 +140,27 @@ class ItemDisplayTest(EventTestMixin, SoupTest):
         self.assertIn("Entry tickets", doc.select("section:nth-of-type(1) h3")[0].text)
         self.assertIn("Early-bird", doc.select("section:nth-of-type(1) div:nth-of-type(1)")[0].text)
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_product_list_snapshot(self):
+        q = Quota.objects.create(event=self.event, name='Quota', size=2)
+        item = Item.objects.create(event=self.event, name='Early-bird ticket', default_price=0)
+        q.items.add(item)
+        items, display_add_to_cart = get_grouped_items(self.event)
+        self.assertEqual([i.pk for i in items], [item.pk])
+        with self.assertNumQueries(0):
+            items, display_add_to_cart = get_grouped_items(self.event)
+        self.assertEqual([i.pk for i in items], [item.pk])
+        self.assertTrue(display_add_to_cart)
+
+        item2 = Item.objects.create(event=self.event, name='Late-bird ticket', default_price=0,
+                                    available_from=now() + datetime.timedelta(days=2))
+        q.items.add(item2)
+        items, display_add_to_cart = get_grouped_items(self.event)
+        self.assertEqual([i.pk for i in items], [item.pk])
+        with mock.patch('pretix.presale.views.event.now', return_value=now() + datetime.timedelta(days=3)):
+            items, display_add_to_cart = get_grouped_items(self.event)
+            self.assertEqual([i.pk for i in items], [item.pk, item2.pk])
+
     def test_simple_without_quota(self):
         c = ItemCategory.objects.create(event=self.event, name="Entry tickets", position=0)
         Item.objects.create(event=self.event, name='Early-bird ticket', category=c, default_price=0)